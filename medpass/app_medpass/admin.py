@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Especialidade, Profissional, Senha, Guiche
+from .models import Especialidade, Profissional, Senha, Guiche, SenhaHistorico
 
 # Register your models here.
 
@@ -64,6 +64,7 @@ class ProfissionalAdmin(admin.ModelAdmin):
 @admin.register(Senha)
 class SenhaAdmin(admin.ModelAdmin):
     list_display = ['numero', 'tipo', 'especialidade', 'status', 'nome_paciente', 'guiche', 'profissional', 'criado_em']
+    list_select_related = ['especialidade', 'guiche', 'profissional']
     list_filter = ['status', 'tipo', 'especialidade', 'criado_em']
     search_fields = ['numero', 'nome_paciente']
     readonly_fields = [
@@ -95,3 +96,18 @@ class SenhaAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+
+
+@admin.register(SenhaHistorico)
+class SenhaHistoricoAdmin(admin.ModelAdmin):
+    """Senhas arquivadas: somente consulta"""
+    list_display = ['numero', 'tipo', 'especialidade', 'status', 'nome_paciente', 'criado_em', 'concluido_em']
+    list_filter = ['mes', 'status', 'tipo', 'especialidade']
+    search_fields = ['numero', 'nome_paciente']
+    date_hierarchy = 'criado_em'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -1,15 +1,38 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.utils import timezone
-from datetime import date
+from django.db.models.functions import Coalesce
+from django.http import Http404, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter, OpenApiExample
 from drf_spectacular.types import OpenApiTypes
-from .models import Especialidade, Profissional, Senha, Guiche
+from .models import Especialidade, Profissional, Senha, SenhaHistorico, Guiche, filtro_do_dia
+from .condicional import etag_fila
+from .estatisticas import agrupamentos_do_parametro, calcular_estatisticas, dados_da_api
+from .estimativas import obter_estimativas
+from .exportacao import FORMATOS, exportar, senhas_para_exportar
+from .filas import ETAPAS, FilaSenhas, MesaOcupada, chamar_proxima_guiche, chamar_proxima_medico
+from .transicoes import (
+    MOTIVOS_CANCELAMENTO,
+    TransicaoInvalida,
+    transicionar,
+    cancelar_aguardando,
+    encerrar_chamadas_antigas,
+    redistribuir_guiche,
+    redistribuir_medico,
+)
+from .paginacao import PaginacaoKeyset
+from . import resumos
+from .painel import dados_painel, etag_quadro, obter_quadro
+from .roteamento import banco_de_leitura, somente_leitura
 from .serializers import (
     EspecialidadeSerializer, 
     ProfissionalSerializer, 
     SenhaSerializer,
+    SenhaSerializerRapido,
     SenhaCreateSerializer,
     SenhaChamarSerializer,
     SenhaStatusSerializer,
@@ -188,10 +211,50 @@ class ProfissionalViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
+def _especialidade_do_parametro(request):
+    """especialidade_id da query string como int (None se ausente); 400 se não for numérico"""
+    especialidade_id = request.query_params.get('especialidade_id')
+    if especialidade_id and not especialidade_id.isdigit():
+        raise ValidationError({'especialidade_id': 'Deve ser um número'})
+    return int(especialidade_id) if especialidade_id else None
+
+
+def _fila_aguardando_medico(request):
+    # Valida antes do ETag: a chave da versão não pode vir do que o cliente mandar
+    especialidade_id = _especialidade_do_parametro(request)
+    return f'aguardando_medico:{especialidade_id}' if especialidade_id else 'aguardando_medico'
+
+
+def _fila_proxima(request):
+    if request.query_params.get('etapa') == 'medico':
+        return _fila_aguardando_medico(request)
+    return 'aguardando_guiche'
+
+
+def _filtros_de_periodo(request):
+    """inicio, fim (datas) e especialidade_id validados dos parâmetros da URL"""
+    filtros = {}
+    for nome in ('inicio', 'fim'):
+        valor = request.query_params.get(nome)
+        try:
+            filtros[nome] = parse_date(valor) if valor else None
+        except ValueError:
+            filtros[nome] = None
+        if valor and filtros[nome] is None:
+            raise ValidationError({nome: 'Data inválida (use AAAA-MM-DD)'})
+    
+    especialidade_id = request.query_params.get('especialidade_id')
+    if especialidade_id and not especialidade_id.isdigit():
+        raise ValidationError({'especialidade_id': 'Deve ser um número'})
+    filtros['especialidade_id'] = especialidade_id
+    return filtros
+
+
 @extend_schema_view(
     list=extend_schema(
         summary="Listar Senhas",
-        description="Retorna a lista de todas as senhas do sistema.",
+        description="Retorna a lista das senhas do dia e das ainda em andamento. As senhas "
+                    "finalizadas de dias anteriores ficam no histórico (ver /exportar/).",
         tags=['Senhas']
     ),
     create=extend_schema(
@@ -201,7 +264,7 @@ class ProfissionalViewSet(viewsets.ModelViewSet):
     ),
     retrieve=extend_schema(
         summary="Obter Senha",
-        description="Retorna os detalhes de uma senha específica.",
+        description="Retorna os detalhes de uma senha específica, inclusive já arquivada.",
         tags=['Senhas']
     ),
     update=extend_schema(
@@ -234,74 +297,237 @@ class SenhaViewSet(viewsets.ModelViewSet):
     7. Consulta finalizada (concluido)
     """
     queryset = Senha.objects.all().select_related('especialidade', 'guiche', 'profissional')
+    pagination_class = PaginacaoKeyset
     
     def get_serializer_class(self):
         if self.action == 'create':
             return SenhaCreateSerializer
         return SenhaSerializer
     
+    def _listar(self, senhas):
+        """Página (keyset) de `senhas` pelo serializador rápido; a chave é o order_by"""
+        page = self.paginate_queryset(SenhaSerializerRapido.valores(senhas))
+        return self.get_paginated_response(SenhaSerializerRapido(page).data)
+    
+    @method_decorator(somente_leitura)
+    def list(self, request, *args, **kwargs):
+        """
+        Lista paginada usando o serializador rápido (mesmo JSON de SenhaSerializer).
+        Lê só a tabela Senha: o histórico arquivado sai por exportar().
+        """
+        return self._listar(self.filter_queryset(self.get_queryset()))
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Senha pelo id; as já arquivadas vêm de SenhaHistorico (ver arquivamento.py)"""
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            if not str(kwargs.get('pk')).isdigit():
+                raise
+            arquivada = SenhaSerializerRapido.valores(SenhaHistorico.objects.filter(pk=kwargs['pk'])).first()
+            if arquivada is None:
+                raise
+            return Response(SenhaSerializerRapido([arquivada]).data[0])
+    
+    def _transicionar(self, transicao, erro, **dados):
+        """Aplica a transição à senha da URL (UPDATE condicional, ver transicoes.py)"""
+        try:
+            senha = transicionar(self.get_object(), transicao, **dados)
+        except TransicaoInvalida:
+            return Response({'error': erro}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(SenhaSerializer(senha).data)
+    
     # =====================
     # Consultas de Status
     # =====================
     
     @extend_schema(summary="Senhas Aguardando Guichê", tags=['Senhas'])
+    @method_decorator(somente_leitura(versionada=True))
+    @method_decorator(condition(etag_func=etag_fila('aguardando_guiche')))
     @action(detail=False, methods=['get'])
     def aguardando_guiche(self, request):
         """Retorna senhas aguardando triagem no guichê"""
         senhas = self.queryset.filter(status='aguardando_guiche').order_by('criado_em')
-        serializer = self.get_serializer(senhas, many=True)
-        return Response(serializer.data)
+        return self._listar(senhas)
     
     @extend_schema(summary="Senhas Aguardando Médico", tags=['Senhas'])
+    @method_decorator(somente_leitura(versionada=True))
+    @method_decorator(condition(etag_func=etag_fila(_fila_aguardando_medico)))
     @action(detail=False, methods=['get'])
     def aguardando_medico(self, request):
         """Retorna senhas aguardando consulta médica"""
-        especialidade_id = request.query_params.get('especialidade_id')
+        especialidade_id = _especialidade_do_parametro(request)
         senhas = self.queryset.filter(status='aguardando_medico')
         if especialidade_id:
             senhas = senhas.filter(especialidade_id=especialidade_id)
         senhas = senhas.order_by('triagem_finalizada_em')
-        serializer = self.get_serializer(senhas, many=True)
-        return Response(serializer.data)
+        return self._listar(senhas)
     
+    @extend_schema(
+        summary="Próxima Senha da Fila",
+        description="Retorna a próxima senha a ser chamada (prioridade com envelhecimento), sem retirá-la da fila.",
+        parameters=[
+            OpenApiParameter(name='etapa', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY,
+                             enum=tuple(ETAPAS), description='guiche (padrão) ou medico', required=False),
+            OpenApiParameter(name='especialidade_id', type=OpenApiTypes.INT, location=OpenApiParameter.QUERY,
+                             required=False),
+        ],
+        tags=['Senhas']
+    )
+    @method_decorator(somente_leitura(versionada=True))
+    @method_decorator(condition(etag_func=etag_fila(_fila_proxima)))
+    @action(detail=False, methods=['get'])
+    def proxima(self, request):
+        """Retorna a senha no topo da fila da etapa (uma leitura indexada)"""
+        etapa = request.query_params.get('etapa', 'guiche')
+        if etapa not in ETAPAS:
+            raise ValidationError({'etapa': f'Use um de: {", ".join(ETAPAS)}'})
+        senha = FilaSenhas(etapa, _especialidade_do_parametro(request)).espiar()
+        if senha is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(SenhaSerializer(senha).data)
+    
+    @extend_schema(
+        summary="Estimativa de Espera",
+        description=(
+            "Tempo de espera recente da fila (p50 e p90, em segundos), calculado em memória a partir "
+            "das últimas chamadas. Sem chamadas recentes da especialidade, usa a etapa inteira "
+            "(especialidade_id nulo na resposta); sem nenhuma, p50 e p90 são nulos."
+        ),
+        parameters=[
+            OpenApiParameter(name='etapa', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY,
+                             enum=tuple(ETAPAS), description='guiche (padrão) ou medico', required=False),
+            OpenApiParameter(name='especialidade_id', type=OpenApiTypes.INT, location=OpenApiParameter.QUERY,
+                             required=False),
+        ],
+        tags=['Senhas']
+    )
+    @action(detail=False, methods=['get'])
+    def estimativa_espera(self, request):
+        """Retorna p50/p90 da espera recente e o tamanho atual da fila"""
+        etapa = request.query_params.get('etapa', 'guiche')
+        if etapa not in ETAPAS:
+            raise ValidationError({'etapa': f'Use um de: {", ".join(ETAPAS)}'})
+        especialidade_id = _especialidade_do_parametro(request)
+        
+        estimativa = obter_estimativas().estimativa(etapa, especialidade_id)
+        estimativa['na_fila'] = len(FilaSenhas(etapa, especialidade_id))
+        return Response(estimativa)
+    
+    @method_decorator(somente_leitura(versionada=True))
+    @method_decorator(condition(etag_func=etag_fila('em_atendimento')))
     @action(detail=False, methods=['get'])
     def em_atendimento(self, request):
         """Retorna senhas em atendimento (triagem ou consulta)"""
+        # Mais recentes primeiro pela última chamada (médico, se já houve)
         senhas = self.queryset.filter(
             status__in=['chamando_guiche', 'em_triagem', 'chamando_medico', 'em_consulta']
-        ).order_by('-chamado_guiche_em', '-chamado_medico_em')
-        serializer = self.get_serializer(senhas, many=True)
-        return Response(serializer.data)
+        ).annotate(chamado_em=Coalesce('chamado_medico_em', 'chamado_guiche_em')).order_by('-chamado_em')
+        return self._listar(senhas)
     
+    @method_decorator(somente_leitura(versionada=True))
+    @method_decorator(condition(etag_func=etag_fila('finalizadas')))
     @action(detail=False, methods=['get'])
     def finalizadas(self, request):
-        """Retorna senhas finalizadas"""
+        """Retorna senhas finalizadas ainda não arquivadas (o dia corrente)"""
         senhas = self.queryset.filter(status='concluido').order_by('-concluido_em')
-        serializer = self.get_serializer(senhas, many=True)
-        return Response(serializer.data)
+        return self._listar(senhas)
     
+    @method_decorator(somente_leitura(versionada=True))
+    @method_decorator(condition(etag_func=etag_fila('hoje')))
     @action(detail=False, methods=['get'])
     def hoje(self, request):
         """Retorna senhas geradas hoje"""
-        hoje = date.today()
-        senhas = self.queryset.filter(criado_em__date=hoje).order_by('-criado_em')
-        serializer = self.get_serializer(senhas, many=True)
-        return Response(serializer.data)
+        senhas = self.queryset.filter(filtro_do_dia('criado_em')).order_by('-criado_em')
+        return self._listar(senhas)
     
+    @extend_schema(
+        summary="Estatísticas das Senhas",
+        parameters=[
+            OpenApiParameter(
+                name='agrupar_por',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description='Quebra opcional dos contadores: especialidade, tipo ou especialidade,tipo',
+                required=False
+            ),
+        ],
+        tags=['Senhas']
+    )
+    @method_decorator(somente_leitura(versionada=True))
+    @method_decorator(condition(etag_func=etag_fila('hoje')))
     @action(detail=False, methods=['get'])
     def estatisticas(self, request):
-        """Retorna estatísticas das senhas"""
-        hoje = date.today()
-        
-        return Response({
-            'total_hoje': self.queryset.filter(criado_em__date=hoje).count(),
-            'aguardando_guiche': self.queryset.filter(status='aguardando_guiche').count(),
-            'em_triagem': self.queryset.filter(status__in=['chamando_guiche', 'em_triagem']).count(),
-            'aguardando_medico': self.queryset.filter(status='aguardando_medico').count(),
-            'em_consulta': self.queryset.filter(status__in=['chamando_medico', 'em_consulta']).count(),
-            'finalizadas_hoje': self.queryset.filter(status='concluido', concluido_em__date=hoje).count(),
-            'data': hoje.isoformat()
-        })
+        """Retorna estatísticas das senhas (uma única consulta agregada)"""
+        agrupar_por = agrupamentos_do_parametro(request.query_params.get('agrupar_por'))
+        return Response(dados_da_api(calcular_estatisticas(agrupar_por=agrupar_por)))
+    
+    @extend_schema(
+        summary="Exportar Senhas",
+        description="Exporta o histórico de senhas em fluxo (NDJSON ou CSV), sem paginação.",
+        parameters=[
+            OpenApiParameter(name='formato', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY,
+                             enum=tuple(FORMATOS), description='ndjson (padrão) ou csv', required=False),
+            OpenApiParameter(name='inicio', type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY,
+                             description='Primeiro dia de emissão (inclusive)', required=False),
+            OpenApiParameter(name='fim', type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY,
+                             description='Último dia de emissão (inclusive)', required=False),
+            OpenApiParameter(name='especialidade_id', type=OpenApiTypes.INT, location=OpenApiParameter.QUERY,
+                             required=False),
+        ],
+        responses={(200, 'application/x-ndjson'): OpenApiTypes.STR, (200, 'text/csv'): OpenApiTypes.STR},
+        tags=['Senhas']
+    )
+    @method_decorator(somente_leitura)
+    @action(detail=False, methods=['get'])
+    def exportar(self, request):
+        """Exporta as senhas em fluxo, lendo o banco em lotes"""
+        formato = request.query_params.get('formato', 'ndjson')
+        if formato not in FORMATOS:
+            raise ValidationError({'formato': f'Use um de: {", ".join(FORMATOS)}'})
+        
+        # O fluxo é lido depois que a view retorna: o banco é escolhido agora
+        senhas = senhas_para_exportar(**_filtros_de_periodo(request)).using(banco_de_leitura())
+        resposta = StreamingHttpResponse(exportar(formato, senhas), content_type=FORMATOS[formato])
+        resposta['Content-Disposition'] = f'attachment; filename="senhas.{formato}"'
+        return resposta
+    
+    @extend_schema(
+        summary="Resumos Diários",
+        description=(
+            "Contadores (emitidas, concluídas, canceladas, desistências) e tempos "
+            "(quantidade, média, p50 e p90 em segundos) de espera no guichê, triagem, "
+            "espera pelo médico e consulta, lidos dos resumos pré-calculados."
+        ),
+        parameters=[
+            OpenApiParameter(name='inicio', type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY,
+                             description='Primeiro dia (padrão: 30 dias antes do fim)', required=False),
+            OpenApiParameter(name='fim', type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY,
+                             description='Último dia (padrão: hoje)', required=False),
+            OpenApiParameter(name='especialidade_id', type=OpenApiTypes.INT, location=OpenApiParameter.QUERY,
+                             required=False),
+            OpenApiParameter(name='tipo', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY,
+                             enum=[tipo for tipo, _ in Senha.TIPO_CHOICES], required=False),
+            OpenApiParameter(name='agrupar_por', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY,
+                             description='Campos do grupo: data, especialidade, tipo (padrão: os três; vazio soma o período)',
+                             required=False),
+        ],
+        tags=['Senhas']
+    )
+    @method_decorator(somente_leitura)
+    @action(detail=False, methods=['get'])
+    def resumos(self, request):
+        """Retorna os resumos diários do período, combinados conforme agrupar_por"""
+        filtros = _filtros_de_periodo(request)
+        tipo = request.query_params.get('tipo')
+        if tipo and tipo not in dict(Senha.TIPO_CHOICES):
+            raise ValidationError({'tipo': 'Tipo inválido'})
+        agrupar_por = request.query_params.get('agrupar_por')
+        if agrupar_por is None:
+            agrupar_por = resumos.AGRUPAMENTOS
+        else:
+            agrupar_por = [nome for nome in agrupar_por.split(',') if nome in resumos.AGRUPAMENTOS]
+        return Response(resumos.consultar(tipo=tipo, agrupar_por=agrupar_por, **filtros))
     
     # =====================
     # Ações do Guichê
@@ -310,64 +536,61 @@ class SenhaViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def chamar_guiche(self, request, pk=None):
         """Guichê chama uma senha para triagem"""
-        senha = self.get_object()
-        
-        if senha.status != 'aguardando_guiche':
-            return Response(
-                {'error': 'Senha não está aguardando guichê'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
+        dados = {}
         guiche_id = request.data.get('guiche_id')
         if guiche_id:
             try:
-                guiche = Guiche.objects.get(id=guiche_id)
-                senha.guiche = guiche
+                dados['guiche'] = Guiche.objects.get(id=guiche_id)
             except Guiche.DoesNotExist:
                 pass
         
-        senha.status = 'chamando_guiche'
-        senha.chamado_guiche_em = timezone.now()
-        senha.save()
-        
-        return Response(SenhaSerializer(senha).data)
+        return self._transicionar('chamar_guiche', 'Senha não está aguardando guichê', **dados)
     
-    @action(detail=True, methods=['post'])
-    def iniciar_triagem(self, request, pk=None):
-        """Inicia a triagem no guichê"""
-        senha = self.get_object()
-        
-        if senha.status != 'chamando_guiche':
+    @extend_schema(
+        summary="Guichê Chama a Próxima Senha",
+        description="Reserva atomicamente a próxima senha da fila de triagem para o guichê. "
+                    "Retorna 204 se a fila estiver vazia.",
+        request={'application/json': {'type': 'object', 'properties': {'guiche_id': {'type': 'integer'}}}},
+        tags=['Senhas']
+    )
+    @action(detail=False, methods=['post'])
+    def chamar_proxima_guiche(self, request):
+        """Guichê chama a próxima senha da fila (sem colisão entre guichês)"""
+        guiche_id = str(request.data.get('guiche_id', ''))
+        guiche = Guiche.objects.filter(id=guiche_id).first() if guiche_id.isdigit() else None
+        if not guiche:
             return Response(
-                {'error': 'Senha não está sendo chamada no guichê'},
+                {'error': 'guiche_id inválido'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        senha.status = 'em_triagem'
-        senha.triagem_iniciada_em = timezone.now()
-        senha.save()
-        
+        try:
+            senha = chamar_proxima_guiche(guiche)
+        except MesaOcupada:
+            return Response(
+                {'error': 'O guichê já está atendendo uma senha'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if senha is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(SenhaSerializer(senha).data)
     
+    @action(detail=True, methods=['post'])
+    def iniciar_triagem(self, request, pk=None):
+        """Inicia a triagem no guichê"""
+        return self._transicionar('iniciar_triagem', 'Senha não está sendo chamada no guichê')
+    
     @action(detail=True, methods=['post'])
     def finalizar_triagem(self, request, pk=None):
         """Finaliza a triagem e envia para o médico"""
-        senha = self.get_object()
-        
-        if senha.status != 'em_triagem':
-            return Response(
-                {'error': 'Senha não está em triagem'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
         # Atualiza dados do paciente se fornecidos
-        senha.nome_paciente = request.data.get('nome_paciente', senha.nome_paciente)
-        senha.observacoes_triagem = request.data.get('observacoes', senha.observacoes_triagem)
-        senha.status = 'aguardando_medico'
-        senha.triagem_finalizada_em = timezone.now()
-        senha.save()
+        dados = {}
+        if 'nome_paciente' in request.data:
+            dados['nome_paciente'] = request.data['nome_paciente']
+        if 'observacoes' in request.data:
+            dados['observacoes_triagem'] = request.data['observacoes']
         
-        return Response(SenhaSerializer(senha).data)
+        return self._transicionar('finalizar_triagem', 'Senha não está em triagem', **dados)
     
     # =====================
     # Ações do Médico
@@ -376,61 +599,54 @@ class SenhaViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def chamar_medico(self, request, pk=None):
         """Médico chama o paciente para consulta"""
-        senha = self.get_object()
-        
-        if senha.status != 'aguardando_medico':
-            return Response(
-                {'error': 'Paciente não está aguardando médico'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
+        dados = {}
         profissional_id = request.data.get('profissional_id')
         if profissional_id:
             try:
-                profissional = Profissional.objects.get(id=profissional_id)
-                senha.profissional = profissional
+                dados['profissional'] = Profissional.objects.get(id=profissional_id)
             except Profissional.DoesNotExist:
                 pass
         
-        senha.status = 'chamando_medico'
-        senha.chamado_medico_em = timezone.now()
-        senha.save()
-        
-        return Response(SenhaSerializer(senha).data)
+        return self._transicionar('chamar_medico', 'Paciente não está aguardando médico', **dados)
     
-    @action(detail=True, methods=['post'])
-    def iniciar_consulta(self, request, pk=None):
-        """Inicia a consulta médica"""
-        senha = self.get_object()
-        
-        if senha.status != 'chamando_medico':
+    @extend_schema(
+        summary="Médico Chama o Próximo Paciente",
+        description="Reserva atomicamente o próximo paciente da especialidade do médico. "
+                    "Retorna 204 se a fila estiver vazia.",
+        request={'application/json': {'type': 'object', 'properties': {'profissional_id': {'type': 'integer'}}}},
+        tags=['Senhas']
+    )
+    @action(detail=False, methods=['post'])
+    def chamar_proxima_medico(self, request):
+        """Médico chama o próximo paciente da fila (sem colisão entre médicos)"""
+        profissional_id = str(request.data.get('profissional_id', ''))
+        profissional = Profissional.objects.filter(id=profissional_id).first() if profissional_id.isdigit() else None
+        if not profissional:
             return Response(
-                {'error': 'Paciente não está sendo chamado'},
+                {'error': 'profissional_id inválido'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        senha.status = 'em_consulta'
-        senha.consulta_iniciada_em = timezone.now()
-        senha.save()
-        
+        try:
+            senha = chamar_proxima_medico(profissional)
+        except MesaOcupada:
+            return Response(
+                {'error': 'O médico já está atendendo um paciente'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if senha is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(SenhaSerializer(senha).data)
     
+    @action(detail=True, methods=['post'])
+    def iniciar_consulta(self, request, pk=None):
+        """Inicia a consulta médica"""
+        return self._transicionar('iniciar_consulta', 'Paciente não está sendo chamado')
+    
     @action(detail=True, methods=['post'])
     def finalizar_consulta(self, request, pk=None):
         """Finaliza a consulta médica"""
-        senha = self.get_object()
-        
-        if senha.status != 'em_consulta':
-            return Response(
-                {'error': 'Paciente não está em consulta'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        senha.status = 'concluido'
-        senha.concluido_em = timezone.now()
-        senha.save()
-        
-        return Response(SenhaSerializer(senha).data)
+        return self._transicionar('finalizar_consulta', 'Paciente não está em consulta')
     
     # =====================
     # Ações Gerais
@@ -439,79 +655,103 @@ class SenhaViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def cancelar(self, request, pk=None):
         """Cancela uma senha"""
-        senha = self.get_object()
-        
-        if senha.status == 'concluido':
-            return Response(
-                {'error': 'Senha já foi finalizada'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        senha.status = 'cancelado'
-        senha.concluido_em = timezone.now()
-        senha.save()
-        
-        return Response(SenhaSerializer(senha).data)
+        return self._transicionar('cancelar', 'Senha já foi finalizada')
     
     @action(detail=True, methods=['post'])
     def desistencia(self, request, pk=None):
         """Marca a senha como desistência"""
-        senha = self.get_object()
-        
-        if senha.status == 'concluido':
+        return self._transicionar('desistencia', 'Senha já foi finalizada')
+    
+    # =====================
+    # Operações em Lote
+    # =====================
+    
+    @extend_schema(
+        summary="Cancelar Fila da Especialidade",
+        description="Cancela (ou marca desistência de) todas as senhas em espera da especialidade, "
+                    "num único UPDATE. motivo: cancelado (padrão) ou desistencia.",
+        request={'application/json': {'type': 'object', 'properties': {
+            'especialidade_id': {'type': 'integer'},
+            'motivo': {'type': 'string', 'enum': tuple(MOTIVOS_CANCELAMENTO), 'default': 'cancelado'},
+        }, 'required': ['especialidade_id']}},
+        tags=['Senhas']
+    )
+    @action(detail=False, methods=['post'])
+    def lote_cancelar_aguardando(self, request):
+        """Cancela todas as senhas aguardando de uma especialidade"""
+        especialidade_id = str(request.data.get('especialidade_id', ''))
+        especialidade = Especialidade.objects.filter(id=especialidade_id).first() if especialidade_id.isdigit() else None
+        if not especialidade:
+            return Response(
+                {'error': 'especialidade_id inválido'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        motivo = request.data.get('motivo', 'cancelado')
+        if motivo not in MOTIVOS_CANCELAMENTO:
             return Response(
-                {'error': 'Senha já foi finalizada'},
+                {'error': f'motivo deve ser um de: {", ".join(MOTIVOS_CANCELAMENTO)}'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        senha.status = 'desistencia'
-        senha.concluido_em = timezone.now()
-        senha.save()
+        alteradas = cancelar_aguardando(especialidade.id, motivo)
+        return Response({'alteradas': alteradas})
+    
+    @extend_schema(
+        summary="Encerrar Chamadas Antigas",
+        description="Marca como desistência as senhas em 'chamando_guiche' ou 'chamando_medico' "
+                    "chamadas há mais de N minutos.",
+        request={'application/json': {'type': 'object', 'properties': {
+            'minutos': {'type': 'integer', 'default': 15},
+        }}},
+        tags=['Senhas']
+    )
+    @action(detail=False, methods=['post'])
+    def lote_encerrar_chamadas(self, request):
+        """Encerra chamadas sem comparecimento há mais de N minutos"""
+        try:
+            minutos = int(request.data.get('minutos', 15))
+        except (TypeError, ValueError):
+            minutos = -1
+        if minutos < 0:
+            return Response(
+                {'error': 'minutos deve ser um inteiro não negativo'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        return Response(SenhaSerializer(senha).data)
+        return Response({'alteradas': encerrar_chamadas_antigas(minutos)})
     
+    @extend_schema(
+        summary="Redistribuir Atendimentos",
+        description="Devolve à fila, com a prioridade original, as senhas em atendimento num guichê "
+                    "ou com um profissional (ex.: desativado no meio do expediente).",
+        request={'application/json': {'type': 'object', 'properties': {
+            'guiche_id': {'type': 'integer'},
+            'profissional_id': {'type': 'integer'},
+        }}},
+        tags=['Senhas']
+    )
+    @action(detail=False, methods=['post'])
+    def lote_redistribuir(self, request):
+        """Devolve à fila as senhas de um guichê ou profissional"""
+        guiche_id = str(request.data.get('guiche_id') or '')
+        profissional_id = str(request.data.get('profissional_id') or '')
+        if guiche_id:
+            guiche = Guiche.objects.filter(id=guiche_id).first() if guiche_id.isdigit() else None
+            if guiche:
+                return Response({'alteradas': redistribuir_guiche(guiche)})
+        elif profissional_id:
+            profissional = Profissional.objects.filter(id=profissional_id).first() if profissional_id.isdigit() else None
+            if profissional:
+                return Response({'alteradas': redistribuir_medico(profissional)})
+
+        return Response(
+            {'error': 'Informe um guiche_id ou profissional_id válido'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    @method_decorator(somente_leitura(versionada=True))
+    @method_decorator(condition(etag_func=etag_quadro))
     @action(detail=False, methods=['get'])
     def painel(self, request):
-        """Retorna dados para o painel de senhas"""
-        hoje = date.today()
-        
-        # Senhas sendo chamadas
-        senha_chamando_guiche = self.queryset.filter(
-            status='chamando_guiche'
-        ).order_by('-chamado_guiche_em').first()
-        
-        senha_chamando_medico = self.queryset.filter(
-            status='chamando_medico'
-        ).order_by('-chamado_medico_em').first()
-        
-        # Últimas senhas chamadas
-        ultimas_chamadas = self.queryset.filter(
-            status__in=['em_triagem', 'em_consulta', 'concluido'],
-        ).order_by('-chamado_guiche_em', '-chamado_medico_em')[:5]
-        
-        # Senhas aguardando
-        senhas_aguardando_guiche = self.queryset.filter(
-            status='aguardando_guiche'
-        ).order_by('criado_em')[:10]
-        
-        senhas_aguardando_medico = self.queryset.filter(
-            status='aguardando_medico'
-        ).order_by('triagem_finalizada_em')[:10]
-        
-        # Estatísticas
-        total_hoje = self.queryset.filter(criado_em__date=hoje).count()
-        total_atendidas = self.queryset.filter(status='concluido', concluido_em__date=hoje).count()
-        
-        return Response({
-            'senha_chamando_guiche': SenhaSerializer(senha_chamando_guiche).data if senha_chamando_guiche else None,
-            'senha_chamando_medico': SenhaSerializer(senha_chamando_medico).data if senha_chamando_medico else None,
-            'ultimas_chamadas': SenhaSerializer(ultimas_chamadas, many=True).data,
-            'senhas_aguardando_guiche': SenhaSerializer(senhas_aguardando_guiche, many=True).data,
-            'senhas_aguardando_medico': SenhaSerializer(senhas_aguardando_medico, many=True).data,
-            'estatisticas': {
-                'total_hoje': total_hoje,
-                'total_atendidas': total_atendidas,
-                'aguardando_guiche': self.queryset.filter(status='aguardando_guiche').count(),
-                'aguardando_medico': self.queryset.filter(status='aguardando_medico').count(),
-            }
-        })
+        """Retorna dados para o painel de senhas (servido pelo quadro pré-calculado)"""
+        return Response(dados_painel(obter_quadro()))
@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class AppMedpassConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app_medpass'
+
+    def ready(self):
+        from django.db import connections
+
+        from . import signals  # noqa: F401
+        from .consultas import instrumentar
+        from .estimativas import obter_estimativas
+        from .metricas import obter_metricas_senhas
+        from .roteamento import acompanhar_escritas
+        # Assina o barramento já na inicialização, para não perder chamadas
+        estimativas = obter_estimativas()
+        acompanhar_escritas(estimativas.barramento)
+        obter_metricas_senhas()
+        # As conexões novas são instrumentadas pelo sinal connection_created
+        for conexao in connections.all(initialized_only=True):
+            instrumentar(None, conexao)
@@ -0,0 +1,134 @@
+"""
+Arquivamento das senhas finalizadas de dias anteriores em SenhaHistorico.
+
+A tabela Senha fica só com o dia corrente (e o que ainda está em andamento):
+as senhas concluídas, canceladas ou desistentes de dias anteriores são
+copiadas para SenhaHistorico e apagadas de Senha em lotes, cada lote numa
+transação curta (INSERT ... + DELETE ... WHERE id IN (...)), para não segurar
+o banco enquanto os totens emitem senhas. Só é apagado de Senha o que foi
+copiado no mesmo lote: um id que já existe em SenhaHistorico fica em Senha
+(com um aviso no log) em vez de sumir das duas tabelas.
+
+O DELETE é feito direto em SQL: queryset.delete() dispararia post_delete para
+cada senha e o barramento receberia milhares de eventos 'removida'. No lugar
+deles sai um único evento 'arquivamento'.
+
+Roda pelo comando `arquivar_senhas` (cron) ou, com
+MEDPASS_ARQUIVAMENTO['AO_VIRAR_O_DIA'], em segundo plano quando a primeira
+senha do dia é emitida (ver signals.py).
+"""
+import logging
+import threading
+from datetime import datetime, time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .eventos import publicar_apos_commit
+from .models import Senha, SenhaHistorico
+
+logger = logging.getLogger(__name__)
+
+STATUS_FINALIZADOS = ('concluido', 'cancelado', 'desistencia')
+
+# Colunas copiadas (a prioridade só vale enquanto a senha está numa fila)
+CAMPOS = tuple(
+    campo.attname for campo in Senha._meta.concrete_fields if campo.name != 'prioridade'
+)
+
+TAMANHO_LOTE = 1000
+
+
+def mes_de(momento):
+    """Chave de partição de SenhaHistorico: primeiro dia do mês (fuso local)"""
+    return timezone.localtime(momento).date().replace(day=1)
+
+
+def senhas_arquivaveis(antes_de=None):
+    """Senhas finalizadas antes do dia `antes_de` (padrão: hoje)"""
+    inicio = timezone.make_aware(datetime.combine(antes_de or timezone.localdate(), time.min))
+    return Senha.objects.filter(status__in=STATUS_FINALIZADOS).filter(
+        Q(concluido_em__lt=inicio) | Q(concluido_em__isnull=True, criado_em__lt=inicio)
+    )
+
+
+def arquivar(antes_de=None, tamanho_lote=TAMANHO_LOTE):
+    """
+    Move para SenhaHistorico as senhas finalizadas antes do dia `antes_de`.
+    Retorna quantas senhas foram arquivadas.
+    """
+    # Percorre por id: as senhas que ficam em Senha não voltam no próximo lote
+    senhas = senhas_arquivaveis(antes_de).order_by('id').values(*CAMPOS)
+    total = ultimo_id = 0
+    while True:
+        with transaction.atomic():
+            linhas = list(senhas.filter(id__gt=ultimo_id)[:tamanho_lote])
+            if not linhas:
+                break
+            ultimo_id = linhas[-1]['id']
+            ids = [linha['id'] for linha in linhas]
+            repetidos = set(SenhaHistorico.objects.filter(id__in=ids).values_list('id', flat=True))
+            novas = [linha for linha in linhas if linha['id'] not in repetidos]
+            # Sem ignore_conflicts: um id inserido por outro arquivamento no meio
+            # do lote desfaz a transação inteira, sem apagar nada
+            SenhaHistorico.objects.bulk_create(
+                [SenhaHistorico(mes=mes_de(linha['criado_em']), **linha) for linha in novas]
+            )
+            _apagar([linha['id'] for linha in novas])
+        if repetidos:
+            logger.warning('Senhas %s já existem em SenhaHistorico; mantidas em Senha', sorted(repetidos))
+        total += len(novas)
+
+    if total:
+        publicar_apos_commit({'evento': 'arquivamento', 'quantidade': total})
+    return total
+
+
+def _apagar(ids):
+    """DELETE sem os sinais de post_delete; só apaga o que continua finalizado"""
+    if not ids:
+        return
+    qn = connection.ops.quote_name
+    marcadores = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {qn(Senha._meta.db_table)} "
+            f"WHERE {qn('id')} IN ({marcadores}) AND {qn('status')} IN (%s, %s, %s)",
+            [*ids, *STATUS_FINALIZADOS],
+        )
+
+
+# Arquivamento automático na virada do dia
+
+_ultimo_dia = None
+_lock = threading.Lock()
+
+
+def agendar_arquivamento(data):
+    """
+    Agenda (após o commit) o arquivamento em segundo plano, uma vez por dia
+    neste processo, se MEDPASS_ARQUIVAMENTO['AO_VIRAR_O_DIA'] estiver ligado.
+    """
+    global _ultimo_dia
+    config = getattr(settings, 'MEDPASS_ARQUIVAMENTO', {})
+    if not config.get('AO_VIRAR_O_DIA'):
+        return
+    with _lock:
+        if _ultimo_dia == data:
+            return
+        _ultimo_dia = data
+
+    tamanho_lote = config.get('LOTE', TAMANHO_LOTE)
+    transaction.on_commit(lambda: threading.Thread(
+        target=_arquivar_em_segundo_plano, args=(data, tamanho_lote), daemon=True,
+    ).start())
+
+
+def _arquivar_em_segundo_plano(data, tamanho_lote):
+    try:
+        arquivar(data, tamanho_lote)
+    finally:
+        # A thread abriu a própria conexão
+        connection.close()
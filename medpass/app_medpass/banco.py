@@ -0,0 +1,47 @@
+"""
+Transações de escrita e erros de concorrência no banco.
+
+No SQLite uma transação comum (DEFERRED) só pede o lock de escrita no primeiro
+UPDATE. Se ela já leu algo (a cabeça da fila, por exemplo) e outro processo
+escreveu nesse meio tempo, o SQLite não pode esperar pelo lock sem quebrar o
+isolamento e falha na hora com "database is locked", ignorando o timeout.
+`transacao_de_escrita` abre a transação com BEGIN IMMEDIATE: o lock é pedido
+antes da primeira leitura, e os escritores concorrentes esperam a vez (até o
+`timeout` do perfil do banco, ver settings.MEDPASS_PERFIS_BANCO) em vez de
+falhar. Nos outros bancos é um transaction.atomic() comum.
+"""
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+# Trechos das mensagens de lock/deadlock (SQLite, PostgreSQL, MySQL)
+MENSAGENS_DE_LOCK = ('locked', 'lock timeout', 'deadlock', 'could not obtain lock')
+
+
+@contextmanager
+def transacao_de_escrita(using=None):
+    """transaction.atomic() que, no SQLite, reserva o lock de escrita já no BEGIN"""
+    conexao = connections[using or DEFAULT_DB_ALIAS]
+    if conexao.vendor != 'sqlite' or conexao.in_atomic_block:
+        # Blocos internos viram savepoints da transação que já existe
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    # O modo é relido das OPTIONS a cada conexão nova: conecta antes de trocá-lo
+    conexao.ensure_connection()
+    modo, conexao.transaction_mode = conexao.transaction_mode, 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=using):
+            # O BEGIN já foi executado; blocos internos são savepoints
+            conexao.transaction_mode = modo
+            yield
+    finally:
+        conexao.transaction_mode = modo
+
+
+def banco_ocupado(erro):
+    """Se o erro é de lock/deadlock (vale tentar de novo), não um defeito"""
+    return isinstance(erro, OperationalError) and any(
+        trecho in str(erro).lower() for trecho in MENSAGENS_DE_LOCK
+    )
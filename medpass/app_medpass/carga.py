@@ -0,0 +1,337 @@
+"""
+Simulação de carga de um dia de atendimento (comando `simular_dia`).
+
+Cada ator roda numa thread e usa as mesmas rotas que as telas:
+
+- totens: POST gerar-senha/ com chegadas de Poisson (taxa total dividida
+  entre os totens), tipos e especialidades sorteados;
+- guichês: chamar-proxima, iniciar-triagem e finalizar-triagem;
+- médicos: chamar-proxima, iniciar-consulta e finalizar-consulta;
+- painéis: GET api/senhas/painel/ (com If-None-Match, como a tela) e
+  api/senha-chamando/.
+
+Os tempos do cenário (chegadas, triagem, consulta, intervalo dos painéis) são
+do dia simulado e são divididos por `acelerar`; as proporções entre leituras
+e escritas se mantêm. Com a mesma semente, cada ator sorteia a mesma sequência.
+
+O cliente local passa pelo handler do Django no próprio processo e conta as
+consultas ao banco de cada requisição; o cliente HTTP mede um servidor em
+execução (sem contagem de consultas).
+"""
+import http.cookiejar
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+
+from django.db import connection
+from django.test import Client
+
+from .consultas import medir_consultas
+from .models import Especialidade, Guiche, Profissional
+
+CENARIO_PADRAO = {
+    'totens': 2,
+    'guiches': 3,
+    'medicos': 4,
+    'paineis': 4,
+    'especialidades': 3,
+    'chegadas_por_hora': 90,
+    'triagem_minutos': 3,
+    'consulta_minutos': 12,
+    'intervalo_painel': 5,
+    'horas': 8,
+    'acelerar': 480,
+}
+
+# Tipo de senha -> peso no sorteio dos totens
+TIPOS = {'N': 70, 'P': 25, 'U': 5}
+
+# Tempos fixos do dia simulado, em segundos
+ATE_INICIAR = 30
+FILA_VAZIA = 20
+
+
+def _percentil(ordenados, q):
+    # Nearest-rank: sempre um valor observado
+    return ordenados[max(math.ceil(q * len(ordenados)) - 1, 0)]
+
+
+class Medicoes:
+    """Latência, status e consultas ao banco de cada requisição, por rota"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tempos = defaultdict(list)
+        self.consultas = defaultdict(list)
+        self.status = defaultdict(Counter)
+
+    def registrar(self, rota, segundos, status, consultas=None):
+        with self._lock:
+            self.tempos[rota].append(segundos)
+            self.status[rota][status] += 1
+            if consultas is not None:
+                self.consultas[rota].append(consultas)
+
+    def relatorio(self, duracao):
+        """Por rota: requisições, erros (5xx), vazão, p50/p99 em ms e consultas por requisição"""
+        resultado = []
+        with self._lock:
+            for rota in sorted(self.tempos):
+                tempos = sorted(self.tempos[rota])
+                consultas = self.consultas[rota]
+                resultado.append({
+                    'rota': rota,
+                    'requisicoes': len(tempos),
+                    'erros': sum(n for status, n in self.status[rota].items() if status >= 500),
+                    'status': dict(sorted(self.status[rota].items())),
+                    'por_segundo': round(len(tempos) / duracao, 2),
+                    'p50_ms': round(_percentil(tempos, 0.5) * 1000, 2),
+                    'p99_ms': round(_percentil(tempos, 0.99) * 1000, 2),
+                    'consultas_media': round(sum(consultas) / len(consultas), 2) if consultas else None,
+                    'consultas_max': max(consultas) if consultas else None,
+                })
+        return resultado
+
+
+class ClienteLocal:
+    """Requisições pelo handler do Django no próprio processo (uma instância por thread)"""
+
+    def __init__(self):
+        self.cliente = Client(raise_request_exception=False)
+
+    def requisitar(self, metodo, caminho, dados=None, cabecalhos=None):
+        """Retorna (status, cabeçalhos, corpo, consultas ao banco)"""
+        with medir_consultas() as registro:
+            resposta = getattr(self.cliente, metodo)(caminho, dados, headers=cabecalhos)
+        return resposta.status_code, resposta.headers, resposta.content, registro.quantidade
+
+    def encerrar(self):
+        connection.close()
+
+
+class _SemRedirecionar(urllib.request.HTTPRedirectHandler):
+    # O redirect do gerar-senha/ é medido como 302, sem carregar a central
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class ClienteHTTP:
+    """Requisições a um servidor em execução em `url`, com o cookie CSRF da central"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.abridor = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), _SemRedirecionar,
+        )
+        self.requisitar('get', '/central-senhas/')
+
+    def _csrf(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+    def requisitar(self, metodo, caminho, dados=None, cabecalhos=None):
+        cabecalhos = dict(cabecalhos or {})
+        corpo = None
+        if metodo == 'post':
+            corpo = urllib.parse.urlencode(dados or {}).encode()
+            cabecalhos['X-CSRFToken'] = self._csrf()
+            cabecalhos['Referer'] = self.url + '/'
+        elif dados:
+            caminho = f'{caminho}?{urllib.parse.urlencode(dados)}'
+        pedido = urllib.request.Request(self.url + caminho, corpo, cabecalhos, method=metodo.upper())
+        try:
+            with self.abridor.open(pedido, timeout=30) as resposta:
+                return resposta.status, resposta.headers, resposta.read(), None
+        except urllib.error.HTTPError as erro:
+            return erro.code, erro.headers, erro.read(), None
+
+    def encerrar(self):
+        pass
+
+    def listar(self, caminho):
+        """Lista de uma rota da API (paginada ou não)"""
+        status, _, corpo, _ = self.requisitar('get', caminho)
+        if status != 200:
+            raise RuntimeError(f'GET {caminho} respondeu {status}')
+        dados = json.loads(corpo)
+        return dados['results'] if isinstance(dados, dict) else dados
+
+
+def preparar_cadastros(especialidades, guiches, medicos):
+    """Cria os cadastros da simulação; retorna os ids (especialidades, guichês, médicos)"""
+    criadas = [
+        Especialidade.objects.create(nome=f'Carga {i}', sigla=f'Q{i}')
+        for i in range(1, especialidades + 1)
+    ]
+    ids_guiches = [
+        Guiche.objects.create(numero=f'CG{i:02d}', nome=f'Guichê de carga {i}').id
+        for i in range(1, guiches + 1)
+    ]
+    ids_medicos = [
+        Profissional.objects.create(
+            nome=f'Médico de carga {i}', crm=f'{9000 + i}', uf_crm='ZZ',
+            especialidade=criadas[i % len(criadas)],
+        ).id
+        for i in range(medicos)
+    ]
+    # Só especialidades com médico: as demais acumulariam fila sem fim
+    com_medico = {criadas[i % len(criadas)].id for i in range(medicos)}
+    return [e.id for e in criadas if e.id in com_medico], ids_guiches, ids_medicos
+
+
+def cadastros_do_servidor(cliente, guiches, medicos):
+    """Ids dos primeiros guichês e médicos ativos de um servidor (modo HTTP)"""
+    ids_guiches = [g['id'] for g in cliente.listar('/api/guiches/') if g.get('ativo', True)][:guiches]
+    escolhidos = [m for m in cliente.listar('/api/profissionais/') if m.get('ativo', True)][:medicos]
+    especialidades = sorted({m['especialidade'] for m in escolhidos})
+    return especialidades, ids_guiches, [m['id'] for m in escolhidos]
+
+
+class Simulacao:
+    """Um dia de atendimento com os atores do cenário; executar() retorna o relatório"""
+
+    def __init__(self, ids_especialidades, ids_guiches, ids_medicos, fabrica_cliente=ClienteLocal,
+                 semente=1, **cenario):
+        self.cenario = {
+            **CENARIO_PADRAO, **cenario,
+            'especialidades': len(ids_especialidades),
+            'guiches': len(ids_guiches),
+            'medicos': len(ids_medicos),
+        }
+        self.especialidades = ids_especialidades
+        self.guiches = ids_guiches
+        self.medicos = ids_medicos
+        self.fabrica_cliente = fabrica_cliente
+        self.semente = semente
+        self.medicoes = Medicoes()
+        self.parar = threading.Event()
+        self.emitidas = 0
+        self.concluidas = 0
+        self._lock = threading.Lock()
+
+    def _esperar(self, segundos_simulados):
+        """Dorme o tempo simulado; False quando a simulação terminou"""
+        return not self.parar.wait(segundos_simulados / self.cenario['acelerar'])
+
+    def _requisitar(self, cliente, rota, metodo, caminho, dados=None, cabecalhos=None):
+        inicio = time.perf_counter()
+        status, cabecalhos_resposta, corpo, consultas = cliente.requisitar(metodo, caminho, dados, cabecalhos)
+        self.medicoes.registrar(rota, time.perf_counter() - inicio, status, consultas)
+        return status, cabecalhos_resposta, corpo
+
+    def _contar(self, atributo):
+        with self._lock:
+            setattr(self, atributo, getattr(self, atributo) + 1)
+
+    def _totem(self, cliente, sorteio):
+        taxa = self.cenario['chegadas_por_hora'] / 3600 / self.cenario['totens']
+        tipos, pesos = zip(*TIPOS.items())
+        while self._esperar(sorteio.expovariate(taxa)):
+            dados = {
+                'especialidade': sorteio.choice(self.especialidades),
+                'tipo': sorteio.choices(tipos, pesos)[0],
+            }
+            status, _, _ = self._requisitar(cliente, 'gerar-senha/', 'post', '/gerar-senha/', dados)
+            if status < 400:
+                self._contar('emitidas')
+
+    def _atendente(self, cliente, sorteio, etapa, parametro, atendente_id, acoes, minutos):
+        # Como as telas: cada ação já traz os trechos do painel redesenhados
+        redesenhar = {'fragmentos': '1'}
+        while not self.parar.is_set():
+            status, _, corpo = self._requisitar(
+                cliente, f'{etapa}/chamar-proxima/', 'post',
+                f'/{etapa}/chamar-proxima/?{parametro}={atendente_id}', redesenhar,
+            )
+            if status != 200:
+                # Fila vazia (404) ou atendimento anterior pendente
+                self._esperar(FILA_VAZIA)
+                continue
+            senha_id = json.loads(corpo)['id']
+            if not self._esperar(ATE_INICIAR):
+                return
+            iniciar, finalizar, dados = acoes
+            self._requisitar(cliente, f'{etapa}/{iniciar}/<id>/', 'post',
+                             f'/{etapa}/{iniciar}/{senha_id}/?{parametro}={atendente_id}', redesenhar)
+            if not self._esperar(sorteio.expovariate(1 / (minutos * 60))):
+                return
+            status, _, _ = self._requisitar(cliente, f'{etapa}/{finalizar}/<id>/', 'post',
+                                            f'/{etapa}/{finalizar}/{senha_id}/', {**(dados or {}), **redesenhar})
+            if etapa == 'medico' and status == 200:
+                self._contar('concluidas')
+
+    def _guiche(self, cliente, sorteio, guiche_id):
+        acoes = ('iniciar-triagem', 'finalizar-triagem', {'nome_paciente': 'Paciente de carga'})
+        self._atendente(cliente, sorteio, 'guiche', 'guiche', guiche_id, acoes,
+                        self.cenario['triagem_minutos'])
+
+    def _medico(self, cliente, sorteio, medico_id):
+        acoes = ('iniciar-consulta', 'finalizar-consulta', None)
+        self._atendente(cliente, sorteio, 'medico', 'medico', medico_id, acoes,
+                        self.cenario['consulta_minutos'])
+
+    def _painel(self, cliente, sorteio):
+        etag = None
+        # Telas ligadas em momentos diferentes não fazem poll juntas
+        if not self._esperar(sorteio.uniform(0, self.cenario['intervalo_painel'])):
+            return
+        while True:
+            status, cabecalhos, _ = self._requisitar(
+                cliente, 'api/senhas/painel/', 'get', '/api/senhas/painel/',
+                cabecalhos={'If-None-Match': etag} if etag else None,
+            )
+            if status == 200:
+                etag = cabecalhos.get('ETag')
+            self._requisitar(cliente, 'api/senha-chamando/', 'get', '/api/senha-chamando/')
+            if not self._esperar(self.cenario['intervalo_painel']):
+                return
+
+    def _rodar(self, indice, ator, *args):
+        sorteio = random.Random(f'{self.semente}-{indice}')
+        cliente = self.fabrica_cliente()
+        try:
+            ator(cliente, sorteio, *args)
+        finally:
+            cliente.encerrar()
+
+    def atores(self):
+        atores = [(self._totem,) for _ in range(self.cenario['totens'])]
+        atores += [(self._guiche, guiche_id) for guiche_id in self.guiches]
+        atores += [(self._medico, medico_id) for medico_id in self.medicos]
+        atores += [(self._painel,) for _ in range(self.cenario['paineis'])]
+        return atores
+
+    @property
+    def duracao(self):
+        """Duração real da simulação em segundos"""
+        return self.cenario['horas'] * 3600 / self.cenario['acelerar']
+
+    def executar(self):
+        threads = [
+            threading.Thread(target=self._rodar, args=(indice, *ator), daemon=True)
+            for indice, ator in enumerate(self.atores())
+        ]
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        self.parar.wait(self.duracao)
+        self.parar.set()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - inicio
+
+        rotas = self.medicoes.relatorio(duracao)
+        return {
+            'cenario': self.cenario,
+            'duracao_segundos': round(duracao, 2),
+            'senhas_emitidas': self.emitidas,
+            'consultas_concluidas': self.concluidas,
+            'requisicoes_por_segundo': round(sum(r['requisicoes'] for r in rotas) / duracao, 2),
+            'rotas': rotas,
+        }
@@ -0,0 +1,123 @@
+"""
+Validadores de GET condicional (ETag) para as leituras das filas.
+
+Cada fila tem uma versão: o id do último evento do barramento que a afetou
+(ver eventos.py). A versão é mantida de forma incremental por um assinante do
+barramento, então o ETag sai sem executar a consulta da fila. Um poll sem
+mudanças custa um 304 e, no backend 'banco', no máximo a leitura indexada de
+novos eventos. No backend 'local' o ETag inclui o período do barramento e
+vence junto com ele (as escritas de outros workers não geram eventos aqui).
+"""
+import threading
+
+from django.utils import timezone
+
+from .eventos import obter_barramento
+
+# Filas de leitura afetadas por uma senha em cada status
+FILAS_POR_STATUS = {
+    'aguardando_guiche': ['aguardando_guiche'],
+    'chamando_guiche': ['em_atendimento'],
+    'em_triagem': ['em_atendimento'],
+    'aguardando_medico': ['aguardando_medico'],
+    'chamando_medico': ['em_atendimento'],
+    'em_consulta': ['em_atendimento'],
+    'concluido': ['finalizadas'],
+    'cancelado': [],
+    'desistencia': [],
+}
+
+# Alterações de cadastro (nomes exibidos nas senhas) afetam todas as filas
+TODAS = '*'
+
+
+def filas_afetadas(evento):
+    """Nomes das filas cujo conteúdo muda com o evento"""
+    if evento.get('evento') == 'cadastro':
+        return [TODAS]
+    if evento.get('evento') == 'arquivamento':
+        # Só saem senhas finalizadas de dias anteriores
+        return ['finalizadas']
+
+    if evento.get('evento') == 'lote':
+        status_envolvidos = [evento.get('status'), *evento.get('status_anteriores', [])]
+        especialidades = evento.get('especialidades', [])
+    else:
+        status_envolvidos = [evento.get('status'), evento.get('status_anterior')]
+        especialidades = [evento.get('especialidade_id')]
+
+    filas = {'hoje'}
+    for status in status_envolvidos:
+        for fila in FILAS_POR_STATUS.get(status, []):
+            filas.add(fila)
+            if fila == 'aguardando_medico':
+                filas.update(f'aguardando_medico:{especialidade}' for especialidade in especialidades)
+    return filas
+
+
+class VersoesFilas:
+    """Versão de cada fila, atualizada a partir dos eventos do barramento"""
+
+    def __init__(self, barramento):
+        self.barramento = barramento
+        self._versoes = {}
+        self._lock = threading.Lock()
+        # Eventos anteriores a este ponto podem ter mudado qualquer fila
+        self._base = barramento.versao()
+        barramento.assinar(self._registrar)
+
+    def _registrar(self, evento_id, evento):
+        with self._lock:
+            for fila in filas_afetadas(evento):
+                # Publicações concorrentes podem chegar fora de ordem
+                self._versoes[fila] = max(evento_id, self._versoes.get(fila, 0))
+
+    def versao(self, fila):
+        self.barramento.sincronizar()
+        return self._versao(fila)
+
+    async def aversao(self, fila):
+        await self.barramento.asincronizar()
+        return self._versao(fila)
+
+    def _versao(self, fila):
+        with self._lock:
+            return max(self._versoes.get(fila, self._base), self._versoes.get(TODAS, self._base))
+
+
+_versoes = None
+_lock_versoes = threading.Lock()
+
+
+def obter_versoes():
+    global _versoes
+    if _versoes is None:
+        with _lock_versoes:
+            if _versoes is None:
+                _versoes = VersoesFilas(obter_barramento())
+    return _versoes
+
+
+def etag_fila(fila):
+    """
+    Cria o etag_func (decorator `condition`) de uma leitura de fila.
+
+    `fila` é o nome da fila ou uma função que o obtém da requisição. O ETag
+    inclui o dia (filas de "hoje" viram à meia-noite) e o formato de saída.
+    """
+    def etag_func(request, *args, **kwargs):
+        nome = fila(request) if callable(fila) else fila
+        renderer = getattr(request, 'accepted_renderer', None)
+        return _etag(nome, obter_versoes().versao(nome), renderer.format if renderer else 'html')
+    return etag_func
+
+
+async def aetag_fila(nome, formato='json'):
+    """ETag da fila `nome` para as views assíncronas (mesmo formato de etag_fila)"""
+    return _etag(nome, await obter_versoes().aversao(nome), formato)
+
+
+def _etag(nome, versao, formato):
+    barramento = obter_barramento()
+    return (f'"{nome}-{barramento.origem}-{versao}-{barramento.periodo()}-'
+            f'{timezone.localdate():%Y%m%d}-{formato}"')
@@ -0,0 +1,143 @@
+"""
+Medição das consultas ao banco por requisição (ou por trecho de código).
+
+Um execute_wrapper instalado em toda conexão nova (sinal connection_created)
+soma cada consulta aos RegistroConsultas ativos no contexto. O contexto é uma
+ContextVar, que acompanha o sync_to_async das views assíncronas; fora de uma
+medição o custo é uma leitura da ContextVar por consulta.
+
+O registro guarda a quantidade, o tempo total de SQL e quantas vezes cada
+forma de consulta (o SQL sem os valores) se repetiu. A mesma forma várias
+vezes numa requisição é o sintoma de N+1: um acesso a FK por item de lista.
+
+- MedicaoConsultasMiddleware (middleware.py) mede cada requisição, põe o
+  cabeçalho Server-Timing e registra no log as que passam do orçamento da
+  view (@orcamento) ou repetem consultas;
+- `medir_consultas()` mede um trecho qualquer;
+- `orcamento_consultas()` é a asserção para os testes.
+"""
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+CONFIGURACAO_PADRAO = {
+    'ORCAMENTO_PADRAO': 20,
+    'REPETICOES_SUSPEITAS': 3,
+    'SERVER_TIMING': False,
+}
+
+_registros = ContextVar('medpass_registros_consultas', default=())
+
+# Valores literais e listas do IN viram marcadores: sobra a forma da consulta
+_LITERAIS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTAS = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+
+
+def configuracao():
+    return {**CONFIGURACAO_PADRAO, **getattr(settings, 'MEDPASS_CONSULTAS', {})}
+
+
+def forma(sql):
+    """SQL sem valores: consultas que só diferem nos parâmetros têm a mesma forma"""
+    return _LISTAS.sub('(...)', _LITERAIS.sub('?', sql))
+
+
+class RegistroConsultas:
+    """Quantidade, tempo e repetições das consultas de um trecho"""
+
+    def __init__(self):
+        self.quantidade = 0
+        self.segundos = 0.0
+        self.formas = Counter()
+
+    def adicionar(self, sql, segundos):
+        self.quantidade += 1
+        self.segundos += segundos
+        self.formas[forma(sql)] += 1
+
+    def repetidas(self, minimo=2):
+        """[(forma, vezes)] das formas executadas ao menos `minimo` vezes"""
+        return [(sql, vezes) for sql, vezes in self.formas.most_common() if vezes >= minimo]
+
+    def server_timing(self, segundos_totais=None):
+        """Valor do cabeçalho Server-Timing (tempo de SQL e, se dado, o total)"""
+        partes = [f'db;dur={self.segundos * 1000:.1f};desc="{self.quantidade} consultas"']
+        if segundos_totais is not None:
+            partes.append(f'total;dur={segundos_totais * 1000:.1f}')
+        return ', '.join(partes)
+
+    def __str__(self):
+        linhas = [f'{self.quantidade} consulta(s) em {self.segundos * 1000:.1f} ms']
+        linhas += [f'  {vezes}x {sql}' for sql, vezes in self.repetidas()]
+        return '\n'.join(linhas)
+
+
+def _registrar(execute, sql, params, many, context):
+    registros = _registros.get()
+    if not registros:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duracao = time.perf_counter() - inicio
+        for registro in registros:
+            registro.adicionar(sql, duracao)
+
+
+def instrumentar(sender, connection, **kwargs):
+    # Reconexões (CONN_MAX_AGE) reusam o mesmo objeto de conexão
+    if _registrar not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _registrar)
+
+
+connection_created.connect(instrumentar, dispatch_uid='medpass_medir_consultas')
+
+
+@contextmanager
+def medir_consultas():
+    """Mede as consultas do trecho (medições aninhadas contam nas duas)"""
+    registro = RegistroConsultas()
+    token = _registros.set((*_registros.get(), registro))
+    try:
+        yield registro
+    finally:
+        _registros.reset(token)
+
+
+@contextmanager
+def orcamento_consultas(maximo, repeticoes=1):
+    """
+    Para os testes: falha se o trecho fizer mais de `maximo` consultas ou
+    repetir a mesma forma mais de `repeticoes` vezes.
+    """
+    with medir_consultas() as registro:
+        yield registro
+    repetidas = registro.repetidas(repeticoes + 1)
+    if registro.quantidade > maximo or repetidas:
+        raise AssertionError(f'Orçamento de {maximo} consulta(s) excedido ou consultas repetidas:\n{registro}')
+
+
+def orcamento(consultas):
+    """Decorator: orçamento de consultas da view (funções ou ações de ViewSet)"""
+    def decorar(view):
+        view.orcamento_consultas = consultas
+        return view
+    return decorar
+
+
+def orcamento_da_view(request):
+    """Orçamento declarado pela view que atendeu a requisição, ou None"""
+    rota = getattr(request, 'resolver_match', None)
+    if rota is None:
+        return None
+    acoes = getattr(rota.func, 'actions', None)
+    if acoes and request.method.lower() in acoes:
+        # ViewSet do DRF: o orçamento fica no método da ação
+        return getattr(getattr(rota.func.cls, acoes[request.method.lower()], None), 'orcamento_consultas', None)
+    return getattr(rota.func, 'orcamento_consultas', None)
@@ -0,0 +1,112 @@
+"""
+Estatísticas das senhas calculadas em uma única consulta.
+
+Todos os contadores (por status, do dia e por etapa) saem de um só SELECT com
+agregação condicional (`Count(..., filter=Q(...))`). A consulta lê apenas as
+senhas ativas e as que foram emitidas ou finalizadas no dia, usando os índices
+de status e de data de Senha.
+"""
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import Senha, filtro_do_dia
+
+STATUS_ATIVOS = [
+    'aguardando_guiche', 'chamando_guiche', 'em_triagem',
+    'aguardando_medico', 'chamando_medico', 'em_consulta',
+]
+
+# Agrupamentos aceitos em calcular_estatisticas(): (campos, apelidos)
+AGRUPAMENTOS = {
+    'especialidade': (['especialidade_id'], {'especialidade_nome': F('especialidade__nome')}),
+    'tipo': (['tipo'], {}),
+}
+
+
+def _agregados(data):
+    emitidas = filtro_do_dia('criado_em', data)
+    finalizadas = filtro_do_dia('concluido_em', data)
+
+    agregados = {
+        'total_hoje': Count('id', filter=emitidas),
+        'atendidas_emitidas_hoje': Count('id', filter=emitidas & Q(status='concluido')),
+        'finalizadas_hoje': Count('id', filter=finalizadas & Q(status='concluido')),
+        'canceladas_hoje': Count('id', filter=finalizadas & Q(status='cancelado')),
+        'desistencias_hoje': Count('id', filter=finalizadas & Q(status='desistencia')),
+        'etapa_guiche': Count('id', filter=Q(status__in=['chamando_guiche', 'em_triagem'])),
+        'etapa_medico': Count('id', filter=Q(status__in=['chamando_medico', 'em_consulta'])),
+    }
+    for status in STATUS_ATIVOS:
+        agregados[status] = Count('id', filter=Q(status=status))
+
+    # Só as linhas que podem contar para algum agregado
+    relevantes = Q(status__in=STATUS_ATIVOS) | emitidas | finalizadas
+    return agregados, relevantes
+
+
+def _consulta(data, agrupar_por):
+    """Agregados e a consulta (uma linha, ou uma por grupo) que os calcula"""
+    agregados, relevantes = _agregados(data)
+    senhas = Senha.objects.filter(relevantes).order_by()
+    if not agrupar_por:
+        return agregados, senhas
+
+    campos, apelidos = [], {}
+    for nome in agrupar_por:
+        campos += AGRUPAMENTOS[nome][0]
+        apelidos.update(AGRUPAMENTOS[nome][1])
+    return agregados, senhas.values(*campos, **apelidos).annotate(**agregados).order_by(*campos)
+
+
+def _somar_grupos(data, agregados, grupos):
+    resultado = {nome: sum(grupo[nome] for grupo in grupos) for nome in agregados}
+    resultado['data'] = data
+    resultado['grupos'] = grupos
+    return resultado
+
+
+def calcular_estatisticas(data=None, agrupar_por=()):
+    """
+    Retorna os contadores das senhas para o dia `data` (hoje, se omitido).
+
+    Com `agrupar_por` ('especialidade' e/ou 'tipo'), inclui a chave 'grupos'
+    com os mesmos contadores por grupo; os totais são somados a partir dos
+    grupos, de modo que continua sendo uma única consulta.
+    """
+    data = data or timezone.localdate()
+    agregados, consulta = _consulta(data, agrupar_por)
+    if not agrupar_por:
+        return {**consulta.aggregate(**agregados), 'data': data}
+    return _somar_grupos(data, agregados, list(consulta))
+
+
+async def acalcular_estatisticas(data=None, agrupar_por=()):
+    """Versão assíncrona de calcular_estatisticas() (mesma consulta, ORM assíncrono)"""
+    data = data or timezone.localdate()
+    agregados, consulta = _consulta(data, agrupar_por)
+    if not agrupar_por:
+        return {**await consulta.aaggregate(**agregados), 'data': data}
+    return _somar_grupos(data, agregados, [grupo async for grupo in consulta])
+
+
+def dados_da_api(dados):
+    """Resposta de SenhaViewSet.estatisticas (e da view assíncrona api_estatisticas)"""
+    resposta = {
+        'total_hoje': dados['total_hoje'],
+        'aguardando_guiche': dados['aguardando_guiche'],
+        'em_triagem': dados['etapa_guiche'],
+        'aguardando_medico': dados['aguardando_medico'],
+        'em_consulta': dados['etapa_medico'],
+        'finalizadas_hoje': dados['finalizadas_hoje'],
+        'canceladas_hoje': dados['canceladas_hoje'],
+        'desistencias_hoje': dados['desistencias_hoje'],
+        'data': dados['data'].isoformat()
+    }
+    if 'grupos' in dados:
+        resposta['grupos'] = dados['grupos']
+    return resposta
+
+
+def agrupamentos_do_parametro(valor):
+    """Lista de agrupamentos válidos de um parâmetro 'agrupar_por' (ex.: 'especialidade,tipo')"""
+    return [nome for nome in (valor or '').split(',') if nome in AGRUPAMENTOS]
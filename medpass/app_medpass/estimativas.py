@@ -0,0 +1,199 @@
+"""
+Estimativas de espera ao vivo (p50/p90) por etapa e especialidade.
+
+Cada chamada de senha (guichê ou médico) publica no barramento o tempo que a
+senha esperou na fila (ver eventos.ESPERAS). Um assinante do barramento soma
+esse tempo a um DDSketch (sketches.py) da fila, dividido em fatias de tempo:
+a estimativa combina só as fatias da janela recente (padrão: última hora), de
+modo que reflete o ritmo atual do atendimento com memória limitada, sem
+varrer a tabela de senhas.
+
+As janelas ficam em memória e são copiadas para EstimativaEspera a cada
+INTERVALO_SNAPSHOT segundos; ao reiniciar, o processo parte dessa cópia.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError
+
+from .eventos import obter_barramento
+from .models import EstimativaEspera
+from .sketches import DDSketch
+
+logger = logging.getLogger(__name__)
+
+CONFIGURACAO_PADRAO = {
+    'JANELA': 60 * 60,
+    'FATIAS': 6,
+    'INTERVALO_SNAPSHOT': 60,
+}
+
+# Fila de espera -> etapa (mesmos nomes de filas.ETAPAS)
+ETAPAS = {
+    'aguardando_guiche': 'guiche',
+    'aguardando_medico': 'medico',
+}
+
+QUANTIS = {'p50': 0.5, 'p90': 0.9}
+
+
+def chave(etapa, especialidade_id=None):
+    return f'{etapa}:{especialidade_id}' if especialidade_id else etapa
+
+
+class JanelaSketch:
+    """Sketches por fatia de tempo; só as fatias dentro da janela contam"""
+
+    def __init__(self, janela, fatias):
+        self.janela = janela
+        self.duracao_fatia = janela / fatias
+        self.fatias = deque()
+
+    def _descartar(self, agora):
+        while self.fatias and self.fatias[0][0] <= agora - self.janela:
+            self.fatias.popleft()
+
+    def adicionar(self, valor, agora):
+        self._descartar(agora)
+        if not self.fatias or agora >= self.fatias[-1][0] + self.duracao_fatia:
+            self.fatias.append((agora - agora % self.duracao_fatia, DDSketch()))
+        self.fatias[-1][1].adicionar(valor)
+
+    def combinado(self, agora):
+        self._descartar(agora)
+        sketch = DDSketch()
+        for _, fatia in self.fatias:
+            sketch.mesclar(fatia)
+        return sketch
+
+    def para_lista(self):
+        return [[inicio, fatia.para_dict()] for inicio, fatia in self.fatias]
+
+    def carregar(self, fatias):
+        self.fatias = deque((inicio, DDSketch.de_dict(dados)) for inicio, dados in fatias)
+
+
+class EstimativasEspera:
+    """Janelas de espera das filas, alimentadas pelos eventos de chamada"""
+
+    def __init__(self, barramento, janela=3600, fatias=6, intervalo_snapshot=60):
+        self.barramento = barramento
+        self.janela = janela
+        self.quantidade_fatias = fatias
+        self.intervalo_snapshot = intervalo_snapshot
+        self._janelas = {}
+        self._lock = threading.Lock()
+        self._restaurado = False
+        self._ultimo_snapshot = time.monotonic()
+        barramento.assinar(self._registrar)
+
+    def encerrar(self):
+        self.barramento.cancelar_assinatura(self._registrar)
+
+    def _janela(self, nome):
+        if nome not in self._janelas:
+            self._janelas[nome] = JanelaSketch(self.janela, self.quantidade_fatias)
+        return self._janelas[nome]
+
+    def _restaurar(self):
+        # Feito na primeira leitura ou evento, não na criação (sem banco no ready())
+        if self._restaurado:
+            return
+        self._restaurado = True
+        try:
+            copias = list(EstimativaEspera.objects.values_list('chave', 'fatias'))
+        except DatabaseError:
+            logger.exception('Não foi possível restaurar as estimativas de espera')
+            return
+        with self._lock:
+            for nome, fatias in copias:
+                if nome not in self._janelas:
+                    self._janela(nome).carregar(fatias)
+
+    def _registrar(self, evento_id, evento):
+        espera = evento.get('espera')
+        etapa = ETAPAS.get(evento.get('status_anterior'))
+        if espera is None or etapa is None:
+            return
+        self._restaurar()
+        agora = time.time()
+        with self._lock:
+            self._janela(chave(etapa)).adicionar(espera, agora)
+            self._janela(chave(etapa, evento.get('especialidade_id'))).adicionar(espera, agora)
+        if time.monotonic() - self._ultimo_snapshot >= self.intervalo_snapshot:
+            self.salvar()
+
+    def estimativa(self, etapa, especialidade_id=None):
+        """
+        Espera recente da fila: amostras, p50 e p90 em segundos. Sem amostras
+        da especialidade na janela, usa as da etapa inteira.
+        """
+        self.barramento.sincronizar()
+        self._restaurar()
+        return self._estimar(etapa, especialidade_id)
+
+    async def aestimativa(self, etapa, especialidade_id=None):
+        """Versão assíncrona de estimativa() (só sai do event loop para ler o banco)"""
+        await self.barramento.asincronizar()
+        if not self._restaurado:
+            await sync_to_async(self._restaurar)()
+        return self._estimar(etapa, especialidade_id)
+
+    def _estimar(self, etapa, especialidade_id):
+        agora = time.time()
+        with self._lock:
+            sketch = self._janela(chave(etapa, especialidade_id)).combinado(agora)
+            if especialidade_id and not sketch.contagem:
+                sketch = self._janela(chave(etapa)).combinado(agora)
+                especialidade_id = None
+        return {
+            'etapa': etapa,
+            'especialidade_id': especialidade_id,
+            'amostras': sketch.contagem,
+            **{nome: sketch.quantil(q) for nome, q in QUANTIS.items()},
+        }
+
+    def salvar(self):
+        """Grava a cópia das janelas em EstimativaEspera"""
+        self._ultimo_snapshot = time.monotonic()
+        with self._lock:
+            copias = {nome: janela.para_lista() for nome, janela in self._janelas.items()}
+        try:
+            for nome, fatias in copias.items():
+                EstimativaEspera.objects.update_or_create(chave=nome, defaults={'fatias': fatias})
+        except DatabaseError:
+            logger.exception('Não foi possível gravar as estimativas de espera')
+
+
+def minutos_de_espera(etapa, especialidade_id=None):
+    """p50 da espera recente arredondado em minutos (mínimo 1), ou None sem amostras"""
+    return _minutos(obter_estimativas().estimativa(etapa, especialidade_id))
+
+
+async def aminutos_de_espera(etapa, especialidade_id=None):
+    return _minutos(await obter_estimativas().aestimativa(etapa, especialidade_id))
+
+
+def _minutos(estimativa):
+    return None if estimativa['p50'] is None else max(round(estimativa['p50'] / 60), 1)
+
+
+_estimativas = None
+_lock_estimativas = threading.Lock()
+
+
+def obter_estimativas():
+    """Retorna as estimativas do processo, criadas conforme settings.MEDPASS_ESTIMATIVAS"""
+    global _estimativas
+    if _estimativas is None:
+        with _lock_estimativas:
+            if _estimativas is None:
+                config = {**CONFIGURACAO_PADRAO, **getattr(settings, 'MEDPASS_ESTIMATIVAS', {})}
+                _estimativas = EstimativasEspera(
+                    obter_barramento(), **{nome.lower(): valor for nome, valor in config.items()}
+                )
+    return _estimativas
@@ -0,0 +1,353 @@
+"""
+Barramento de eventos das senhas.
+
+Cada alteração relevante de uma Senha (emissão, troca de status ou rechamada)
+vira um evento compacto com id crescente, publicado após o commit da transação.
+Os eventos ficam num buffer circular limitado; quem reage a eles (painéis em
+tempo real, caches, métricas) pode:
+
+- assinar um callback, chamado a cada evento recebido pelo processo;
+- consultar `versao()` e `desde(ultimo_id)` para buscar só o que mudou;
+- aguardar novos eventos de forma assíncrona com `aguardar()`.
+
+Backends (settings.MEDPASS_BARRAMENTO['BACKEND']):
+
+- 'local': memória do processo. Zero consultas, mas cada worker só vê os
+  próprios eventos: os caches guiados pela versão (quadro dos painéis, ETags)
+  expiram a cada VALIDADE segundos para pegar as escritas dos demais.
+- 'banco': tabela EventoSenha. Os ids vêm do autoincremento e cada processo
+  lê os eventos dos demais workers por polling limitado. Um id faltando
+  (transação de outro worker ainda não commitada) segura a entrega até
+  ESPERA_LACUNA segundos; depois disso é dado como desfeito e pulado.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+CONFIGURACAO_PADRAO = {
+    'BACKEND': 'local',
+    'CAPACIDADE': 1000,
+    'INTERVALO_POLLING': 0.5,
+    # Segundos que o backend 'local' confia na própria versão (None: sempre)
+    'VALIDADE': 5,
+    # Segundos que o backend 'banco' segura os eventos depois de um id faltando
+    'ESPERA_LACUNA': 2.0,
+}
+
+BACKENDS = {
+    'local': 'app_medpass.eventos.BarramentoLocal',
+    'banco': 'app_medpass.eventos.BarramentoBanco',
+}
+
+
+# Fila de origem -> (status da chamada, entrada na fila, chamada). O evento da
+# chamada leva o tempo de espera, usado nas estimativas (estimativas.py).
+ESPERAS = {
+    'aguardando_guiche': ('chamando_guiche', 'criado_em', 'chamado_guiche_em'),
+    'aguardando_medico': ('chamando_medico', 'triagem_finalizada_em', 'chamado_medico_em'),
+}
+
+
+def evento_da_senha(senha, status_anterior=None, tipo_evento='status'):
+    """Monta o diff publicado no barramento (somente ids e campos curtos, sem joins)"""
+    evento = {
+        'evento': tipo_evento,
+        'id': senha.id,
+        'numero': senha.numero,
+        'tipo': senha.tipo,
+        'especialidade_id': senha.especialidade_id,
+        'status': senha.status,
+        'status_anterior': status_anterior,
+        'guiche_id': senha.guiche_id,
+        'profissional_id': senha.profissional_id,
+    }
+    if status_anterior in ESPERAS:
+        chamada, entrada, chamado_em = ESPERAS[status_anterior]
+        if senha.status == chamada and getattr(senha, entrada) and getattr(senha, chamado_em):
+            evento['espera'] = (getattr(senha, chamado_em) - getattr(senha, entrada)).total_seconds()
+    return evento
+
+
+class BarramentoLocal:
+    """
+    Barramento em memória: ids sequenciais por processo e buffer circular.
+
+    A publicação pode vir de qualquer thread (views síncronas rodam no pool do
+    ASGI); quem aguarda de forma assíncrona é acordado no próprio event loop.
+    """
+
+    def __init__(self, capacidade=1000, validade=5, **opcoes):
+        self.capacidade = capacidade
+        # Ids só valem dentro deste processo; a origem os distingue em ETags
+        self.origem = uuid.uuid4().hex[:8]
+        self.validade = validade
+        self._buffer = deque(maxlen=capacidade)
+        self._ultimo_id = 0
+        self._lock = threading.Lock()
+        self._lock_publicacao = threading.Lock()
+        self._assinantes = []
+        self._esperas = set()
+
+    # Publicação
+
+    def publicar(self, evento):
+        """Atribui o próximo id ao evento, entrega aos assinantes e retorna o id"""
+        with self._lock_publicacao:
+            evento_id = self._ultimo_id + 1
+            entrega = self._guardar([(evento_id, evento)])
+        # Fora do lock: um assinante pode publicar outro evento
+        self._entregar(*entrega)
+        return evento_id
+
+    def _receber(self, eventos):
+        self._entregar(*self._guardar(eventos))
+
+    def _guardar(self, eventos):
+        """Põe os eventos novos no buffer; retorna (novos, assinantes, esperas) para _entregar"""
+        novos = []
+        with self._lock:
+            for evento_id, evento in eventos:
+                # O mesmo evento pode chegar pela publicação e pelo polling
+                if evento_id <= self._ultimo_id:
+                    continue
+                self._buffer.append((evento_id, evento))
+                self._ultimo_id = evento_id
+                novos.append((evento_id, evento))
+            assinantes = list(self._assinantes)
+            esperas = list(self._esperas)
+        return novos, assinantes, esperas
+
+    def _entregar(self, novos, assinantes, esperas):
+        # Sem lock: publicações de threads diferentes podem chegar aos
+        # assinantes fora de ordem (quem guarda um id deve guardar o maior)
+        if not novos:
+            return
+        for callback in assinantes:
+            for evento_id, evento in novos:
+                try:
+                    callback(evento_id, evento)
+                except Exception:
+                    logger.exception('Erro no assinante %r do barramento', callback)
+        for loop, sinal in esperas:
+            try:
+                loop.call_soon_threadsafe(sinal.set)
+            except RuntimeError:
+                # Loop já encerrado; a espera é removida pelo próprio aguardar()
+                pass
+
+    # Consulta
+
+    def assinar(self, callback):
+        """Registra callback(evento_id, evento), chamado a cada evento recebido"""
+        with self._lock:
+            self._assinantes.append(callback)
+
+    def cancelar_assinatura(self, callback):
+        with self._lock:
+            self._assinantes = [c for c in self._assinantes if c is not callback]
+
+    def sincronizar(self):
+        """Traz eventos publicados por outros processos (nada a fazer no backend local)"""
+
+    def versao(self):
+        """Id do último evento conhecido"""
+        self.sincronizar()
+        return self._ultimo_id
+
+    @property
+    def ultimo_id(self):
+        """Id do último evento já recebido, sem sincronizar (ver versao())"""
+        return self._ultimo_id
+
+    def periodo(self):
+        """
+        Janela de `validade` segundos em que os caches guiados pela versão podem
+        ser reusados (sempre 0 quando a versão basta). Com vários workers no
+        backend local as escritas dos outros não geram eventos neste processo.
+        """
+        if not self.validade:
+            return 0
+        return int(time.time() // self.validade)
+
+    async def asincronizar(self):
+        """Versão assíncrona de sincronizar() (views async)"""
+
+    async def aversao(self):
+        """Versão assíncrona de versao(); no backend local não sai do event loop"""
+        await self.asincronizar()
+        return self._ultimo_id
+
+    def desde(self, ultimo_id):
+        """
+        Eventos com id maior que `ultimo_id`, em ordem.
+
+        Retorna None quando o buffer já descartou parte do intervalo (ou o id é
+        de outra execução); o chamador deve então recarregar o estado completo.
+        """
+        self.sincronizar()
+        with self._lock:
+            if ultimo_id > self._ultimo_id:
+                return None
+            if ultimo_id == self._ultimo_id:
+                return []
+            if not self._buffer or self._buffer[0][0] > ultimo_id + 1:
+                return None
+            return [(i, e) for i, e in self._buffer if i > ultimo_id]
+
+    async def aguardar(self, ultimo_id, timeout):
+        """Espera até haver eventos após `ultimo_id` (ou o timeout) e os retorna"""
+        loop = asyncio.get_running_loop()
+        sinal = asyncio.Event()
+        espera = (loop, sinal)
+        with self._lock:
+            self._esperas.add(espera)
+        try:
+            limite = loop.time() + timeout
+            while True:
+                eventos = await self._adesde(ultimo_id)
+                if eventos is None or eventos:
+                    return eventos
+                restante = limite - loop.time()
+                if restante <= 0:
+                    return []
+                sinal.clear()
+                try:
+                    await asyncio.wait_for(sinal.wait(), timeout=min(restante, self._intervalo_espera()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                self._esperas.discard(espera)
+
+    async def _adesde(self, ultimo_id):
+        return self.desde(ultimo_id)
+
+    def _intervalo_espera(self):
+        return float('inf')
+
+
+class BarramentoBanco(BarramentoLocal):
+    """
+    Barramento gravado na tabela EventoSenha, compartilhado entre workers.
+
+    Cada processo mantém o mesmo buffer em memória e o completa lendo a tabela
+    no máximo uma vez a cada `intervalo_polling` segundos, não importa quantos
+    painéis estejam conectados. A tabela é podada para `capacidade` linhas.
+    """
+
+    def __init__(self, capacidade=1000, intervalo_polling=0.5, espera_lacuna=2.0, **opcoes):
+        # Ids vêm da tabela e valem para todos os workers: a versão não expira
+        super().__init__(capacidade=capacidade, validade=None)
+        self.origem = 'banco'
+        self.intervalo_polling = intervalo_polling
+        self.espera_lacuna = espera_lacuna
+        self._ultima_sincronizacao = 0.0
+        self._lock_sincronizacao = threading.Lock()
+        # (primeiro id faltando, desde quando) enquanto a entrega está parada nele
+        self._lacuna = None
+
+    def publicar(self, evento):
+        from .models import EventoSenha
+
+        evento_id = EventoSenha.objects.create(evento=evento).id
+        if evento_id % 100 == 0:
+            EventoSenha.objects.filter(id__lte=evento_id - self.capacidade).delete()
+        # Lê a tabela em vez de entregar direto: eventos de outros workers com
+        # id menor ainda não vistos por este processo não podem ser pulados
+        self.sincronizar(forcar=True)
+        return evento_id
+
+    def sincronizar(self, forcar=False):
+        from .models import EventoSenha
+
+        with self._lock_sincronizacao:
+            agora = time.monotonic()
+            if not forcar and agora - self._ultima_sincronizacao < self.intervalo_polling:
+                return
+            self._ultima_sincronizacao = agora
+
+            ultimo_id = self._ultimo_id
+            if ultimo_id == 0:
+                # Processo novo: começa do último evento, sem reentregar o histórico
+                ultimo = EventoSenha.objects.order_by('-id').values('id', 'evento').first()
+                linhas = [(ultimo['id'], ultimo['evento'])] if ultimo else []
+            else:
+                linhas = EventoSenha.objects.filter(id__gt=ultimo_id).order_by('id').values_list('id', 'evento')
+                linhas = self._sem_lacunas(ultimo_id, list(linhas[:self.capacidade]), agora)
+            entrega = self._guardar(linhas)
+        # Fora do lock: um assinante pode publicar (e sincronizar) de novo
+        self._entregar(*entrega)
+
+    def _sem_lacunas(self, ultimo_id, linhas, agora):
+        """
+        Trecho de `linhas` que pode ser entregue sem pular ids.
+
+        No PostgreSQL o id sai da sequência antes do commit: um evento com id
+        menor pode aparecer na tabela depois de um maior. A entrega para no
+        primeiro id faltando e só passa dele após `espera_lacuna` segundos
+        (rollback também consome ids, então a lacuna pode nunca ser preenchida).
+        """
+        esperado = ultimo_id + 1
+        for indice, (evento_id, _) in enumerate(linhas):
+            if evento_id != esperado:
+                if self._lacuna is None or self._lacuna[0] != esperado:
+                    self._lacuna = (esperado, agora)
+                if agora - self._lacuna[1] < self.espera_lacuna:
+                    return linhas[:indice]
+                logger.warning('Eventos %s a %s não apareceram no barramento; seguindo sem eles',
+                               esperado, evento_id - 1)
+            esperado = evento_id + 1
+        self._lacuna = None
+        return linhas
+
+    async def _adesde(self, ultimo_id):
+        from asgiref.sync import sync_to_async
+
+        return await sync_to_async(self.desde)(ultimo_id)
+
+    async def asincronizar(self):
+        # Só vai ao pool de threads (e ao banco) quando o polling está vencido
+        if time.monotonic() - self._ultima_sincronizacao >= self.intervalo_polling:
+            from asgiref.sync import sync_to_async
+
+            await sync_to_async(self.sincronizar)()
+
+    def _intervalo_espera(self):
+        return self.intervalo_polling
+
+
+_barramento = None
+_lock_barramento = threading.Lock()
+
+
+def obter_barramento():
+    """Retorna o barramento do processo, criado conforme settings.MEDPASS_BARRAMENTO"""
+    global _barramento
+    if _barramento is None:
+        with _lock_barramento:
+            if _barramento is None:
+                config = {**CONFIGURACAO_PADRAO, **getattr(settings, 'MEDPASS_BARRAMENTO', {})}
+                backend = config.pop('BACKEND')
+                if backend == 'local' and getattr(settings, 'MEDPASS_PERFIL_BANCO', None) == 'producao':
+                    # Vários workers: cada um ficaria só com os próprios eventos
+                    raise ImproperlyConfigured(
+                        "O perfil 'producao' roda com vários workers: use MEDPASS_BARRAMENTO['BACKEND'] = 'banco'"
+                    )
+                classe = import_string(BACKENDS.get(backend, backend))
+                _barramento = classe(**{chave.lower(): valor for chave, valor in config.items()})
+    return _barramento
+
+
+def publicar_apos_commit(evento):
+    """Publica o evento quando a transação atual for confirmada"""
+    transaction.on_commit(lambda: obter_barramento().publicar(evento))
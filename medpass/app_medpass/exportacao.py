@@ -0,0 +1,113 @@
+"""
+Exportação em fluxo (NDJSON ou CSV) do histórico de senhas.
+
+As senhas são lidas com `iterator(chunk_size=...)` (cursor do lado do servidor
+no PostgreSQL, `fetchmany` no SQLite) e cada lote vira um bloco de texto assim
+que chega do banco. A memória não cresce com o número de linhas, o que permite
+exportar meses inteiros numa única requisição (`StreamingHttpResponse`) ou pelo
+comando `exportar_senhas`.
+
+O histórico é a união da tabela Senha (dia corrente) com SenhaHistorico
+(senhas arquivadas, ver arquivamento.py), com os mesmos nomes de coluna.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .models import Senha, SenhaHistorico
+from .serializers import SenhaSerializerRapido
+
+FORMATOS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+# Linhas buscadas por ida ao banco (e escritas por bloco)
+TAMANHO_LOTE = 2000
+
+
+def senhas_para_exportar(inicio=None, fim=None, especialidade_id=None):
+    """
+    Linhas (.values()) das senhas emitidas entre as datas `inicio` e `fim`,
+    inclusive, no fuso local, em ordem de emissão. Inclui as senhas
+    arquivadas (UNION ALL com SenhaHistorico).
+    """
+    filtro = {}
+    if inicio:
+        filtro['criado_em__gte'] = timezone.make_aware(datetime.combine(inicio, time.min))
+    if fim:
+        filtro['criado_em__lt'] = timezone.make_aware(datetime.combine(fim + timedelta(days=1), time.min))
+    if especialidade_id:
+        filtro['especialidade_id'] = especialidade_id
+
+    arquivadas = SenhaHistorico.objects.filter(**filtro)
+    # Restringe às partições (meses) do período
+    if inicio:
+        arquivadas = arquivadas.filter(mes__gte=inicio.replace(day=1))
+    if fim:
+        arquivadas = arquivadas.filter(mes__lte=fim.replace(day=1))
+
+    atuais = SenhaSerializerRapido.valores(Senha.objects.filter(**filtro).order_by())
+    arquivadas = SenhaSerializerRapido.valores(arquivadas.order_by())
+    return atuais.union(arquivadas, all=True).order_by('criado_em', 'id')
+
+
+def _registros(senhas, tamanho_lote):
+    fuso = timezone.get_current_timezone()
+    for linha in senhas.iterator(chunk_size=tamanho_lote):
+        yield SenhaSerializerRapido.representar(linha, fuso)
+
+
+def _em_blocos(linhas, tamanho_lote):
+    # A primeira linha sai sozinha, para o cliente receber bytes sem esperar o lote
+    bloco, limite = [], 1
+    for linha in linhas:
+        bloco.append(linha)
+        if len(bloco) >= limite:
+            yield ''.join(bloco)
+            bloco, limite = [], tamanho_lote
+    if bloco:
+        yield ''.join(bloco)
+
+
+def gerar_ndjson(senhas, tamanho_lote=TAMANHO_LOTE):
+    """Blocos de texto NDJSON (um objeto JSON de SenhaSerializer por linha)"""
+    linhas = (
+        json.dumps(registro, ensure_ascii=False) + '\n'
+        for registro in _registros(senhas, tamanho_lote)
+    )
+    return _em_blocos(linhas, tamanho_lote)
+
+
+class _Eco:
+    """Pseudo-arquivo para csv.writer: devolve a linha em vez de gravá-la"""
+
+    def write(self, valor):
+        return valor
+
+
+def gerar_csv(senhas, tamanho_lote=TAMANHO_LOTE):
+    """Blocos de texto CSV; o cabeçalho sai antes da primeira consulta"""
+    escritor = csv.writer(_Eco())
+    colunas = list(SenhaSerializerRapido.representar(
+        dict.fromkeys(SenhaSerializerRapido.COLUNAS), timezone.get_current_timezone()
+    ))
+    yield escritor.writerow(colunas)
+    linhas = (
+        escritor.writerow(['' if registro[coluna] is None else registro[coluna] for coluna in colunas])
+        for registro in _registros(senhas, tamanho_lote)
+    )
+    yield from _em_blocos(linhas, tamanho_lote)
+
+
+GERADORES = {
+    'ndjson': gerar_ndjson,
+    'csv': gerar_csv,
+}
+
+
+def exportar(formato, senhas, tamanho_lote=TAMANHO_LOTE):
+    """Gerador de blocos de texto no `formato` ('ndjson' ou 'csv')"""
+    return GERADORES[formato](senhas, tamanho_lote)
@@ -0,0 +1,120 @@
+"""
+Filas de espera das senhas (guichê e médico) ordenadas por prioridade.
+
+Cada senha em espera guarda em `Senha.prioridade` uma chave inteira fixa (ver
+Senha.calcular_prioridade): instante de entrada na fila menos o bônus do tipo.
+A fila é a ordem (prioridade, id) sobre os índices `senha_fila_guiche_idx` e
+`senha_fila_medico_idx`, que fazem o papel do heap: a próxima senha é a
+primeira entrada do índice, sem ordenar a fila inteira, e o envelhecimento das
+senhas Normais já está embutido na chave.
+"""
+from django.db import connection
+from django.utils import timezone
+
+from .banco import transacao_de_escrita
+from .eventos import evento_da_senha, publicar_apos_commit
+from .models import Senha
+from .transicoes import TRANSICOES
+
+# Etapa -> status de espera
+ETAPAS = {
+    'guiche': 'aguardando_guiche',
+    'medico': 'aguardando_medico',
+}
+
+# Etapa -> (campo da mesa na Senha, status de uma senha em atendimento na mesa)
+ATENDIMENTO = {
+    'guiche': ('guiche', ('chamando_guiche', 'em_triagem')),
+    'medico': ('profissional', ('chamando_medico', 'em_consulta')),
+}
+
+
+class MesaOcupada(Exception):
+    """O guichê ou médico já está atendendo uma senha"""
+
+
+class FilaSenhas:
+    """Fila de uma etapa ('guiche' ou 'medico'), opcionalmente de uma especialidade"""
+
+    def __init__(self, etapa, especialidade_id=None):
+        if etapa not in ETAPAS:
+            raise ValueError(f'Etapa desconhecida: {etapa}')
+        self.etapa = etapa
+        self.status = ETAPAS[etapa]
+        self.especialidade_id = especialidade_id
+
+    def senhas(self):
+        """Senhas da fila, da próxima para a última"""
+        senhas = Senha.objects.filter(status=self.status)
+        if self.especialidade_id:
+            senhas = senhas.filter(especialidade_id=self.especialidade_id)
+        return senhas.order_by('prioridade', 'id')
+
+    def espiar(self):
+        """Próxima senha da fila (sem retirá-la), ou None"""
+        return self.senhas().select_related('especialidade', 'guiche', 'profissional').first()
+
+    def retirar(self, transicao, mesa=None, **campos):
+        """
+        Retira a próxima senha aplicando a `transicao` (ver transicoes.py), com
+        os `campos` dados gravados no mesmo UPDATE.
+
+        Com `mesa` (Guiche ou Profissional), a senha é gravada nela e, se a
+        mesa já atende outra senha, levanta MesaOcupada. A checagem roda na
+        mesma transação da retirada, com a linha da mesa travada onde há
+        SELECT ... FOR UPDATE: um clique duplo não leva duas senhas.
+
+        Onde o banco suporta (PostgreSQL, MySQL), a cabeça da fila é lida com
+        SELECT ... FOR UPDATE SKIP LOCKED: mesas concorrentes pulam a linha já
+        reservada e cada uma leva uma senha diferente. Em qualquer banco a troca
+        é um UPDATE condicional (WHERE id = ? AND status = <espera>); no SQLite,
+        se outra mesa levou a mesma senha, tenta a seguinte (cada falha
+        significa que a fila andou), e a transação já começa com o lock de
+        escrita (banco.transacao_de_escrita). Retorna a senha atualizada ou
+        None se a fila estiver vazia.
+        """
+        transicao = TRANSICOES[transicao]
+        if self.status not in transicao.origens:
+            raise ValueError(f'A transição não parte de {self.status}')
+        if mesa is not None:
+            campos[ATENDIMENTO[self.etapa][0]] = mesa
+        while True:
+            with transacao_de_escrita():
+                if mesa is not None:
+                    self._verificar_mesa(mesa)
+                proxima = self._proxima_id()
+                if proxima is None:
+                    return None
+                valores = transicao.valores(None, campos, timezone.now())
+                if Senha.objects.filter(id=proxima, status=self.status).update(**valores):
+                    senha = Senha.objects.select_related('especialidade', 'guiche', 'profissional').get(id=proxima)
+                    # update() não dispara post_save; o evento sai daqui
+                    publicar_apos_commit(evento_da_senha(senha, self.status, transicao.evento))
+                    return senha
+
+    def _verificar_mesa(self, mesa):
+        campo, em_atendimento = ATENDIMENTO[self.etapa]
+        if connection.features.has_select_for_update:
+            # Cliques simultâneos da mesma mesa esperam aqui um pelo outro
+            list(type(mesa).objects.select_for_update().filter(pk=mesa.pk).values_list('pk'))
+        if Senha.objects.filter(**{campo: mesa}, status__in=em_atendimento).exists():
+            raise MesaOcupada
+
+    def _proxima_id(self):
+        ids = self.senhas().values_list('id', flat=True)
+        if connection.features.has_select_for_update_skip_locked:
+            ids = ids.select_for_update(skip_locked=True)
+        return ids.first()
+
+    def __len__(self):
+        return self.senhas().count()
+
+
+def chamar_proxima_guiche(guiche):
+    """Guichê chama a próxima senha da fila de triagem (None se vazia; MesaOcupada se já atende)"""
+    return FilaSenhas('guiche').retirar('chamar_guiche', mesa=guiche)
+
+
+def chamar_proxima_medico(medico):
+    """Médico chama o próximo paciente da sua especialidade (None se vazia; MesaOcupada se já atende)"""
+    return FilaSenhas('medico', medico.especialidade_id).retirar('chamar_medico', mesa=medico)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from app_medpass.arquivamento import TAMANHO_LOTE, arquivar
+from app_medpass.management.commands.exportar_senhas import _data
+
+
+class Command(BaseCommand):
+    help = (
+        'Move as senhas finalizadas de dias anteriores para o histórico '
+        '(SenhaHistorico), em lotes de transações curtas.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--antes-de', type=_data, help='Arquiva o que terminou antes deste dia (padrão: hoje)')
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE, help='Senhas por transação')
+
+    def handle(self, *args, **options):
+        total = arquivar(options['antes_de'], options['lote'])
+        self.stdout.write(self.style.SUCCESS(f'{total} senha(s) arquivada(s)'))
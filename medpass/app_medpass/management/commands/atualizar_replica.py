@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from app_medpass.roteamento import alias_replica, configuracao
+
+
+class Command(BaseCommand):
+    help = (
+        'Copia o banco SQLite principal para o arquivo da réplica (MEDPASS_BANCO_REPLICA) '
+        'com a API de backup do SQLite, uma vez ou a cada --intervalo segundos. '
+        'Faz as vezes da replicação para testar o roteamento de leituras localmente.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--intervalo', type=float,
+            help='Repete a cópia neste intervalo (use no máximo o ATRASO_MAXIMO da réplica)',
+        )
+
+    def handle(self, *args, **options):
+        replica = alias_replica()
+        if replica is None:
+            raise CommandError('Nenhuma réplica configurada (defina MEDPASS_BANCO_REPLICA).')
+        principal = connections[DEFAULT_DB_ALIAS]
+        if principal.vendor != 'sqlite' or connections[replica].vendor != 'sqlite':
+            raise CommandError('A cópia de arquivo só vale para o SQLite; use a replicação do banco.')
+
+        intervalo = options['intervalo']
+        if intervalo and intervalo > configuracao()['ATRASO_MAXIMO']:
+            self.stderr.write(self.style.WARNING(
+                'Intervalo maior que ATRASO_MAXIMO: as leituras na réplica podem vir atrasadas.'
+            ))
+        while True:
+            inicio = time.monotonic()
+            principal.ensure_connection()
+            destino = sqlite3.connect(connections[replica].settings_dict['NAME'])
+            try:
+                principal.connection.backup(destino)
+            finally:
+                destino.close()
+            self.stdout.write(f'Réplica atualizada em {(time.monotonic() - inicio) * 1000:.0f} ms')
+            if not intervalo:
+                return
+            time.sleep(max(intervalo - (time.monotonic() - inicio), 0))
@@ -0,0 +1,152 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, connections
+
+from app_medpass.banco import banco_ocupado
+
+# Os modelos são importados dentro das funções: os processos filhos importam
+# este módulo antes do django.setup()
+
+PADRAO_CONEXAO = {'OPTIONS': {}, 'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False}
+
+
+def _trabalhador(arquivo, perfil, indice, duracao, largada, resultados):
+    """Processo que emite senhas e as leva da triagem ao fim da consulta"""
+    import django
+    django.setup()
+
+    from app_medpass.filas import chamar_proxima_guiche, chamar_proxima_medico
+    from app_medpass.models import Especialidade, Guiche, Profissional, Senha
+    from app_medpass.transicoes import transicionar
+
+    conexao = connections['default']
+    conexao.close()
+    conexao.settings_dict.update({**PADRAO_CONEXAO, **perfil, 'NAME': arquivo})
+
+    especialidade = Especialidade.objects.get()
+    guiche = Guiche.objects.get(numero=f'Z{indice:02d}')
+    medico = Profissional.objects.get(crm=f'{90000 + indice}')
+    close_old_connections()
+
+    def emitir():
+        Senha.objects.create(
+            numero=Senha.gerar_numero('N', especialidade), tipo='N',
+            especialidade=especialidade, status='aguardando_guiche',
+        )
+        contagem['emitidas'] += 1
+
+    def atender(chamar, etapas):
+        senha = chamar()
+        for transicao in etapas:
+            if senha is None:
+                return
+            # Cada passo é uma requisição separada, como nas telas
+            close_old_connections()
+            senha = transicionar(senha, transicao)
+        if senha is not None and senha.status == 'concluido':
+            contagem['concluidas'] += 1
+
+    passos = [
+        emitir,
+        lambda: atender(lambda: chamar_proxima_guiche(guiche), ['iniciar_triagem', 'finalizar_triagem']),
+        lambda: atender(lambda: chamar_proxima_medico(medico), ['iniciar_consulta', 'finalizar_consulta']),
+    ]
+    contagem = {'emitidas': 0, 'concluidas': 0, 'ocupado': 0, 'erros': 0}
+    largada.wait()
+    fim = time.monotonic() + duracao
+    while time.monotonic() < fim:
+        for passo in passos:
+            try:
+                passo()
+            except Exception as erro:
+                contagem['ocupado' if banco_ocupado(erro) else 'erros'] += 1
+            # Fim da "requisição": com CONN_MAX_AGE=0 a conexão é fechada
+            close_old_connections()
+    conexao.close()
+    resultados.put(contagem)
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede senhas/s com vários processos escrevendo no mesmo SQLite, em cada '
+        'perfil de settings.MEDPASS_PERFIS_BANCO (antes/depois do perfil de produção). '
+        'Cada perfil roda numa cópia nova de um banco temporário.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processos', type=int, default=4, help='Processos escrevendo ao mesmo tempo')
+        parser.add_argument('--segundos', type=float, default=10, help='Duração de cada perfil')
+        parser.add_argument(
+            '--perfis', nargs='+', choices=list(settings.MEDPASS_PERFIS_BANCO),
+            default=list(settings.MEDPASS_PERFIS_BANCO), help='Perfis comparados',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('O benchmark de concorrência é para o SQLite.')
+        processos = options['processos']
+
+        with tempfile.TemporaryDirectory() as diretorio:
+            modelo = os.path.join(diretorio, 'modelo.sqlite3')
+            self._criar_modelo(modelo, processos)
+
+            self.stdout.write(f'{processos} processo(s), {options["segundos"]:g} s por perfil\n')
+            self.stdout.write(f'{"perfil":<18}{"senhas/s":>10}{"concluídas/s":>14}{"ocupado":>9}{"erros":>7}')
+            taxas = {}
+            for nome in options['perfis']:
+                arquivo = os.path.join(diretorio, f'{nome}.sqlite3')
+                shutil.copy(modelo, arquivo)
+                total = self._medir(arquivo, settings.MEDPASS_PERFIS_BANCO[nome], processos, options['segundos'])
+                taxas[nome] = total['emitidas'] / options['segundos']
+                linha = (
+                    f'{nome:<18}{taxas[nome]:>10.1f}{total["concluidas"] / options["segundos"]:>14.1f}'
+                    f'{total["ocupado"]:>9}{total["erros"]:>7}'
+                )
+                self.stdout.write(self.style.ERROR(linha) if total['ocupado'] or total['erros'] else linha)
+
+        if len(taxas) > 1 and min(taxas.values()):
+            antes, *_, depois = taxas.values()
+            self.stdout.write(self.style.SUCCESS(f'\n{depois / antes:.1f}x senhas/s no último perfil'))
+
+    def _criar_modelo(self, arquivo, processos):
+        """Banco migrado, no modo de journal padrão, com um guichê e um médico por processo"""
+        from app_medpass.models import Especialidade, Guiche, Profissional
+
+        original = dict(connection.settings_dict)
+        connection.close()
+        connection.settings_dict.update({**PADRAO_CONEXAO, 'NAME': arquivo})
+        try:
+            call_command('migrate', verbosity=0, interactive=False)
+            especialidade = Especialidade.objects.create(nome='Concorrência', sigla='ZC')
+            for indice in range(processos):
+                Guiche.objects.create(numero=f'Z{indice:02d}', nome=f'Guichê {indice}')
+                Profissional.objects.create(
+                    nome=f'Médico {indice}', crm=f'{90000 + indice}', uf_crm='ZZ', especialidade=especialidade,
+                )
+        finally:
+            connection.close()
+            connection.settings_dict.clear()
+            connection.settings_dict.update(original)
+
+    @staticmethod
+    def _medir(arquivo, perfil, processos, segundos):
+        contexto = multiprocessing.get_context('spawn')
+        largada = contexto.Barrier(processos)
+        resultados = contexto.Queue()
+        filhos = [
+            contexto.Process(target=_trabalhador, args=(arquivo, perfil, indice, segundos, largada, resultados))
+            for indice in range(processos)
+        ]
+        for filho in filhos:
+            filho.start()
+        contagens = [resultados.get() for _ in filhos]
+        for filho in filhos:
+            filho.join()
+        return {chave: sum(c[chave] for c in contagens) for chave in contagens[0]}
@@ -0,0 +1,82 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from app_medpass.models import Especialidade, Guiche, Profissional, Senha
+from app_medpass.serializers import SenhaSerializer, SenhaSerializerRapido
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara o custo por linha de SenhaSerializer e SenhaSerializerRapido. '
+        'As senhas de teste são criadas numa transação desfeita ao final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--linhas', type=int, default=500, help='Quantidade de senhas na lista')
+        parser.add_argument('--repeticoes', type=int, default=5, help='Rodadas por medição (vale a melhor)')
+
+    def handle(self, *args, **options):
+        linhas = options['linhas']
+        repeticoes = options['repeticoes']
+
+        with transaction.atomic():
+            self._criar_senhas(linhas)
+            queryset = Senha.objects.select_related('especialidade', 'guiche', 'profissional')
+
+            instancias = list(queryset)
+            valores = list(SenhaSerializerRapido.valores(queryset))
+
+            medicoes = [
+                ('SenhaSerializer (só serialização)',
+                 lambda: SenhaSerializer(instancias, many=True).data),
+                ('SenhaSerializerRapido (só serialização)',
+                 lambda: SenhaSerializerRapido(valores).data),
+                ('SenhaSerializer (consulta + serialização)',
+                 lambda: SenhaSerializer(queryset.all(), many=True).data),
+                ('SenhaSerializerRapido (consulta + serialização)',
+                 lambda: SenhaSerializerRapido(queryset.all()).data),
+            ]
+
+            self.stdout.write(f'{linhas} senhas, melhor de {repeticoes} rodadas\n')
+            resultados = {}
+            for nome, funcao in medicoes:
+                melhor = min(self._medir(funcao) for _ in range(repeticoes))
+                resultados[nome] = melhor
+                self.stdout.write(f'  {nome:<48} {melhor * 1e6 / linhas:8.1f} µs/linha')
+
+            padrao = resultados['SenhaSerializer (só serialização)']
+            rapido = resultados['SenhaSerializerRapido (só serialização)']
+            self.stdout.write(self.style.SUCCESS(f'\nSerialização {padrao / rapido:.1f}x mais rápida'))
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _medir(funcao):
+        inicio = time.perf_counter()
+        funcao()
+        return time.perf_counter() - inicio
+
+    @staticmethod
+    def _criar_senhas(linhas):
+        especialidade = Especialidade.objects.create(nome='Benchmark', sigla='ZZZ')
+        guiche = Guiche.objects.create(numero='BENCH', nome='Benchmark')
+        medico = Profissional.objects.create(nome='Benchmark', crm='99999999', uf_crm='ZZ', especialidade=especialidade)
+        agora = timezone.now()
+        status = [s for s, _ in Senha.STATUS_CHOICES]
+        Senha.objects.bulk_create([
+            Senha(
+                numero=f'NZZZ{i:03d}'[:10],
+                tipo='NPU'[i % 3],
+                especialidade=especialidade,
+                status=status[i % len(status)],
+                guiche=guiche if i % 2 else None,
+                profissional=medico if i % 4 == 0 else None,
+                nome_paciente=f'Paciente {i}',
+                chamado_guiche_em=agora,
+                concluido_em=agora if i % 3 == 0 else None,
+            )
+            for i in range(linhas)
+        ])
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from app_medpass.exportacao import FORMATOS, TAMANHO_LOTE, exportar, senhas_para_exportar
+
+
+def _data(valor):
+    try:
+        data = parse_date(valor)
+    except ValueError:
+        data = None
+    if data is None:
+        raise CommandError(f'Data inválida: {valor} (use AAAA-MM-DD)')
+    return data
+
+
+class Command(BaseCommand):
+    help = (
+        'Exporta o histórico de senhas em NDJSON ou CSV, lendo o banco em lotes '
+        '(memória constante, independente do número de senhas).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formato', choices=list(FORMATOS), default='ndjson')
+        parser.add_argument('--inicio', type=_data, help='Primeiro dia de emissão (AAAA-MM-DD)')
+        parser.add_argument('--fim', type=_data, help='Último dia de emissão (AAAA-MM-DD)')
+        parser.add_argument('--especialidade', type=int, help='ID da especialidade')
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE, help='Linhas por ida ao banco')
+        parser.add_argument('--saida', help='Arquivo de destino (padrão: saída padrão)')
+
+    def handle(self, *args, **options):
+        senhas = senhas_para_exportar(options['inicio'], options['fim'], options['especialidade'])
+        blocos = exportar(options['formato'], senhas, options['lote'])
+
+        if options['saida']:
+            with open(options['saida'], 'w', encoding='utf-8', newline='') as arquivo:
+                arquivo.writelines(blocos)
+            self.stderr.write(self.style.SUCCESS(f'Exportação gravada em {options["saida"]}'))
+        else:
+            for bloco in blocos:
+                self.stdout.write(bloco, ending='')
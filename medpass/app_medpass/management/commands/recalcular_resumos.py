@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from app_medpass.management.commands.exportar_senhas import _data
+from app_medpass.resumos import recalcular
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula os resumos diários (contadores e tempos por especialidade e tipo) '
+        'a partir das senhas, inclusive as arquivadas.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inicio', type=_data, help='Primeiro dia (AAAA-MM-DD; padrão: todo o histórico)')
+        parser.add_argument('--fim', type=_data, help='Último dia (AAAA-MM-DD)')
+
+    def handle(self, *args, **options):
+        total = recalcular(options['inicio'], options['fim'])
+        self.stdout.write(self.style.SUCCESS(f'{total} resumo(s) gravado(s)'))
@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from app_medpass.carga import (
+    CENARIO_PADRAO, ClienteHTTP, Simulacao, cadastros_do_servidor, preparar_cadastros,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Simula um dia de atendimento (totens, guichês, médicos e painéis) e mede '
+        'latência p50/p99, vazão e consultas ao banco por rota. Sem --url, roda no '
+        'próprio processo num banco descartável do mesmo tipo do configurado '
+        '(SQLite ou PostgreSQL), apagado ao final.'
+    )
+
+    def add_arguments(self, parser):
+        ajuda = {
+            'totens': 'Totens emitindo senhas',
+            'guiches': 'Guichês de triagem',
+            'medicos': 'Médicos atendendo',
+            'paineis': 'Telas de painel fazendo poll',
+            'especialidades': 'Especialidades criadas (sem --url)',
+            'chegadas_por_hora': 'Chegadas de pacientes por hora, somando os totens',
+            'triagem_minutos': 'Duração média da triagem',
+            'consulta_minutos': 'Duração média da consulta',
+            'intervalo_painel': 'Segundos entre os polls de cada painel',
+            'horas': 'Duração do dia simulado',
+            'acelerar': 'Quantas vezes o dia simulado corre mais rápido que o relógio',
+        }
+        for nome, padrao in CENARIO_PADRAO.items():
+            parser.add_argument(
+                f'--{nome.replace("_", "-")}', type=type(padrao), default=padrao,
+                help=f'{ajuda[nome]} (padrão: {padrao})',
+            )
+        parser.add_argument('--semente', type=int, default=1, help='Semente dos sorteios')
+        parser.add_argument('--url', help='Mede um servidor em execução (ex.: http://localhost:8000)')
+        parser.add_argument('--json', dest='arquivo_json', help='Grava o relatório completo neste arquivo')
+
+    def handle(self, *args, **options):
+        cenario = {nome: options[nome] for nome in CENARIO_PADRAO}
+        especialidades = cenario.pop('especialidades')
+        guiches, medicos = cenario.pop('guiches'), cenario.pop('medicos')
+
+        # Filas vazias (404) e erros (5xx) já aparecem no relatório
+        registro = logging.getLogger('django.request')
+        nivel = registro.level
+        if options['verbosity'] < 2:
+            registro.setLevel(logging.CRITICAL)
+        try:
+            if options['url']:
+                ids = cadastros_do_servidor(ClienteHTTP(options['url']), guiches, medicos)
+                relatorio = self._simular(ids, cenario, options, lambda: ClienteHTTP(options['url']))
+            else:
+                with self._banco_descartavel():
+                    ids = preparar_cadastros(especialidades, guiches, medicos)
+                    relatorio = self._simular(ids, cenario, options)
+        finally:
+            registro.setLevel(nivel)
+
+        self._imprimir(relatorio)
+        if options['arquivo_json']:
+            with open(options['arquivo_json'], 'w', encoding='utf-8') as arquivo:
+                json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+
+    def _simular(self, ids, cenario, options, fabrica_cliente=None):
+        especialidades, guiches, medicos = ids
+        if not (especialidades and guiches and medicos):
+            raise SystemExit('É preciso ao menos um guichê e um médico ativos.')
+        extras = {'fabrica_cliente': fabrica_cliente} if fabrica_cliente else {}
+        simulacao = Simulacao(especialidades, guiches, medicos, semente=options['semente'], **cenario, **extras)
+        self.stdout.write(
+            f'Simulando {cenario["horas"]}h em {simulacao.duracao:.0f}s: {cenario["totens"]} totem(ns), '
+            f'{len(guiches)} guichê(s), {len(medicos)} médico(s), {cenario["paineis"]} painel(is)'
+        )
+        return simulacao.executar()
+
+    @contextmanager
+    def _banco_descartavel(self):
+        nome_original = connection.settings_dict['NAME']
+        with tempfile.TemporaryDirectory() as diretorio:
+            if connection.vendor == 'sqlite':
+                # Em arquivo (não em memória), para as threads concorrerem como processos
+                connection.settings_dict['TEST']['NAME'] = os.path.join(diretorio, 'carga.sqlite3')
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                yield
+            finally:
+                connection.creation.destroy_test_db(nome_original, verbosity=0)
+
+    def _imprimir(self, relatorio):
+        self.stdout.write(
+            f'\n{relatorio["senhas_emitidas"]} senhas emitidas, {relatorio["consultas_concluidas"]} '
+            f'consultas concluídas em {relatorio["duracao_segundos"]}s '
+            f'({relatorio["requisicoes_por_segundo"]} req/s)\n'
+        )
+        self.stdout.write(
+            f'{"rota":<34}{"req":>7}{"req/s":>9}{"p50 ms":>9}{"p99 ms":>9}'
+            f'{"consultas":>11}{"máx":>6}{"erros":>7}'
+        )
+        for rota in relatorio['rotas']:
+            consultas = '-' if rota['consultas_media'] is None else rota['consultas_media']
+            maximo = '-' if rota['consultas_max'] is None else rota['consultas_max']
+            linha = (
+                f'{rota["rota"]:<34}{rota["requisicoes"]:>7}{rota["por_segundo"]:>9}'
+                f'{rota["p50_ms"]:>9}{rota["p99_ms"]:>9}{consultas:>11}{maximo:>6}{rota["erros"]:>7}'
+            )
+            self.stdout.write(self.style.ERROR(linha) if rota['erros'] else linha)
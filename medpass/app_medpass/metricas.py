@@ -0,0 +1,289 @@
+"""
+Métricas do processo no formato texto do Prometheus (GET /metricas/).
+
+Sem cliente nem serviço externo: um registro local guarda contadores,
+medidores e histogramas com rótulos e os escreve no formato de exposição
+0.0.4 a cada coleta.
+
+- Requisições: latência e tempo de SQL por view e método, quantidade de
+  consultas e status, observados pelo MedicaoConsultasMiddleware (que já
+  mede as consultas de cada requisição, consultas.py);
+- Senhas: emissões por tipo e especialidade, transições por aresta de status
+  e o tamanho das filas aguardando_guiche/aguardando_medico, mantidos por um
+  assinante do barramento (MetricasSenhas) a partir dos eventos. As filas só
+  são contadas no banco na primeira coleta, depois de um evento que não diz
+  de onde a senha saiu e a cada RECONTAGEM segundos (corrige desvios); as
+  demais coletas não consultam a tabela.
+
+Cada worker tem o próprio registro. Com o barramento 'local' as métricas de
+senhas de um worker só veem as senhas que ele mesmo alterou (as filas se
+acertam na recontagem); com o 'banco', cada worker recebe os eventos de todos.
+"""
+import math
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.models import Count
+
+from .eventos import obter_barramento
+from .models import Senha
+
+CONFIGURACAO_PADRAO = {
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'RECONTAGEM': 5 * 60,
+}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Métodos fora desta lista viram 'outro' (o rótulo não cresce com o que o cliente mandar)
+METODOS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+FILAS = tuple(Senha.ENTRADA_NA_FILA)
+
+
+def configuracao():
+    return {**CONFIGURACAO_PADRAO, **getattr(settings, 'MEDPASS_METRICAS', {})}
+
+
+def _numero(valor):
+    if valor == math.inf:
+        return '+Inf'
+    return str(valor) if isinstance(valor, int) else repr(float(valor))
+
+
+def _escapar(valor):
+    return valor.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _rotulos(pares):
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + '}'
+
+
+class Metrica:
+    """Série de valores por combinação de rótulos"""
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def _chave(self, rotulos):
+        return tuple('' if rotulos[nome] is None else str(rotulos[nome]) for nome in self.rotulos)
+
+    def _amostras(self, chave, valor):
+        """[(sufixo, rótulos extras, valor)] de uma série"""
+        return [('', (), valor)]
+
+    def exposicao(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} {self.tipo}']
+        with self._lock:
+            series = sorted(self._valores.items())
+            series = [(chave, self._amostras(chave, valor)) for chave, valor in series]
+        for chave, amostras in series:
+            for sufixo, extras, valor in amostras:
+                pares = (*zip(self.rotulos, chave), *extras)
+                linhas.append(f'{self.nome}{sufixo}{_rotulos(pares)} {_numero(valor)}')
+        return '\n'.join(linhas)
+
+
+class Contador(Metrica):
+    tipo = 'counter'
+
+    def incrementar(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def valor(self, **rotulos):
+        return self._valores.get(self._chave(rotulos), 0)
+
+
+class Medidor(Contador):
+    tipo = 'gauge'
+
+    def substituir(self, valores):
+        """Troca todas as séries por `valores` ({(rótulos em ordem): valor}); as ausentes vão a zero"""
+        valores = {tuple('' if v is None else str(v) for v in chave): valor for chave, valor in valores.items()}
+        with self._lock:
+            self._valores = {**dict.fromkeys(self._valores, 0), **valores}
+
+
+class Histograma(Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=CONFIGURACAO_PADRAO['BUCKETS']):
+        super().__init__(nome, ajuda, rotulos)
+        self.buckets = tuple(sorted(buckets))
+
+    def observar(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            if chave not in self._valores:
+                # Contagem por bucket (não acumulada, o último é o +Inf) e soma
+                self._valores[chave] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie = self._valores[chave]
+            serie[0][bisect_left(self.buckets, valor)] += 1
+            serie[1] += valor
+
+    def contagem(self, **rotulos):
+        serie = self._valores.get(self._chave(rotulos))
+        return sum(serie[0]) if serie else 0
+
+    def _amostras(self, chave, valor):
+        contagens, soma = valor
+        amostras, acumulado = [], 0
+        for limite, quantidade in zip((*self.buckets, math.inf), contagens):
+            acumulado += quantidade
+            amostras.append(('_bucket', (('le', _numero(limite)),), acumulado))
+        return [*amostras, ('_sum', (), soma), ('_count', (), acumulado)]
+
+
+class Registro:
+    """Métricas expostas juntas no endpoint"""
+
+    def __init__(self):
+        self.metricas = []
+
+    def registrar(self, metrica):
+        self.metricas.append(metrica)
+        return metrica
+
+    def exposicao(self):
+        return '\n'.join(metrica.exposicao() for metrica in self.metricas) + '\n'
+
+
+registro = Registro()
+_buckets = configuracao()['BUCKETS']
+
+REQUISICOES = registro.registrar(Contador(
+    'medpass_requisicoes_total', 'Requisições atendidas', ('view', 'metodo', 'status'),
+))
+LATENCIA = registro.registrar(Histograma(
+    'medpass_requisicao_segundos', 'Duração das requisições (até o primeiro byte)', ('view', 'metodo'), _buckets,
+))
+TEMPO_BANCO = registro.registrar(Histograma(
+    'medpass_requisicao_banco_segundos', 'Tempo de SQL por requisição', ('view', 'metodo'), _buckets,
+))
+CONSULTAS = registro.registrar(Contador(
+    'medpass_consultas_total', 'Consultas ao banco feitas pelas requisições', ('view', 'metodo'),
+))
+EMITIDAS = registro.registrar(Contador(
+    'medpass_senhas_emitidas_total', 'Senhas emitidas', ('tipo', 'especialidade_id'),
+))
+TRANSICOES = registro.registrar(Contador(
+    'medpass_transicoes_total', 'Mudanças de status das senhas (rechamadas contam como de=para)', ('de', 'para'),
+))
+TAMANHO_FILA = registro.registrar(Medidor(
+    'medpass_fila_senhas', 'Senhas em espera por fila e especialidade', ('fila', 'especialidade_id'),
+))
+
+
+def nome_da_view(request):
+    """Nome da rota atendida (nas ViewSets, uma por ação junto com o método)"""
+    rota = getattr(request, 'resolver_match', None)
+    if rota is None:
+        return 'nao_encontrada'
+    return rota.view_name or rota._func_path
+
+
+def observar_requisicao(request, status, segundos, consultas):
+    """Registra uma requisição: status, duração e o RegistroConsultas dela"""
+    rotulos = {
+        'view': nome_da_view(request),
+        'metodo': request.method if request.method in METODOS else 'outro',
+    }
+    REQUISICOES.incrementar(status=status, **rotulos)
+    LATENCIA.observar(segundos, **rotulos)
+    TEMPO_BANCO.observar(consultas.segundos, **rotulos)
+    CONSULTAS.incrementar(consultas.quantidade, **rotulos)
+
+
+class MetricasSenhas:
+    """Emissões, transições e tamanho das filas, alimentados pelos eventos do barramento"""
+
+    def __init__(self, barramento, recontagem=300):
+        self.barramento = barramento
+        self.recontagem = recontagem
+        self._lock = threading.Lock()
+        # Id do evento até o qual a última contagem já inclui (None: filas por contar)
+        self._base = None
+        self._contado_em = 0.0
+        barramento.assinar(self._registrar)
+
+    def encerrar(self):
+        self.barramento.cancelar_assinatura(self._registrar)
+
+    def _registrar(self, evento_id, evento):
+        tipo = evento.get('evento')
+        especialidade = evento.get('especialidade_id')
+        if tipo == 'criada':
+            EMITIDAS.incrementar(tipo=evento['tipo'], especialidade_id=especialidade)
+            movimentos = [(None, evento['status'], especialidade, 1)]
+        elif tipo in ('status', 'rechamada') and evento.get('status_anterior'):
+            movimentos = [(evento['status_anterior'], evento['status'], especialidade, 1)]
+        elif tipo == 'removida':
+            movimentos = [(evento['status'], None, especialidade, 1)]
+        elif tipo == 'lote' and 'contagem' in evento:
+            movimentos = [(de, evento['status'], esp, n) for de, esp, n in evento['contagem']]
+        elif tipo in ('status', 'lote'):
+            # save() sem o estado carregado: não se sabe de que fila a senha saiu
+            with self._lock:
+                self._base = None
+            return
+        else:
+            return
+
+        for de, para, _, quantidade in movimentos:
+            if de and para:
+                TRANSICOES.incrementar(quantidade, de=de, para=para)
+        with self._lock:
+            if self._base is None or evento_id <= self._base:
+                return
+            for de, para, esp, quantidade in movimentos:
+                if de in FILAS:
+                    TAMANHO_FILA.incrementar(-quantidade, fila=de, especialidade_id=esp)
+                if para in FILAS:
+                    TAMANHO_FILA.incrementar(quantidade, fila=para, especialidade_id=esp)
+
+    def atualizar(self, forcar=False):
+        """Conta as filas no banco se ainda não contou, se a contagem foi invalidada ou venceu"""
+        vencida = self.recontagem and time.monotonic() - self._contado_em >= self.recontagem
+        if self._base is not None and not vencida and not forcar:
+            return
+        # Eventos de outros workers chegam antes, para não serem aplicados sobre a contagem
+        self.barramento.sincronizar()
+        with self._lock:
+            contagem = (
+                Senha.objects.filter(status__in=FILAS)
+                .values_list('status', 'especialidade_id').annotate(n=Count('id')).order_by()
+            )
+            TAMANHO_FILA.substituir({(status, especialidade): n for status, especialidade, n in contagem})
+            self._base = self.barramento.ultimo_id
+            self._contado_em = time.monotonic()
+
+
+_metricas_senhas = None
+_lock_metricas = threading.Lock()
+
+
+def obter_metricas_senhas():
+    """Retorna as métricas de senhas do processo, assinadas no barramento"""
+    global _metricas_senhas
+    if _metricas_senhas is None:
+        with _lock_metricas:
+            if _metricas_senhas is None:
+                _metricas_senhas = MetricasSenhas(obter_barramento(), configuracao()['RECONTAGEM'])
+    return _metricas_senhas
+
+
+def exposicao():
+    """Texto do endpoint: atualiza as filas se preciso e escreve todas as métricas"""
+    obter_metricas_senhas().atualizar()
+    return registro.exposicao()
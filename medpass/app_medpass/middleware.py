@@ -0,0 +1,117 @@
+import logging
+import math
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from . import consultas, metricas, roteamento
+from .banco import banco_ocupado
+
+logger = logging.getLogger(__name__)
+
+# Segundos sugeridos ao cliente antes de repetir a requisição
+TENTAR_DE_NOVO_EM = 1
+
+
+class BancoOcupadoMiddleware(MiddlewareMixin):
+    """
+    Responde 503 com Retry-After quando a requisição falha por lock no banco
+    (ex.: "database is locked" no SQLite), em vez de um 500 com o erro cru.
+    O 503 diz ao cliente que pode repetir a ação; um 500 indicaria defeito.
+    (Com MiddlewareMixin as views assíncronas continuam no event loop.)
+    """
+
+    def process_exception(self, request, exception):
+        if not banco_ocupado(exception):
+            return None
+        resposta = JsonResponse(
+            {'error': 'Sistema ocupado no momento. Tente novamente em instantes.'}, status=503
+        )
+        resposta['Retry-After'] = str(TENTAR_DE_NOVO_EM)
+        return resposta
+
+
+class ReplicaMiddleware:
+    """
+    Isola o estado do roteador por requisição e fixa no principal, por
+    ATRASO_MAXIMO segundos, o cliente que acabou de escrever.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with roteamento.requisicao(fixado=roteamento.COOKIE in request.COOKIES):
+            resposta = self.get_response(request)
+            return self._fixar_cliente(request, resposta)
+
+    async def __acall__(self, request):
+        with roteamento.requisicao(fixado=roteamento.COOKIE in request.COOKIES):
+            resposta = await self.get_response(request)
+            return self._fixar_cliente(request, resposta)
+
+    def _fixar_cliente(self, request, resposta):
+        escreveu = request.method not in ('GET', 'HEAD', 'OPTIONS') or roteamento.escreveu()
+        if escreveu and roteamento.alias_replica() is not None:
+            resposta.set_cookie(
+                roteamento.COOKIE, '1', max_age=math.ceil(roteamento.configuracao()['ATRASO_MAXIMO']),
+                httponly=True, samesite='Lax',
+            )
+        return resposta
+
+
+class MedicaoConsultasMiddleware:
+    """
+    Mede as consultas de cada requisição (consultas.py): põe o cabeçalho
+    Server-Timing (se SERVER_TIMING), registra no log as requisições acima do
+    orçamento da view e as que repetem a mesma consulta (suspeita de N+1) e
+    alimenta as métricas de latência e SQL por view (metricas.py).
+    Respostas em fluxo só contam as consultas feitas antes do primeiro byte.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        inicio = time.perf_counter()
+        with consultas.medir_consultas() as registro:
+            resposta = self.get_response(request)
+        return self._relatar(request, resposta, registro, time.perf_counter() - inicio)
+
+    async def __acall__(self, request):
+        inicio = time.perf_counter()
+        with consultas.medir_consultas() as registro:
+            resposta = await self.get_response(request)
+        return self._relatar(request, resposta, registro, time.perf_counter() - inicio)
+
+    def _relatar(self, request, resposta, registro, segundos):
+        metricas.observar_requisicao(request, resposta.status_code, segundos, registro)
+        config = consultas.configuracao()
+        if config['SERVER_TIMING']:
+            anterior = resposta.get('Server-Timing')
+            valor = registro.server_timing(segundos)
+            resposta['Server-Timing'] = f'{anterior}, {valor}' if anterior else valor
+
+        orcamento = consultas.orcamento_da_view(request) or config['ORCAMENTO_PADRAO']
+        if registro.quantidade > orcamento:
+            logger.warning(
+                '%s %s: %d consultas (orçamento %d), %.1f ms de SQL',
+                request.method, request.path, registro.quantidade, orcamento, registro.segundos * 1000,
+            )
+        for sql, vezes in registro.repetidas(config['REPETICOES_SUSPEITAS']):
+            logger.warning('%s %s: consulta repetida %dx (N+1?): %s', request.method, request.path, vezes, sql)
+        return resposta
@@ -0,0 +1,28 @@
+# Generated manually
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_medpass', '0004_especialidade_sigla'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SequenciaSenha',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(verbose_name='Data')),
+                ('tipo', models.CharField(choices=[('N', 'Normal'), ('P', 'Preferencial'), ('U', 'Urgência')], max_length=1, verbose_name='Tipo de Senha')),
+                ('sigla', models.CharField(max_length=3, verbose_name='Sigla da Especialidade')),
+                ('ultimo', models.PositiveIntegerField(default=0, help_text='Último sequencial emitido no dia para este prefixo', verbose_name='Último Sequencial')),
+            ],
+            options={
+                'verbose_name': 'Sequência de Senha',
+                'verbose_name_plural': 'Sequências de Senha',
+                'unique_together': {('data', 'tipo', 'sigla')},
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated manually
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_medpass', '0005_sequenciasenha'),
+    ]
+
+    operations = [
+        # Filas por etapa
+        migrations.AddIndex(
+            model_name='senha',
+            index=models.Index(fields=['status', 'criado_em'], name='senha_status_criado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='senha',
+            index=models.Index(fields=['status', 'especialidade', 'triagem_finalizada_em'], name='senha_status_esp_triagem_idx'),
+        ),
+        # Chamadas e finalizações
+        migrations.AddIndex(
+            model_name='senha',
+            index=models.Index(fields=['status', 'chamado_guiche_em'], name='senha_status_cham_guiche_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='senha',
+            index=models.Index(fields=['status', 'chamado_medico_em'], name='senha_status_cham_medico_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='senha',
+            index=models.Index(fields=['status', 'concluido_em'], name='senha_status_concluido_idx'),
+        ),
+        # Índices parciais das senhas em atendimento
+        migrations.AddIndex(
+            model_name='senha',
+            index=models.Index(
+                condition=models.Q(('status__in', ['chamando_guiche', 'em_triagem'])),
+                fields=['guiche', 'status'],
+                name='senha_guiche_ativa_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='senha',
+            index=models.Index(
+                condition=models.Q(('status__in', ['chamando_medico', 'em_consulta'])),
+                fields=['profissional', 'status'],
+                name='senha_medico_ativa_idx'
+            ),
+        ),
+        # Intervalos do dia
+        migrations.AddIndex(
+            model_name='senha',
+            index=models.Index(fields=['criado_em'], name='senha_criado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='senha',
+            index=models.Index(fields=['concluido_em'], name='senha_concluido_idx'),
+        ),
+    ]
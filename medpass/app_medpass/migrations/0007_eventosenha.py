@@ -0,0 +1,26 @@
+# Generated manually
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_medpass', '0006_senha_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoSenha',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('evento', models.JSONField(verbose_name='Evento')),
+                ('criado_em', models.DateTimeField(auto_now_add=True, verbose_name='Data de Criação')),
+            ],
+            options={
+                'verbose_name': 'Evento de Senha',
+                'verbose_name_plural': 'Eventos de Senha',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated manually
+
+from django.conf import settings
+from django.db import migrations, models
+
+ENTRADA_NA_FILA = {
+    'aguardando_guiche': 'criado_em',
+    'aguardando_medico': 'triagem_finalizada_em',
+}
+BONUS_PRIORIDADE = {'U': 4 * 60 * 60, 'P': 30 * 60, 'N': 0}
+
+
+def preencher_prioridade(apps, schema_editor):
+    """Calcula a prioridade das senhas que já estão em alguma fila de espera"""
+    Senha = apps.get_model('app_medpass', 'Senha')
+    bonus = getattr(settings, 'MEDPASS_PRIORIDADE', BONUS_PRIORIDADE)
+    for status, campo in ENTRADA_NA_FILA.items():
+        senhas = Senha.objects.filter(status=status).only('id', 'tipo', 'criado_em', campo)
+        for senha in senhas.iterator():
+            entrada = getattr(senha, campo) or senha.criado_em
+            senha.prioridade = int(entrada.timestamp()) - bonus.get(senha.tipo, 0)
+            senha.save(update_fields=['prioridade'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_medpass', '0007_eventosenha'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='senha',
+            name='prioridade',
+            field=models.BigIntegerField(blank=True, editable=False, help_text='Chave de ordenação na fila de espera atual (menor é chamada antes)', null=True, verbose_name='Prioridade na Fila'),
+        ),
+        migrations.RunPython(preencher_prioridade, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='senha',
+            index=models.Index(fields=['status', 'prioridade'], name='senha_fila_guiche_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='senha',
+            index=models.Index(fields=['status', 'especialidade', 'prioridade'], name='senha_fila_medico_idx'),
+        ),
+    ]
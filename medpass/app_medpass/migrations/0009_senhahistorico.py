@@ -0,0 +1,43 @@
+# Generated manually
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_medpass', '0008_senha_prioridade'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SenhaHistorico',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID da Senha')),
+                ('mes', models.DateField(help_text='Primeiro dia do mês em que a senha foi emitida', verbose_name='Mês de Emissão')),
+                ('numero', models.CharField(max_length=10, verbose_name='Número da Senha')),
+                ('tipo', models.CharField(choices=[('N', 'Normal'), ('P', 'Preferencial'), ('U', 'Urgência')], max_length=1, verbose_name='Tipo de Senha')),
+                ('status', models.CharField(choices=[('aguardando_guiche', 'Aguardando Guichê'), ('chamando_guiche', 'Chamando no Guichê'), ('em_triagem', 'Em Triagem'), ('aguardando_medico', 'Aguardando Médico'), ('chamando_medico', 'Chamando para Consulta'), ('em_consulta', 'Em Consulta'), ('concluido', 'Concluído'), ('cancelado', 'Cancelado'), ('desistencia', 'Desistência')], max_length=20, verbose_name='Status')),
+                ('nome_paciente', models.CharField(blank=True, max_length=200, verbose_name='Nome do Paciente')),
+                ('observacoes_triagem', models.TextField(blank=True, verbose_name='Observações da Triagem')),
+                ('criado_em', models.DateTimeField(verbose_name='Data de Criação')),
+                ('chamado_guiche_em', models.DateTimeField(blank=True, null=True, verbose_name='Chamado no Guichê em')),
+                ('triagem_iniciada_em', models.DateTimeField(blank=True, null=True, verbose_name='Triagem Iniciada em')),
+                ('triagem_finalizada_em', models.DateTimeField(blank=True, null=True, verbose_name='Triagem Finalizada em')),
+                ('chamado_medico_em', models.DateTimeField(blank=True, null=True, verbose_name='Chamado pelo Médico em')),
+                ('consulta_iniciada_em', models.DateTimeField(blank=True, null=True, verbose_name='Consulta Iniciada em')),
+                ('concluido_em', models.DateTimeField(blank=True, null=True, verbose_name='Data de Conclusão')),
+                ('arquivado_em', models.DateTimeField(auto_now_add=True, verbose_name='Arquivado em')),
+                ('especialidade', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='senhas_arquivadas', to='app_medpass.especialidade', verbose_name='Especialidade')),
+                ('guiche', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='senhas_arquivadas', to='app_medpass.guiche', verbose_name='Guichê')),
+                ('profissional', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='senhas_arquivadas', to='app_medpass.profissional', verbose_name='Médico')),
+            ],
+            options={
+                'verbose_name': 'Senha Arquivada',
+                'verbose_name_plural': 'Senhas Arquivadas',
+                'ordering': ['-criado_em'],
+                'indexes': [models.Index(fields=['mes', 'criado_em'], name='senha_hist_mes_criado_idx'), models.Index(fields=['mes', 'especialidade'], name='senha_hist_mes_esp_idx')],
+            },
+        ),
+    ]
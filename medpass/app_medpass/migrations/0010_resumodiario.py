@@ -0,0 +1,35 @@
+# Generated manually
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_medpass', '0009_senhahistorico'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(verbose_name='Data')),
+                ('tipo', models.CharField(choices=[('N', 'Normal'), ('P', 'Preferencial'), ('U', 'Urgência')], max_length=1, verbose_name='Tipo de Senha')),
+                ('emitidas', models.PositiveIntegerField(default=0, verbose_name='Emitidas')),
+                ('concluidas', models.PositiveIntegerField(default=0, verbose_name='Concluídas')),
+                ('canceladas', models.PositiveIntegerField(default=0, verbose_name='Canceladas')),
+                ('desistencias', models.PositiveIntegerField(default=0, verbose_name='Desistências')),
+                ('duracoes', models.JSONField(blank=True, default=dict, help_text='Sketch de quantis por métrica (segundos)', verbose_name='Distribuições de Tempo')),
+                ('atualizado_em', models.DateTimeField(auto_now=True, verbose_name='Atualizado em')),
+                ('especialidade', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='resumos_diarios', to='app_medpass.especialidade', verbose_name='Especialidade')),
+            ],
+            options={
+                'verbose_name': 'Resumo Diário',
+                'verbose_name_plural': 'Resumos Diários',
+                'ordering': ['data', 'especialidade', 'tipo'],
+                'unique_together': {('data', 'especialidade', 'tipo')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated manually
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_medpass', '0010_resumodiario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstimativaEspera',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave', models.CharField(help_text='Etapa e, opcionalmente, especialidade (ex.: medico:3)', max_length=40, unique=True, verbose_name='Fila')),
+                ('fatias', models.JSONField(default=list, help_text='Pares [início (timestamp), sketch] das fatias de tempo', verbose_name='Fatias da Janela')),
+                ('atualizado_em', models.DateTimeField(auto_now=True, verbose_name='Atualizado em')),
+            ],
+            options={
+                'verbose_name': 'Estimativa de Espera',
+                'verbose_name_plural': 'Estimativas de Espera',
+            },
+        ),
+    ]
@@ -1,8 +1,25 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, connections, router, transaction, IntegrityError
 from django.core.validators import RegexValidator
+from django.utils import timezone
+from datetime import datetime, time, timedelta
 
 # Create your models here.
 
+
+def filtro_do_dia(campo, data=None):
+    """
+    Retorna um Q que seleciona o dia `data` (hoje, se omitido) no campo informado.
+
+    Usa um intervalo [00:00, 00:00 do dia seguinte) no fuso local em vez de
+    `campo__date`, que aplica uma função sobre a coluna e impede o uso de índice.
+    """
+    data = data or timezone.localdate()
+    inicio = timezone.make_aware(datetime.combine(data, time.min))
+    fim = timezone.make_aware(datetime.combine(data + timedelta(days=1), time.min))
+    return models.Q(**{f'{campo}__gte': inicio, f'{campo}__lt': fim})
+
+
 class Especialidade(models.Model):
     """
     Modelo para armazenar as especialidades médicas disponíveis no sistema.
@@ -291,14 +308,102 @@ class Senha(models.Model):
         verbose_name="Data de Conclusão"
     )
     
+    # Fila (ver filas.py)
+    prioridade = models.BigIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Prioridade na Fila",
+        help_text="Chave de ordenação na fila de espera atual (menor é chamada antes)"
+    )
+    
     class Meta:
         verbose_name = "Senha"
         verbose_name_plural = "Senhas"
         ordering = ['-criado_em']
+        indexes = [
+            # Filas: status + ordem de chegada em cada etapa
+            models.Index(fields=['status', 'criado_em'], name='senha_status_criado_idx'),
+            models.Index(fields=['status', 'especialidade', 'triagem_finalizada_em'], name='senha_status_esp_triagem_idx'),
+            # Chamadas atuais e últimas chamadas do painel
+            models.Index(fields=['status', 'chamado_guiche_em'], name='senha_status_cham_guiche_idx'),
+            models.Index(fields=['status', 'chamado_medico_em'], name='senha_status_cham_medico_idx'),
+            models.Index(fields=['status', 'concluido_em'], name='senha_status_concluido_idx'),
+            # Atendimento em andamento por guichê/médico (parciais: só senhas ativas)
+            models.Index(
+                fields=['guiche', 'status'],
+                condition=models.Q(status__in=['chamando_guiche', 'em_triagem']),
+                name='senha_guiche_ativa_idx'
+            ),
+            models.Index(
+                fields=['profissional', 'status'],
+                condition=models.Q(status__in=['chamando_medico', 'em_consulta']),
+                name='senha_medico_ativa_idx'
+            ),
+            # Próxima senha de cada fila (ver filas.py)
+            models.Index(fields=['status', 'prioridade'], name='senha_fila_guiche_idx'),
+            models.Index(fields=['status', 'especialidade', 'prioridade'], name='senha_fila_medico_idx'),
+            # Estatísticas do dia (intervalos, ver filtro_do_dia)
+            models.Index(fields=['criado_em'], name='senha_criado_idx'),
+            models.Index(fields=['concluido_em'], name='senha_concluido_idx'),
+        ]
     
     def __str__(self):
         return f"{self.numero} - {self.get_tipo_display()} - {self.especialidade.nome}"
     
+    # Campos comparados no post_save para publicar eventos (ver signals.py)
+    CAMPOS_RASTREADOS = ('status', 'chamado_guiche_em', 'chamado_medico_em')
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._estado_carregado = instancia.estado_rastreado()
+        return instancia
+    
+    def estado_rastreado(self):
+        return {campo: self.__dict__.get(campo) for campo in self.CAMPOS_RASTREADOS}
+    
+    # Momento de entrada em cada fila de espera
+    ENTRADA_NA_FILA = {
+        'aguardando_guiche': 'criado_em',
+        'aguardando_medico': 'triagem_finalizada_em',
+    }
+    
+    # Vantagem, em segundos, de cada tipo sobre uma senha Normal de mesma entrada
+    BONUS_PRIORIDADE = {'U': 4 * 60 * 60, 'P': 30 * 60, 'N': 0}
+    
+    @classmethod
+    def calcular_prioridade(cls, tipo, entrada):
+        """
+        Chave da senha na fila: instante de entrada (segundos) menos o bônus do tipo.
+
+        A chave não muda enquanto a senha espera, e o envelhecimento sai de graça:
+        uma Normal que já espera mais que o bônus da Preferencial fica à frente
+        de uma Preferencial recém-chegada. Os bônus podem ser trocados em
+        settings.MEDPASS_PRIORIDADE.
+        """
+        bonus = getattr(settings, 'MEDPASS_PRIORIDADE', cls.BONUS_PRIORIDADE)
+        return int(entrada.timestamp()) - bonus.get(tipo, 0)
+    
+    def atualizar_prioridade(self):
+        """Recalcula `prioridade` se a senha está numa fila de espera"""
+        campo = self.ENTRADA_NA_FILA.get(self.status)
+        if campo is None:
+            return
+        entrada = getattr(self, campo)
+        if entrada is None:
+            if self.prioridade is not None:
+                return
+            entrada = timezone.now()
+        self.prioridade = self.calcular_prioridade(self.tipo, entrada)
+    
+    def save(self, *args, **kwargs):
+        self.atualizar_prioridade()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'prioridade' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'prioridade']
+        super().save(*args, **kwargs)
+    
     @classmethod
     def gerar_numero(cls, tipo, especialidade):
         """
@@ -306,30 +411,15 @@ class Senha(models.Model):
         Ex: NC001 (Normal + Cardiologia + 001)
             PD002 (Preferencial + Dermatologia + 002)
             UG003 (Urgência + Clínica Geral + 003)
+
+        O sequencial vem de SequenciaSenha, incrementado atomicamente no banco,
+        então o custo é o mesmo na senha 5 ou na 5.000 e dois totens nunca
+        recebem o mesmo número.
         """
-        from django.utils import timezone
-        from django.db.models import Max
-        
-        hoje = timezone.now().date()
-        prefixo = f"{tipo}{especialidade.sigla}"
-        
-        # Busca o último número do dia para esta combinação
-        ultima_senha = cls.objects.filter(
-            numero__startswith=prefixo,
-            criado_em__date=hoje
-        ).aggregate(Max('numero'))['numero__max']
-        
-        if ultima_senha:
-            # Extrai o número sequencial
-            try:
-                ultimo_seq = int(ultima_senha[len(prefixo):])
-                novo_seq = ultimo_seq + 1
-            except ValueError:
-                novo_seq = 1
-        else:
-            novo_seq = 1
-        
-        return f"{prefixo}{novo_seq:03d}"
+        hoje = timezone.localdate()
+        novo_seq = SequenciaSenha.proximo(hoje, tipo, especialidade.sigla)
+
+        return f"{tipo}{especialidade.sigla}{novo_seq:03d}"
     
     @property
     def etapa_atual(self):
@@ -340,3 +430,292 @@ class Senha(models.Model):
             return 'medico'
         else:
             return 'finalizado'
+
+
+class SequenciaSenha(models.Model):
+    """
+    Contador diário usado na numeração das senhas.
+
+    Existe uma linha por (data, tipo, sigla). O incremento é feito no próprio
+    banco (UPDATE ... RETURNING ou F()), sem contar as senhas já emitidas.
+    """
+    data = models.DateField(
+        verbose_name="Data"
+    )
+    tipo = models.CharField(
+        max_length=1,
+        choices=Senha.TIPO_CHOICES,
+        verbose_name="Tipo de Senha"
+    )
+    sigla = models.CharField(
+        max_length=3,
+        verbose_name="Sigla da Especialidade"
+    )
+    ultimo = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Último Sequencial",
+        help_text="Último sequencial emitido no dia para este prefixo"
+    )
+
+    class Meta:
+        verbose_name = "Sequência de Senha"
+        verbose_name_plural = "Sequências de Senha"
+        unique_together = [['data', 'tipo', 'sigla']]
+
+    def __str__(self):
+        return f"{self.data} {self.tipo}{self.sigla}: {self.ultimo}"
+
+    @classmethod
+    def proximo(cls, data, tipo, sigla):
+        """
+        Incrementa e retorna o sequencial de (data, tipo, sigla).
+
+        No caminho comum é um único UPDATE. A primeira senha do dia para o
+        prefixo cria a linha, partindo do maior número já emitido no dia
+        (senhas geradas antes desta tabela existir).
+        """
+        novo = cls._incrementar(data, tipo, sigla)
+        if novo is not None:
+            return novo
+
+        inicial = cls._ultimo_emitido(data, f"{tipo}{sigla}")
+        try:
+            with transaction.atomic(using=router.db_for_write(cls)):
+                cls.objects.create(data=data, tipo=tipo, sigla=sigla, ultimo=inicial + 1)
+            return inicial + 1
+        except IntegrityError:
+            # Outro totem criou a linha ao mesmo tempo
+            return cls._incrementar(data, tipo, sigla)
+
+    @classmethod
+    def _incrementar(cls, data, tipo, sigla):
+        """
+        Incrementa a linha existente; retorna None se ela ainda não existe.
+
+        UPDATE ... RETURNING só no PostgreSQL e no SQLite 3.35+ (a flag de
+        RETURNING do Django é a do INSERT: o MariaDB a tem, mas não aceita
+        RETURNING no UPDATE, e o Oracle usa RETURNING ... INTO). Nos demais,
+        UPDATE com F() e releitura na mesma transação.
+        """
+        alias = router.db_for_write(cls)
+        conexao = connections[alias]
+        if conexao.vendor in ('sqlite', 'postgresql') and conexao.features.can_return_columns_from_insert:
+            qn = conexao.ops.quote_name
+            sql = (
+                f"UPDATE {qn(cls._meta.db_table)} SET {qn('ultimo')} = {qn('ultimo')} + 1 "
+                f"WHERE {qn('data')} = %s AND {qn('tipo')} = %s AND {qn('sigla')} = %s "
+                f"RETURNING {qn('ultimo')}"
+            )
+            with conexao.cursor() as cursor:
+                cursor.execute(sql, [conexao.ops.adapt_datefield_value(data), tipo, sigla])
+                row = cursor.fetchone()
+            return row[0] if row else None
+
+        with transaction.atomic(using=alias):
+            filtro = cls.objects.using(alias).filter(data=data, tipo=tipo, sigla=sigla)
+            if not filtro.update(ultimo=models.F('ultimo') + 1):
+                return None
+            return filtro.values_list('ultimo', flat=True).get()
+
+    @staticmethod
+    def _ultimo_emitido(data, prefixo):
+        ultima_senha = Senha.objects.filter(
+            filtro_do_dia('criado_em', data),
+            numero__startswith=prefixo
+        ).aggregate(models.Max('numero'))['numero__max']
+
+        if not ultima_senha:
+            return 0
+        try:
+            return int(ultima_senha[len(prefixo):])
+        except ValueError:
+            return 0
+
+
+class EventoSenha(models.Model):
+    """
+    Evento do barramento de senhas gravado em tabela (backend 'banco').
+
+    Permite que vários workers compartilhem a mesma sequência de eventos sem
+    serviços externos; ver app_medpass/eventos.py.
+    """
+    evento = models.JSONField(
+        verbose_name="Evento"
+    )
+    criado_em = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Data de Criação"
+    )
+
+    class Meta:
+        verbose_name = "Evento de Senha"
+        verbose_name_plural = "Eventos de Senha"
+        ordering = ['id']
+
+    def __str__(self):
+        return f"#{self.id} {self.evento.get('numero', '')} {self.evento.get('status', '')}"
+
+
+class SenhaHistorico(models.Model):
+    """
+    Senhas finalizadas de dias anteriores, movidas de Senha pelo arquivamento.
+
+    Tabela só de inserção, com o mesmo id e os mesmos campos de Senha, o que
+    mantém a tabela quente com o tamanho de um dia. `mes` (primeiro dia do mês
+    de emissão) é a chave de partição: o SQLite não tem particionamento
+    nativo, então as leituras por período filtram por `mes` e usam o índice
+    (mes, criado_em). Ver app_medpass/arquivamento.py.
+    """
+    id = models.BigIntegerField(
+        primary_key=True,
+        verbose_name="ID da Senha"
+    )
+    mes = models.DateField(
+        verbose_name="Mês de Emissão",
+        help_text="Primeiro dia do mês em que a senha foi emitida"
+    )
+    numero = models.CharField(
+        max_length=10,
+        verbose_name="Número da Senha"
+    )
+    tipo = models.CharField(
+        max_length=1,
+        choices=Senha.TIPO_CHOICES,
+        verbose_name="Tipo de Senha"
+    )
+    especialidade = models.ForeignKey(
+        Especialidade,
+        on_delete=models.PROTECT,
+        related_name='senhas_arquivadas',
+        verbose_name="Especialidade"
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=Senha.STATUS_CHOICES,
+        verbose_name="Status"
+    )
+    guiche = models.ForeignKey(
+        Guiche,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='senhas_arquivadas',
+        verbose_name="Guichê"
+    )
+    profissional = models.ForeignKey(
+        Profissional,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='senhas_arquivadas',
+        verbose_name="Médico"
+    )
+    nome_paciente = models.CharField(
+        max_length=200,
+        blank=True,
+        verbose_name="Nome do Paciente"
+    )
+    observacoes_triagem = models.TextField(
+        blank=True,
+        verbose_name="Observações da Triagem"
+    )
+    criado_em = models.DateTimeField(verbose_name="Data de Criação")
+    chamado_guiche_em = models.DateTimeField(null=True, blank=True, verbose_name="Chamado no Guichê em")
+    triagem_iniciada_em = models.DateTimeField(null=True, blank=True, verbose_name="Triagem Iniciada em")
+    triagem_finalizada_em = models.DateTimeField(null=True, blank=True, verbose_name="Triagem Finalizada em")
+    chamado_medico_em = models.DateTimeField(null=True, blank=True, verbose_name="Chamado pelo Médico em")
+    consulta_iniciada_em = models.DateTimeField(null=True, blank=True, verbose_name="Consulta Iniciada em")
+    concluido_em = models.DateTimeField(null=True, blank=True, verbose_name="Data de Conclusão")
+    arquivado_em = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Arquivado em"
+    )
+
+    class Meta:
+        verbose_name = "Senha Arquivada"
+        verbose_name_plural = "Senhas Arquivadas"
+        ordering = ['-criado_em']
+        indexes = [
+            models.Index(fields=['mes', 'criado_em'], name='senha_hist_mes_criado_idx'),
+            models.Index(fields=['mes', 'especialidade'], name='senha_hist_mes_esp_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.numero} ({self.criado_em:%d/%m/%Y})"
+
+
+class ResumoDiario(models.Model):
+    """
+    Resumo pré-calculado de um dia de emissão por especialidade e tipo.
+
+    Contadores de senhas emitidas e finalizadas e, em `duracoes`, um sketch de
+    quantis (sketches.DDSketch serializado) por métrica de tempo. Atualizado
+    quando a senha é emitida e quando chega a um status final; recalculável
+    pelo comando `recalcular_resumos`. Ver app_medpass/resumos.py.
+    """
+    data = models.DateField(
+        verbose_name="Data"
+    )
+    especialidade = models.ForeignKey(
+        Especialidade,
+        on_delete=models.PROTECT,
+        related_name='resumos_diarios',
+        verbose_name="Especialidade"
+    )
+    tipo = models.CharField(
+        max_length=1,
+        choices=Senha.TIPO_CHOICES,
+        verbose_name="Tipo de Senha"
+    )
+    emitidas = models.PositiveIntegerField(default=0, verbose_name="Emitidas")
+    concluidas = models.PositiveIntegerField(default=0, verbose_name="Concluídas")
+    canceladas = models.PositiveIntegerField(default=0, verbose_name="Canceladas")
+    desistencias = models.PositiveIntegerField(default=0, verbose_name="Desistências")
+    duracoes = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name="Distribuições de Tempo",
+        help_text="Sketch de quantis por métrica (segundos)"
+    )
+    atualizado_em = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Atualizado em"
+    )
+
+    class Meta:
+        verbose_name = "Resumo Diário"
+        verbose_name_plural = "Resumos Diários"
+        ordering = ['data', 'especialidade', 'tipo']
+        unique_together = [['data', 'especialidade', 'tipo']]
+
+    def __str__(self):
+        return f"{self.data} {self.especialidade_id}/{self.tipo}: {self.emitidas} emitidas"
+
+
+class EstimativaEspera(models.Model):
+    """
+    Cópia periódica das janelas de espera em memória (estimativas.py), para
+    que as estimativas sigam válidas logo após reiniciar o servidor.
+    """
+    chave = models.CharField(
+        max_length=40,
+        unique=True,
+        verbose_name="Fila",
+        help_text="Etapa e, opcionalmente, especialidade (ex.: medico:3)"
+    )
+    fatias = models.JSONField(
+        default=list,
+        verbose_name="Fatias da Janela",
+        help_text="Pares [início (timestamp), sketch] das fatias de tempo"
+    )
+    atualizado_em = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Atualizado em"
+    )
+
+    class Meta:
+        verbose_name = "Estimativa de Espera"
+        verbose_name_plural = "Estimativas de Espera"
+
+    def __str__(self):
+        return self.chave
@@ -0,0 +1,155 @@
+"""
+Paginação por chave (keyset) para as listas de senhas.
+
+A página seguinte é buscada a partir do último (timestamp, id) visto, com
+`WHERE campo >= v AND (campo > v OR id > ultimo_id) ORDER BY campo, id LIMIT n`,
+que anda pelos índices de Senha. Não há OFFSET nem COUNT(*): uma página no
+fundo do histórico custa o mesmo que a primeira.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class PaginacaoKeyset(BasePagination):
+    """
+    Paginação por (campo de ordenação, id), com o campo tirado do order_by.
+
+    O queryset deve estar ordenado por um único campo (ex.: 'criado_em' ou
+    '-concluido_em') ou anotação; o id é usado como desempate. Em campos que
+    aceitam nulo (e nas anotações), as senhas sem valor vêm depois das
+    demais, ordenadas por id.
+    """
+    page_size = api_settings.PAGE_SIZE or 100
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limite'
+    invalid_cursor_message = 'Cursor inválido'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.proximo_cursor = None
+
+        campo, descendente = self._chave(queryset)
+        limite = self._limite(request)
+        cursor = self._ler_cursor(request)
+        if campo in queryset.query.annotations:
+            anulavel = True
+        else:
+            anulavel = queryset.model._meta.get_field(campo).null
+        comparacao = 'lt' if descendente else 'gt'
+        ordem_id = '-id' if descendente else 'id'
+
+        pagina = []
+        if cursor is None or cursor['valor'] is not None:
+            senhas = queryset.order_by(f'-{campo}' if descendente else campo, ordem_id)
+            if anulavel:
+                senhas = senhas.filter(**{f'{campo}__isnull': False})
+            if cursor:
+                valor = cursor['valor']
+                senhas = senhas.filter(
+                    Q(**{f'{campo}__{comparacao}e': valor})
+                    & (Q(**{f'{campo}__{comparacao}': valor}) | Q(**{f'id__{comparacao}': cursor['id']}))
+                )
+            pagina = list(senhas[:limite + 1])
+
+        if anulavel and len(pagina) <= limite:
+            nulos = queryset.filter(**{f'{campo}__isnull': True}).order_by(ordem_id)
+            if cursor and cursor['valor'] is None:
+                nulos = nulos.filter(**{f'id__{comparacao}': cursor['id']})
+            pagina += list(nulos[:limite + 1 - len(pagina)])
+
+        if len(pagina) > limite:
+            pagina = pagina[:limite]
+            ultimo = pagina[-1]
+            self.proximo_cursor = self._codificar(self._valor(ultimo, campo), self._valor(ultimo, 'id'))
+        return pagina
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.proximo_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.proximo_cursor)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cursor da próxima página (valor de "next")',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': f'Itens por página (máximo {self.max_page_size})',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+    # Auxiliares
+
+    @staticmethod
+    def _chave(queryset):
+        ordem = queryset.query.order_by or queryset.model._meta.ordering
+        if not ordem or not isinstance(ordem[0], str):
+            raise ValueError('PaginacaoKeyset exige um queryset ordenado por um campo')
+        campo = ordem[0]
+        return campo.lstrip('-'), campo.startswith('-')
+
+    def _limite(self, request):
+        try:
+            limite = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(limite, self.max_page_size))
+
+    @staticmethod
+    def _valor(linha, campo):
+        return linha[campo] if isinstance(linha, dict) else getattr(linha, campo)
+
+    @staticmethod
+    def _codificar(valor, id):
+        if isinstance(valor, datetime):
+            valor = valor.isoformat()
+        texto = json.dumps([valor, id])
+        return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+    def _ler_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+            valor, id = json.loads(texto)
+            if valor is not None:
+                valor = datetime.fromisoformat(valor)
+            return {'valor': valor, 'id': int(id)}
+        except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
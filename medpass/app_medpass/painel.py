@@ -0,0 +1,211 @@
+"""
+Quadro de senhas pré-calculado para os painéis públicos.
+
+`painel_senhas`, `SenhaViewSet.painel`, `api_senha_chamando` e
+`api_senhas_aguardando` montam os mesmos dados: chamadas atuais, últimas
+chamadas, início das filas e contadores. O Quadro guarda cada uma dessas seções
+já calculada para a versão atual do barramento de eventos (ver eventos.py).
+Qualquer transição de senha gera um novo evento, logo uma nova versão, e o
+quadro é descartado; enquanto nada muda os painéis são servidos sem consultas.
+No barramento 'local' o quadro também vence a cada período do barramento
+(ver BarramentoLocal.periodo), já que as escritas de outros workers não
+chegam como eventos.
+
+A versão também vira o ETag das respostas, permitindo 304 aos clientes.
+
+Cada seção tem uma versão assíncrona (achamada_guiche, acontadores...) para as
+views async: elas preenchem o mesmo cache e a montagem da resposta (ex.:
+dados_painel) roda depois sem consultas.
+"""
+import threading
+
+from django.utils import timezone
+
+from .estatisticas import acalcular_estatisticas, calcular_estatisticas
+from .eventos import obter_barramento
+from .models import Senha
+from .serializers import SenhaSerializer
+
+# Tamanho do início de fila mantido no quadro (os painéis usam até 20)
+TAMANHO_FILA = 20
+
+RELACIONADOS = ('especialidade', 'guiche', 'profissional')
+
+# Status das "últimas chamadas" da API do painel
+ULTIMAS_CHAMADAS_API = ('em_triagem', 'em_consulta', 'concluido')
+
+
+class Quadro:
+    """Seções do painel calculadas sob demanda e válidas para uma única versão"""
+
+    def __init__(self, versao, data, origem='', periodo=0):
+        self.versao = versao
+        self.data = data
+        self.origem = origem
+        self.periodo = periodo
+        self._secoes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def etag(self):
+        return f'"quadro-{self.origem}-{self.versao}-{self.periodo}-{self.data:%Y%m%d}"'
+
+    def vale_para(self, versao, data, periodo):
+        return self.versao == versao and self.data == data and self.periodo == periodo
+
+    def secao(self, chave, calcular):
+        """Retorna a seção `chave`, calculando-a na primeira vez"""
+        try:
+            return self._secoes[chave]
+        except KeyError:
+            pass
+        valor = calcular()
+        with self._lock:
+            return self._secoes.setdefault(chave, valor)
+
+    async def asecao(self, chave, calcular):
+        """Versão assíncrona de secao(): `calcular` retorna uma corrotina"""
+        try:
+            return self._secoes[chave]
+        except KeyError:
+            pass
+        valor = await calcular()
+        with self._lock:
+            return self._secoes.setdefault(chave, valor)
+
+    # Seções (cada uma com a versão assíncrona, que usa o ORM assíncrono)
+
+    def _chamada(self, status, campo):
+        return Senha.objects.filter(status=status).select_related(*RELACIONADOS).order_by(f'-{campo}')
+
+    def chamada_guiche(self):
+        return self.secao('chamada_guiche', lambda: self._chamada('chamando_guiche', 'chamado_guiche_em').first())
+
+    async def achamada_guiche(self):
+        return await self.asecao('chamada_guiche', lambda: self._chamada('chamando_guiche', 'chamado_guiche_em').afirst())
+
+    def chamada_medico(self):
+        return self.secao('chamada_medico', lambda: self._chamada('chamando_medico', 'chamado_medico_em').first())
+
+    async def achamada_medico(self):
+        return await self.asecao('chamada_medico', lambda: self._chamada('chamando_medico', 'chamado_medico_em').afirst())
+
+    def _ultimas_chamadas(self, status, limite):
+        return Senha.objects.filter(status__in=status).select_related(*RELACIONADOS).order_by(
+            '-chamado_guiche_em', '-chamado_medico_em', '-concluido_em'
+        )[:limite]
+
+    def ultimas_chamadas(self, status, limite):
+        """Últimas senhas chamadas nos status informados"""
+        status = tuple(status)
+        return self.secao(('ultimas_chamadas', status, limite),
+                          lambda: list(self._ultimas_chamadas(status, limite)))
+
+    async def aultimas_chamadas(self, status, limite):
+        status = tuple(status)
+        return await self.asecao(('ultimas_chamadas', status, limite),
+                                 lambda: _alista(self._ultimas_chamadas(status, limite)))
+
+    def _aguardando_guiche(self):
+        return Senha.objects.filter(
+            status='aguardando_guiche'
+        ).select_related(*RELACIONADOS).order_by('criado_em')[:TAMANHO_FILA]
+
+    def aguardando_guiche(self):
+        return self.secao('aguardando_guiche', lambda: list(self._aguardando_guiche()))
+
+    async def aaguardando_guiche(self):
+        return await self.asecao('aguardando_guiche', lambda: _alista(self._aguardando_guiche()))
+
+    def _aguardando_medico(self, especialidade_id, ordem):
+        senhas = Senha.objects.filter(status='aguardando_medico')
+        if especialidade_id:
+            senhas = senhas.filter(especialidade_id=especialidade_id)
+        return senhas.select_related(*RELACIONADOS).order_by(ordem)[:TAMANHO_FILA]
+
+    def aguardando_medico(self, especialidade_id=None, ordem='triagem_finalizada_em'):
+        return self.secao(('aguardando_medico', especialidade_id, ordem),
+                          lambda: list(self._aguardando_medico(especialidade_id, ordem)))
+
+    async def aaguardando_medico(self, especialidade_id=None, ordem='triagem_finalizada_em'):
+        return await self.asecao(('aguardando_medico', especialidade_id, ordem),
+                                 lambda: _alista(self._aguardando_medico(especialidade_id, ordem)))
+
+    def contadores(self):
+        return self.secao('contadores', lambda: calcular_estatisticas(self.data))
+
+    async def acontadores(self):
+        return await self.asecao('contadores', lambda: acalcular_estatisticas(self.data))
+
+
+async def _alista(consulta):
+    return [senha async for senha in consulta]
+
+
+def dados_painel(quadro):
+    """Resposta JSON do painel (SenhaViewSet.painel e a view assíncrona api_painel)"""
+    def calcular():
+        senha_chamando_guiche = quadro.chamada_guiche()
+        senha_chamando_medico = quadro.chamada_medico()
+        contadores = quadro.contadores()
+        
+        return {
+            'senha_chamando_guiche': SenhaSerializer(senha_chamando_guiche).data if senha_chamando_guiche else None,
+            'senha_chamando_medico': SenhaSerializer(senha_chamando_medico).data if senha_chamando_medico else None,
+            'ultimas_chamadas': SenhaSerializer(quadro.ultimas_chamadas(ULTIMAS_CHAMADAS_API, 5), many=True).data,
+            'senhas_aguardando_guiche': SenhaSerializer(quadro.aguardando_guiche()[:10], many=True).data,
+            'senhas_aguardando_medico': SenhaSerializer(quadro.aguardando_medico()[:10], many=True).data,
+            'estatisticas': {
+                'total_hoje': contadores['total_hoje'],
+                'total_atendidas': contadores['finalizadas_hoje'],
+                'aguardando_guiche': contadores['aguardando_guiche'],
+                'aguardando_medico': contadores['aguardando_medico'],
+            }
+        }
+    
+    return quadro.secao('api_painel', calcular)
+
+
+async def adados_painel(quadro):
+    """Carrega as seções com o ORM assíncrono e monta dados_painel() sem consultas"""
+    await quadro.achamada_guiche()
+    await quadro.achamada_medico()
+    await quadro.acontadores()
+    await quadro.aultimas_chamadas(ULTIMAS_CHAMADAS_API, 5)
+    await quadro.aaguardando_guiche()
+    await quadro.aaguardando_medico()
+    return dados_painel(quadro)
+
+
+_quadro = None
+_lock_quadro = threading.Lock()
+
+
+def obter_quadro():
+    """Quadro da versão atual; um novo é criado quando há eventos, o período vence ou o dia muda"""
+    barramento = obter_barramento()
+    return _quadro_da_versao(barramento, barramento.versao())
+
+
+async def aobter_quadro():
+    """Versão assíncrona de obter_quadro() (o barramento local não usa threads)"""
+    barramento = obter_barramento()
+    return _quadro_da_versao(barramento, await barramento.aversao())
+
+
+def _quadro_da_versao(barramento, versao):
+    global _quadro
+    data = timezone.localdate()
+    periodo = barramento.periodo()
+    quadro = _quadro
+    if quadro is None or not quadro.vale_para(versao, data, periodo):
+        with _lock_quadro:
+            if _quadro is None or not _quadro.vale_para(versao, data, periodo):
+                _quadro = Quadro(versao, data, barramento.origem, periodo)
+            quadro = _quadro
+    return quadro
+
+
+def etag_quadro(request, *args, **kwargs):
+    """etag_func para o decorator `condition` das views servidas pelo quadro"""
+    return obter_quadro().etag
@@ -0,0 +1,213 @@
+"""
+Resumos diários (ResumoDiario) por dia de emissão, especialidade e tipo.
+
+Cada linha guarda os contadores do dia e, por métrica de tempo, um DDSketch
+(sketches.py) com média e quantis. A linha é atualizada de forma incremental:
+
+- na emissão da senha: +1 em `emitidas` (um UPDATE com F());
+- quando a senha chega a um status final (transicoes.py, signals.py): +1 no
+  contador do status e as durações da senha somadas aos sketches.
+
+Assim os painéis de gestão leem poucas linhas por dia, qualquer que seja o
+tamanho do histórico, e os sketches de vários dias são combinados na leitura.
+`recalcular` refaz os resumos de um período a partir das senhas (inclusive as
+arquivadas), para a carga inicial ou correções.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .exportacao import TAMANHO_LOTE, senhas_para_exportar
+from .models import ResumoDiario
+from .sketches import DDSketch
+
+# Métrica -> (início, fim). A consulta só conta para senhas concluídas.
+METRICAS = {
+    'espera_guiche': ('criado_em', 'chamado_guiche_em'),
+    'triagem': ('triagem_iniciada_em', 'triagem_finalizada_em'),
+    'espera_medico': ('triagem_finalizada_em', 'chamado_medico_em'),
+    'consulta': ('consulta_iniciada_em', 'concluido_em'),
+}
+
+# Status final -> contador
+CONTADORES = {
+    'concluido': 'concluidas',
+    'cancelado': 'canceladas',
+    'desistencia': 'desistencias',
+}
+STATUS_FINAIS = tuple(CONTADORES)
+
+# Colunas de Senha necessárias para resumir uma senha
+CAMPOS = ('especialidade_id', 'tipo', 'status', *dict.fromkeys(
+    campo for inicio_fim in METRICAS.values() for campo in inicio_fim
+))
+
+AGRUPAMENTOS = ('data', 'especialidade', 'tipo')
+
+QUANTIS = {'p50': 0.5, 'p90': 0.9}
+
+
+def _campo(senha, nome):
+    return senha[nome] if isinstance(senha, dict) else getattr(senha, nome)
+
+
+def chave(senha):
+    """(data local de emissão, especialidade_id, tipo) da senha (instância ou dict)"""
+    return (
+        timezone.localtime(_campo(senha, 'criado_em')).date(),
+        _campo(senha, 'especialidade_id'),
+        _campo(senha, 'tipo'),
+    )
+
+
+def duracoes(senha):
+    """Durações em segundos das etapas que a senha completou"""
+    resultado = {}
+    for metrica, (inicio, fim) in METRICAS.items():
+        if metrica == 'consulta' and _campo(senha, 'status') != 'concluido':
+            continue
+        comeco, termino = _campo(senha, inicio), _campo(senha, fim)
+        if comeco and termino:
+            resultado[metrica] = (termino - comeco).total_seconds()
+    return resultado
+
+
+def _atualizar(chave_resumo, incrementos, amostras=None):
+    """Soma `incrementos` aos contadores e `amostras` aos sketches da linha"""
+    data, especialidade_id, tipo = chave_resumo
+    linha = ResumoDiario.objects.filter(data=data, especialidade_id=especialidade_id, tipo=tipo)
+    with transaction.atomic():
+        # O UPDATE vem antes da leitura: trava a linha (ou o banco, no SQLite)
+        # e as atualizações concorrentes dos sketches não se perdem
+        if not linha.update(**{campo: F(campo) + n for campo, n in incrementos.items()}):
+            try:
+                with transaction.atomic():
+                    ResumoDiario.objects.create(
+                        data=data, especialidade_id=especialidade_id, tipo=tipo, **incrementos
+                    )
+            except IntegrityError:
+                # Outra requisição criou a linha ao mesmo tempo
+                linha.update(**{campo: F(campo) + n for campo, n in incrementos.items()})
+        if amostras:
+            resumo = linha.select_for_update().get()
+            for metrica, valores in amostras.items():
+                sketch = DDSketch.de_dict(resumo.duracoes.get(metrica))
+                for valor in valores:
+                    sketch.adicionar(valor)
+                resumo.duracoes[metrica] = sketch.para_dict()
+            resumo.save(update_fields=['duracoes', 'atualizado_em'])
+
+
+def registrar_emissao(senha):
+    _atualizar(chave(senha), {'emitidas': 1})
+
+
+def registrar_finalizacao(senhas):
+    """Conta as senhas (instâncias ou dicts com CAMPOS) que chegaram a um status final"""
+    grupos = defaultdict(lambda: (defaultdict(int), defaultdict(list)))
+    for senha in senhas:
+        contadores, amostras = grupos[chave(senha)]
+        contadores[CONTADORES[_campo(senha, 'status')]] += 1
+        for metrica, valor in duracoes(senha).items():
+            amostras[metrica].append(valor)
+    for chave_resumo, (contadores, amostras) in grupos.items():
+        _atualizar(chave_resumo, contadores, amostras)
+
+
+def recalcular(inicio=None, fim=None):
+    """
+    Refaz os resumos dos dias de `inicio` a `fim` (inclusive; padrão: todo o
+    histórico) lendo Senha e SenhaHistorico em lotes. Retorna quantas linhas
+    de resumo foram gravadas.
+    """
+    acumulado = defaultdict(lambda: {'contadores': defaultdict(int), 'sketches': {}})
+    for senha in senhas_para_exportar(inicio, fim).iterator(chunk_size=TAMANHO_LOTE):
+        item = acumulado[chave(senha)]
+        item['contadores']['emitidas'] += 1
+        if senha['status'] in CONTADORES:
+            item['contadores'][CONTADORES[senha['status']]] += 1
+            for metrica, valor in duracoes(senha).items():
+                item['sketches'].setdefault(metrica, DDSketch()).adicionar(valor)
+
+    resumos = [
+        ResumoDiario(
+            data=data, especialidade_id=especialidade_id, tipo=tipo,
+            duracoes={metrica: sketch.para_dict() for metrica, sketch in item['sketches'].items()},
+            **item['contadores'],
+        )
+        for (data, especialidade_id, tipo), item in acumulado.items()
+    ]
+    existentes = ResumoDiario.objects.all()
+    if inicio:
+        existentes = existentes.filter(data__gte=inicio)
+    if fim:
+        existentes = existentes.filter(data__lte=fim)
+    with transaction.atomic():
+        existentes.delete()
+        ResumoDiario.objects.bulk_create(resumos, batch_size=500)
+    return len(resumos)
+
+
+def _segundos(valor):
+    return None if valor is None else round(valor, 3)
+
+
+def consultar(inicio=None, fim=None, especialidade_id=None, tipo=None, agrupar_por=AGRUPAMENTOS):
+    """
+    Resumos do período (padrão: últimos 30 dias), combinados pelos campos de
+    `agrupar_por` (subconjunto de AGRUPAMENTOS; vazio soma tudo). Cada grupo
+    traz os contadores e, por métrica, quantidade, média, p50 e p90 em segundos.
+    """
+    fim = fim or timezone.localdate()
+    inicio = inicio or fim - timedelta(days=29)
+    linhas = ResumoDiario.objects.filter(data__gte=inicio, data__lte=fim)
+    if especialidade_id:
+        linhas = linhas.filter(especialidade_id=especialidade_id)
+    if tipo:
+        linhas = linhas.filter(tipo=tipo)
+
+    grupos = {}
+    for linha in linhas.values('data', 'especialidade_id', 'especialidade__nome', 'tipo',
+                               *CONTADORES.values(), 'emitidas', 'duracoes'):
+        chave_grupo = tuple(linha['especialidade_id' if campo == 'especialidade' else campo]
+                            for campo in agrupar_por)
+        grupo = grupos.get(chave_grupo)
+        if grupo is None:
+            grupo = grupos[chave_grupo] = {
+                'campos': linha,
+                'contadores': dict.fromkeys(('emitidas', *CONTADORES.values()), 0),
+                'sketches': {},
+            }
+        for contador in ('emitidas', *CONTADORES.values()):
+            grupo['contadores'][contador] += linha[contador]
+        for metrica, dados in linha['duracoes'].items():
+            sketch = DDSketch.de_dict(dados)
+            if metrica in grupo['sketches']:
+                grupo['sketches'][metrica].mesclar(sketch)
+            else:
+                grupo['sketches'][metrica] = sketch
+
+    resultado = []
+    for grupo in grupos.values():
+        item = {}
+        if 'data' in agrupar_por:
+            item['data'] = grupo['campos']['data'].isoformat()
+        if 'especialidade' in agrupar_por:
+            item['especialidade_id'] = grupo['campos']['especialidade_id']
+            item['especialidade_nome'] = grupo['campos']['especialidade__nome']
+        if 'tipo' in agrupar_por:
+            item['tipo'] = grupo['campos']['tipo']
+        item.update(grupo['contadores'])
+        item['tempos'] = {
+            metrica: {
+                'quantidade': sketch.contagem,
+                'media': _segundos(sketch.media),
+                **{nome: _segundos(sketch.quantil(q)) for nome, q in QUANTIS.items()},
+            }
+            for metrica, sketch in grupo['sketches'].items()
+        }
+        resultado.append(item)
+    return resultado
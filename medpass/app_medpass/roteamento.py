@@ -0,0 +1,157 @@
+"""
+Leituras na réplica (settings.MEDPASS_REPLICA) para as views só de leitura.
+
+As views marcadas com `somente_leitura` (painéis, listas, estatísticas,
+exportação, resumos) leem da réplica; todo o resto, e qualquer escrita, vai
+para o banco principal. A réplica pode estar até ATRASO_MAXIMO segundos
+atrás do principal, e três regras evitam que esse atraso apareça:
+
+- depois de uma escrita, a própria requisição passa a ler do principal;
+- o cliente que escreveu (POST etc.) recebe um cookie e, por ATRASO_MAXIMO
+  segundos, suas leituras também vão ao principal (middleware.ReplicaMiddleware);
+- respostas atreladas à versão das filas (ETag de condicional.py e o quadro
+  de painel.py, guardados até o próximo evento) só usam a réplica quando o
+  último evento do barramento tem mais de ATRASO_MAXIMO segundos; antes
+  disso a réplica poderia não ter o que o evento anunciou.
+
+Sem a réplica configurada em DATABASES, tudo lê do principal.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+CONFIGURACAO_PADRAO = {
+    'ALIAS': 'replica',
+    'ATRASO_MAXIMO': 5,
+}
+
+COOKIE = 'medpass_primario'
+
+# Modos de leitura
+TOLERANTE = 'tolerante'
+VERSIONADA = 'versionada'
+
+_modo = ContextVar('medpass_modo_leitura', default=None)
+_fixado = ContextVar('medpass_fixado_no_primario', default=False)
+_escreveu = ContextVar('medpass_escreveu', default=False)
+
+# Última escrita vista pelo processo (própria ou de outro worker, pelo barramento);
+# no início não se sabe, então conta como agora
+_ultima_escrita = time.monotonic()
+
+
+def configuracao():
+    return {**CONFIGURACAO_PADRAO, **getattr(settings, 'MEDPASS_REPLICA', {})}
+
+
+def alias_replica():
+    """Alias da réplica, ou None se ela não está em DATABASES"""
+    alias = configuracao()['ALIAS']
+    return alias if alias in connections.settings else None
+
+
+def registrar_escrita(*args):
+    """Marca uma escrita agora (também usado como assinante do barramento)"""
+    global _ultima_escrita
+    _ultima_escrita = time.monotonic()
+
+
+def escreveu():
+    """Se a requisição atual já escreveu no banco"""
+    return _escreveu.get()
+
+
+def escrita_recente():
+    return time.monotonic() - _ultima_escrita < configuracao()['ATRASO_MAXIMO']
+
+
+def acompanhar_escritas(barramento):
+    """Conta os eventos do barramento (escritas de qualquer worker) como escritas"""
+    barramento.assinar(registrar_escrita)
+
+
+@contextmanager
+def leitura(modo=TOLERANTE):
+    """Trecho só de leitura: as consultas vão à réplica conforme o `modo`"""
+    token = _modo.set(modo)
+    try:
+        yield
+    finally:
+        _modo.reset(token)
+
+
+@contextmanager
+def requisicao(fixado=False):
+    """Estado do roteador de uma requisição; `fixado` manda todas as leituras ao principal"""
+    tokens = _fixado.set(fixado), _escreveu.set(False)
+    try:
+        yield
+    finally:
+        _fixado.reset(tokens[0])
+        _escreveu.reset(tokens[1])
+
+
+def somente_leitura(view=None, *, versionada=False):
+    """
+    Decorator de views (síncronas ou assíncronas) que só leem. Com
+    `versionada`, a resposta fica guardada sob a versão das filas e a réplica
+    só é usada quando não houve escrita recente.
+    """
+    modo = VERSIONADA if versionada else TOLERANTE
+
+    def decorar(funcao):
+        if iscoroutinefunction(funcao):
+            @wraps(funcao)
+            async def envolvida(*args, **kwargs):
+                with leitura(modo):
+                    return await funcao(*args, **kwargs)
+        else:
+            @wraps(funcao)
+            def envolvida(*args, **kwargs):
+                with leitura(modo):
+                    return funcao(*args, **kwargs)
+        return envolvida
+
+    return decorar(view) if view else decorar
+
+
+def banco_de_leitura():
+    """Alias que uma leitura usaria agora (para fixá-lo em querysets lidos mais tarde)"""
+    return RoteadorReplica().db_for_read(None) or DEFAULT_DB_ALIAS
+
+
+class RoteadorReplica:
+    """Leituras dos trechos `somente_leitura` na réplica; o resto no principal"""
+
+    def db_for_read(self, model, **hints):
+        replica = alias_replica()
+        modo = _modo.get()
+        if replica is None or modo is None or _fixado.get() or _escreveu.get():
+            return None
+        if modo == VERSIONADA and escrita_recente():
+            return None
+        return replica
+
+    def db_for_write(self, model, **hints):
+        # Daqui em diante a requisição lê o que acabou de escrever
+        _escreveu.set(True)
+        registrar_escrita()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        bancos = {DEFAULT_DB_ALIAS, alias_replica()}
+        if obj1._state.db in bancos and obj2._state.db in bancos:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # A réplica recebe o esquema pela replicação (ou pela cópia do arquivo)
+        if db == alias_replica():
+            return False
+        return None
+
@@ -1,3 +1,5 @@
+from django.db.models import QuerySet
+from django.utils import timezone
 from rest_framework import serializers
 from .models import Especialidade, Profissional, Senha, Guiche
 
@@ -50,26 +52,100 @@ class SenhaSerializer(serializers.ModelSerializer):
         ]
 
 
+class SenhaSerializerRapido:
+    """
+    Caminho rápido, somente leitura, para listas de senhas.
+
+    Gera exatamente o mesmo JSON que SenhaSerializer(many=True), mas a partir de
+    linhas de .values() (sem instanciar modelos) e de tabelas de rótulos
+    pré-calculadas, sem passar pela maquinaria de campos do DRF a cada linha.
+    """
+    COLUNAS = (
+        'id', 'numero', 'especialidade_id', 'especialidade__nome', 'tipo', 'status',
+        'guiche_id', 'guiche__numero', 'profissional_id', 'profissional__nome',
+        'nome_paciente', 'observacoes_triagem',
+        'criado_em', 'chamado_guiche_em', 'triagem_iniciada_em', 'triagem_finalizada_em',
+        'chamado_medico_em', 'consulta_iniciada_em', 'concluido_em',
+    )
+    CAMPOS_DATA_HORA = (
+        'criado_em', 'chamado_guiche_em', 'triagem_iniciada_em', 'triagem_finalizada_em',
+        'chamado_medico_em', 'consulta_iniciada_em', 'concluido_em',
+    )
+    TIPO_DISPLAY = dict(Senha.TIPO_CHOICES)
+    STATUS_DISPLAY = dict(Senha.STATUS_CHOICES)
+    ETAPA_POR_STATUS = {status: Senha(status=status).etapa_atual for status, _ in Senha.STATUS_CHOICES}
+
+    def __init__(self, senhas):
+        self.senhas = senhas
+
+    @classmethod
+    def valores(cls, queryset):
+        """
+        Queryset de linhas no formato esperado (útil para paginar antes de
+        serializar). As anotações vão junto: podem ser a chave da paginação.
+        """
+        return queryset.values(*cls.COLUNAS, *queryset.query.annotations)
+
+    @property
+    def data(self):
+        linhas = self.senhas
+        if isinstance(linhas, QuerySet):
+            linhas = self.valores(linhas)
+        fuso = timezone.get_current_timezone()
+        return [self.representar(linha, fuso) for linha in linhas]
+
+    @classmethod
+    def representar(cls, linha, fuso):
+        tipo = linha['tipo']
+        status = linha['status']
+        guiche_numero = linha['guiche__numero']
+        profissional_nome = linha['profissional__nome']
+        dados = {
+            'id': linha['id'],
+            'numero': linha['numero'],
+            'especialidade': linha['especialidade_id'],
+            'especialidade_nome': linha['especialidade__nome'],
+            'tipo': tipo,
+            'tipo_display': cls.TIPO_DISPLAY.get(tipo, tipo),
+            'status': status,
+            'status_display': cls.STATUS_DISPLAY.get(status, status),
+            'etapa_atual': cls.ETAPA_POR_STATUS.get(status, 'finalizado'),
+            'guiche': linha['guiche_id'],
+            'guiche_numero': guiche_numero,
+            'profissional': linha['profissional_id'],
+            'profissional_nome': profissional_nome,
+            'nome_paciente': linha['nome_paciente'],
+            'observacoes_triagem': linha['observacoes_triagem'],
+        }
+        for campo in cls.CAMPOS_DATA_HORA:
+            dados[campo] = cls._data_hora(linha[campo], fuso)
+        return dados
+
+    @staticmethod
+    def _data_hora(valor, fuso):
+        # Mesmo formato do DateTimeField do DRF (ISO 8601, fuso atual, 'Z' para UTC)
+        if not valor:
+            return None
+        if timezone.is_aware(valor):
+            valor = valor.astimezone(fuso)
+        texto = valor.isoformat()
+        if texto.endswith('+00:00'):
+            texto = texto[:-6] + 'Z'
+        return texto
+
+
 class SenhaCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Senha
         fields = ['especialidade', 'tipo']
         
     def create(self, validated_data):
-        # Gera o número da senha automaticamente
-        from datetime import date
+        # Gera o número da senha automaticamente (mesma sequência do totem)
         especialidade = validated_data['especialidade']
         tipo = validated_data.get('tipo', 'N')
         
-        # Contar senhas do tipo no dia
-        hoje = date.today()
-        count = Senha.objects.filter(
-            tipo=tipo,
-            criado_em__date=hoje
-        ).count() + 1
-        
-        # Formato: TIPO + NUMERO (ex: N001, P002, U003)
-        numero = f"{tipo}{count:03d}"
+        # Formato: TIPO + SIGLA + NUMERO (ex: NC001, PD002, UG003)
+        numero = Senha.gerar_numero(tipo, especialidade)
         
         senha = Senha.objects.create(
             numero=numero,
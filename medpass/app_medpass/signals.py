@@ -0,0 +1,57 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .arquivamento import agendar_arquivamento
+from .eventos import evento_da_senha, publicar_apos_commit
+from .models import Especialidade, Guiche, Profissional, Senha, SequenciaSenha
+from .resumos import STATUS_FINAIS, registrar_emissao, registrar_finalizacao
+
+
+@receiver(post_save, sender=Senha)
+def publicar_mudanca_senha(sender, instance, created, **kwargs):
+    """Publica emissão, mudança de status ou rechamada de uma senha após o commit"""
+    carregado = getattr(instance, '_estado_carregado', None)
+
+    if created:
+        tipo_evento, status_anterior = 'criada', None
+    elif carregado is None:
+        tipo_evento, status_anterior = 'status', None
+    elif carregado['status'] != instance.status:
+        tipo_evento, status_anterior = 'status', carregado['status']
+    elif (carregado['chamado_guiche_em'] != instance.chamado_guiche_em
+          or carregado['chamado_medico_em'] != instance.chamado_medico_em):
+        tipo_evento, status_anterior = 'rechamada', instance.status
+    else:
+        return
+
+    if created:
+        registrar_emissao(instance)
+    if instance.status in STATUS_FINAIS and (created or status_anterior not in (None, *STATUS_FINAIS)):
+        registrar_finalizacao([instance])
+
+    instance._estado_carregado = instance.estado_rastreado()
+    publicar_apos_commit(evento_da_senha(instance, status_anterior, tipo_evento))
+
+
+@receiver(post_delete, sender=Senha)
+def publicar_remocao_senha(sender, instance, **kwargs):
+    publicar_apos_commit(evento_da_senha(instance, instance.status, 'removida'))
+
+
+@receiver([post_save, post_delete], sender=Especialidade)
+@receiver([post_save, post_delete], sender=Guiche)
+@receiver([post_save, post_delete], sender=Profissional)
+def publicar_mudanca_cadastro(sender, instance, **kwargs):
+    """Nomes de especialidade, guichê e sala aparecem nos painéis; avisa quem guarda cache"""
+    publicar_apos_commit({
+        'evento': 'cadastro',
+        'modelo': sender._meta.model_name,
+        'id': instance.pk,
+    })
+
+
+@receiver(post_save, sender=SequenciaSenha)
+def arquivar_ao_virar_o_dia(sender, instance, created, **kwargs):
+    """A primeira senha do dia cria a linha da sequência; arquiva os dias anteriores (opcional)"""
+    if created:
+        agendar_arquivamento(instance.data)
@@ -0,0 +1,128 @@
+"""
+Sketch de quantis no estilo DDSketch (Masson, Rim e Lee, 2019).
+
+Os valores (durações em segundos) caem em baldes de tamanho geométrico: o
+balde i cobre (γ^(i-1), γ^i], com γ = (1 + α) / (1 - α). Qualquer quantil é
+estimado com erro relativo de no máximo α, a memória cresce com o log da faixa
+de valores (não com o número de amostras) e dois sketches se combinam somando
+os baldes. Isso permite guardar um sketch por dia nos resumos (resumos.py) e
+juntar meses inteiros na leitura, e manter estimativas de espera ao vivo
+(estimativas.py).
+"""
+import math
+
+PRECISAO_RELATIVA = 0.01
+
+# Acima disso os baldes mais baixos são fundidos (perde precisão só nos menores valores)
+MAXIMO_BALDES = 2048
+
+# Valores menores que isso (inclusive zero e negativos por ajuste de relógio) contam como zero
+MINIMO = 1e-3
+
+
+class DDSketch:
+    """Distribuição aproximada de valores não negativos, combinável e serializável"""
+
+    def __init__(self, precisao_relativa=PRECISAO_RELATIVA, maximo_baldes=MAXIMO_BALDES):
+        self.precisao_relativa = precisao_relativa
+        self.maximo_baldes = maximo_baldes
+        self.gamma = (1 + precisao_relativa) / (1 - precisao_relativa)
+        self._log_gamma = math.log(self.gamma)
+        self.baldes = {}
+        self.zeros = 0
+        self.contagem = 0
+        self.soma = 0.0
+        self.minimo = None
+        self.maximo = None
+
+    def _indice(self, valor):
+        return math.ceil(math.log(valor) / self._log_gamma)
+
+    def _valor(self, indice):
+        # Ponto do balde com erro relativo α para qualquer valor dentro dele
+        return 2 * self.gamma ** indice / (self.gamma + 1)
+
+    def adicionar(self, valor, peso=1):
+        valor = max(float(valor), 0.0)
+        if valor < MINIMO:
+            self.zeros += peso
+        else:
+            indice = self._indice(valor)
+            self.baldes[indice] = self.baldes.get(indice, 0) + peso
+            if len(self.baldes) > self.maximo_baldes:
+                self._compactar()
+        self.contagem += peso
+        self.soma += valor * peso
+        self.minimo = valor if self.minimo is None else min(self.minimo, valor)
+        self.maximo = valor if self.maximo is None else max(self.maximo, valor)
+
+    def _compactar(self):
+        indices = sorted(self.baldes)
+        excesso = len(indices) - self.maximo_baldes
+        destino = indices[excesso]
+        for indice in indices[:excesso]:
+            self.baldes[destino] += self.baldes.pop(indice)
+
+    def mesclar(self, outro):
+        """Soma as amostras de `outro` (mesma precisão) a este sketch"""
+        if outro.precisao_relativa != self.precisao_relativa:
+            raise ValueError('Só é possível mesclar sketches com a mesma precisão')
+        for indice, contagem in outro.baldes.items():
+            self.baldes[indice] = self.baldes.get(indice, 0) + contagem
+        if len(self.baldes) > self.maximo_baldes:
+            self._compactar()
+        self.zeros += outro.zeros
+        self.contagem += outro.contagem
+        self.soma += outro.soma
+        for valor in (outro.minimo, outro.maximo):
+            if valor is not None:
+                self.minimo = valor if self.minimo is None else min(self.minimo, valor)
+                self.maximo = valor if self.maximo is None else max(self.maximo, valor)
+        return self
+
+    def quantil(self, q):
+        """Valor do quantil `q` (0 a 1), ou None se o sketch está vazio"""
+        if not self.contagem:
+            return None
+        posicao = q * (self.contagem - 1)
+        acumulado = self.zeros
+        if posicao < acumulado:
+            return 0.0
+        for indice in sorted(self.baldes):
+            acumulado += self.baldes[indice]
+            if posicao < acumulado:
+                return min(max(self._valor(indice), self.minimo), self.maximo)
+        return self.maximo
+
+    @property
+    def media(self):
+        return self.soma / self.contagem if self.contagem else None
+
+    def para_dict(self):
+        """Forma serializável em JSON (chaves dos baldes como texto)"""
+        return {
+            'alfa': self.precisao_relativa,
+            'baldes': {str(indice): contagem for indice, contagem in self.baldes.items()},
+            'zeros': self.zeros,
+            'contagem': self.contagem,
+            'soma': self.soma,
+            'minimo': self.minimo,
+            'maximo': self.maximo,
+        }
+
+    @classmethod
+    def de_dict(cls, dados, maximo_baldes=MAXIMO_BALDES):
+        """Reconstrói o sketch de para_dict(); dados vazios dão um sketch vazio"""
+        if not dados:
+            return cls(maximo_baldes=maximo_baldes)
+        sketch = cls(dados['alfa'], maximo_baldes)
+        sketch.baldes = {int(indice): contagem for indice, contagem in dados['baldes'].items()}
+        sketch.zeros = dados['zeros']
+        sketch.contagem = dados['contagem']
+        sketch.soma = dados['soma']
+        sketch.minimo = dados['minimo']
+        sketch.maximo = dados['maximo']
+        return sketch
+
+    def __len__(self):
+        return self.contagem
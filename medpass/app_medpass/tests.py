@@ -1,3 +1,1462 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from django.utils import timezone
+
+from . import arquivamento, carga, consultas, estimativas, metricas, resumos, roteamento, views
+from .banco import banco_ocupado, transacao_de_escrita
+from .middleware import ReplicaMiddleware
+from .estatisticas import calcular_estatisticas
+from .filas import FilaSenhas, MesaOcupada, chamar_proxima_guiche
+from . import transicoes
+from .transicoes import TransicaoInvalida, transicionar
+from .exportacao import exportar, senhas_para_exportar
+from .eventos import BarramentoBanco, BarramentoLocal, obter_barramento
+from .models import (
+    Especialidade, EstimativaEspera, EventoSenha, Guiche, Profissional, ResumoDiario, Senha, SenhaHistorico, SequenciaSenha, filtro_do_dia,
+)
+from .serializers import SenhaSerializer, SenhaSerializerRapido
+from .sketches import DDSketch
+
+
+class SequenciaSenhaTests(TestCase):
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+
+    def test_numeracao_sequencial_por_prefixo(self):
+        self.assertEqual(Senha.gerar_numero('N', self.cardiologia), 'NC001')
+        self.assertEqual(Senha.gerar_numero('N', self.cardiologia), 'NC002')
+        self.assertEqual(Senha.gerar_numero('P', self.cardiologia), 'PC001')
+
+    def test_continua_a_partir_das_senhas_ja_emitidas(self):
+        Senha.objects.create(numero='NC007', tipo='N', especialidade=self.cardiologia)
+        self.assertEqual(Senha.gerar_numero('N', self.cardiologia), 'NC008')
+
+    def test_incremento_em_uma_consulta(self):
+        Senha.gerar_numero('N', self.cardiologia)
+        with self.assertNumQueries(1):
+            Senha.gerar_numero('N', self.cardiologia)
+        self.assertEqual(
+            SequenciaSenha.objects.get(data=timezone.localdate(), tipo='N', sigla='C').ultimo,
+            2
+        )
+
+    def test_sem_update_returning_rele_o_valor(self):
+        # Ex.: MariaDB, que tem RETURNING no INSERT mas não no UPDATE
+        Senha.gerar_numero('N', self.cardiologia)
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            self.assertEqual(Senha.gerar_numero('N', self.cardiologia), 'NC002')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN é específico do SQLite')
+class SenhaIndicesTests(TestCase):
+    """Garante que as consultas das filas e painéis usam os índices de Senha"""
+
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        self.guiche = Guiche.objects.create(numero='01', nome='Triagem 1')
+
+    def assertUsaIndice(self, queryset, indice):
+        plano = queryset.explain()
+        self.assertIn(indice, plano, plano)
+
+    def test_fila_do_guiche(self):
+        self.assertUsaIndice(
+            Senha.objects.filter(status='aguardando_guiche').order_by('criado_em'),
+            'senha_status_criado_idx'
+        )
+
+    def test_fila_do_medico_por_especialidade(self):
+        self.assertUsaIndice(
+            Senha.objects.filter(
+                status='aguardando_medico', especialidade=self.cardiologia
+            ).order_by('triagem_finalizada_em'),
+            'senha_status_esp_triagem_idx'
+        )
+
+    def test_proxima_senha_das_filas(self):
+        self.assertUsaIndice(FilaSenhas('guiche').senhas()[:1], 'senha_fila_guiche_idx')
+        self.assertUsaIndice(FilaSenhas('medico', self.cardiologia.id).senhas()[:1], 'senha_fila_medico_idx')
+
+    def test_chamada_atual(self):
+        self.assertUsaIndice(
+            Senha.objects.filter(status='chamando_guiche').order_by('-chamado_guiche_em')[:1],
+            'senha_status_cham_guiche_idx'
+        )
+        self.assertUsaIndice(
+            Senha.objects.filter(status='chamando_medico').order_by('-chamado_medico_em')[:1],
+            'senha_status_cham_medico_idx'
+        )
+
+    def test_atendimento_em_andamento_do_guiche(self):
+        # O SQLite só casa índices parciais com termos literais e o Django envia
+        # parâmetros, então aqui ele escolhe o índice da FK; o PostgreSQL usa
+        # senha_guiche_ativa_idx. Em ambos a consulta não varre a tabela.
+        plano = Senha.objects.filter(
+            guiche=self.guiche, status__in=['chamando_guiche', 'em_triagem']
+        ).explain()
+        self.assertIn('USING INDEX', plano, plano)
+        self.assertNotIn('SCAN app_medpass_senha', plano, plano)
+
+    def test_intervalos_do_dia(self):
+        self.assertUsaIndice(
+            Senha.objects.filter(filtro_do_dia('criado_em')),
+            'senha_criado_idx'
+        )
+        self.assertUsaIndice(
+            Senha.objects.filter(filtro_do_dia('concluido_em'), status='concluido'),
+            'senha_status_concluido_idx'
+        )
+
+
+class BarramentoTests(TestCase):
+    def test_ids_crescentes_e_buffer_limitado(self):
+        barramento = BarramentoLocal(capacidade=3)
+        ids = [barramento.publicar({'n': n}) for n in range(5)]
+        self.assertEqual(ids, [1, 2, 3, 4, 5])
+        self.assertEqual(barramento.desde(3), [(4, {'n': 3}), (5, {'n': 4})])
+        self.assertEqual(barramento.desde(5), [])
+        # Eventos 2 e 3 já saíram do buffer: o chamador precisa recarregar
+        self.assertIsNone(barramento.desde(1))
+
+    def test_assinantes_recebem_eventos(self):
+        barramento = BarramentoLocal()
+        recebidos = []
+        barramento.assinar(lambda evento_id, evento: recebidos.append(evento_id))
+        barramento.publicar({})
+        barramento.publicar({})
+        self.assertEqual(recebidos, [1, 2])
+
+    def test_backend_banco_compartilha_eventos_entre_processos(self):
+        primeiro = BarramentoBanco(intervalo_polling=0)
+        segundo = BarramentoBanco(intervalo_polling=0)
+        segundo.sincronizar()
+        evento_id = primeiro.publicar({'numero': 'NC001'})
+        self.assertEqual(segundo.desde(evento_id - 1), [(evento_id, {'numero': 'NC001'})])
+
+    def test_assinante_que_publica_nao_trava(self):
+        barramento = BarramentoLocal()
+        recebidos = []
+
+        def assinante(evento_id, evento):
+            recebidos.append(evento_id)
+            if evento.get('repetir'):
+                barramento.publicar({})
+
+        barramento.assinar(assinante)
+        barramento.publicar({'repetir': True})
+        self.assertEqual(sorted(recebidos), [1, 2])
+
+    def test_backend_banco_espera_evento_com_id_menor(self):
+        barramento = BarramentoBanco(intervalo_polling=0, espera_lacuna=60)
+        base = EventoSenha.objects.create(evento={'n': 0}).id
+        barramento.sincronizar()
+        # Id base + 1 ainda não commitado por outro worker
+        EventoSenha.objects.create(id=base + 2, evento={'n': 2})
+        barramento.sincronizar()
+        self.assertEqual(barramento.desde(base), [])
+
+        EventoSenha.objects.create(id=base + 1, evento={'n': 1})
+        barramento.sincronizar()
+        self.assertEqual(barramento.desde(base), [(base + 1, {'n': 1}), (base + 2, {'n': 2})])
+
+    def test_backend_banco_pula_lacuna_vencida(self):
+        barramento = BarramentoBanco(intervalo_polling=0, espera_lacuna=0)
+        base = EventoSenha.objects.create(evento={'n': 0}).id
+        barramento.sincronizar()
+        # Transação que tinha o id base + 1 foi desfeita
+        EventoSenha.objects.create(id=base + 2, evento={'n': 2})
+        with self.assertLogs('app_medpass.eventos', 'WARNING'):
+            barramento.sincronizar()
+        self.assertEqual(barramento.desde(base), [(base + 2, {'n': 2})])
+
+    @override_settings(MEDPASS_PERFIL_BANCO='producao', MEDPASS_BARRAMENTO={'BACKEND': 'local'})
+    def test_perfil_producao_recusa_barramento_local(self):
+        with mock.patch('app_medpass.eventos._barramento', None):
+            with self.assertRaises(ImproperlyConfigured):
+                obter_barramento()
+
+    def test_transicao_publicada_apos_commit(self):
+        cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        versao = obter_barramento().versao()
+        with self.captureOnCommitCallbacks(execute=True):
+            senha = Senha.objects.create(numero='NC001', tipo='N', especialidade=cardiologia)
+            self.assertEqual(obter_barramento().versao(), versao)
+
+        senha = Senha.objects.get(pk=senha.pk)
+        senha.status = 'chamando_guiche'
+        with self.captureOnCommitCallbacks(execute=True):
+            senha.save()
+
+        eventos = [evento for _, evento in obter_barramento().desde(versao)]
+        self.assertEqual(
+            [(e['evento'], e['status'], e['status_anterior']) for e in eventos],
+            [('criada', 'aguardando_guiche', None), ('status', 'chamando_guiche', 'aguardando_guiche')]
+        )
+
+
+class QuadroPainelTests(TestCase):
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.senha = Senha.objects.create(numero='NC001', tipo='N', especialidade=self.cardiologia)
+
+    def test_painel_sem_consultas_enquanto_nada_muda(self):
+        for url in ['/painel/', '/api/senhas/painel/', '/api/senha-chamando/', '/api/senhas-aguardando/',
+                    '/api/painel/']:
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_etag_gera_304_ate_a_proxima_transicao(self):
+        resposta = self.client.get('/api/senhas/painel/')
+        etag = resposta['ETag']
+        self.assertEqual(resposta.json()['estatisticas']['aguardando_guiche'], 1)
+        self.assertEqual(self.client.get('/api/senhas/painel/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/senhas/{self.senha.id}/chamar_guiche/')
+
+        resposta = self.client.get('/api/senhas/painel/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json()['senha_chamando_guiche']['numero'], 'NC001')
+        self.assertEqual(resposta.json()['estatisticas']['aguardando_guiche'], 0)
+
+    def test_barramento_local_recalcula_a_cada_periodo(self):
+        # Escrita de outro worker: nenhum evento chega a este processo
+        resposta = self.client.get('/api/senhas/painel/')
+        Senha.objects.filter(pk=self.senha.pk).update(status='cancelado')
+        self.assertEqual(
+            self.client.get('/api/senhas/painel/', HTTP_IF_NONE_MATCH=resposta['ETag']).status_code, 304
+        )
+
+        periodo = obter_barramento().periodo() + 1
+        with mock.patch.object(obter_barramento(), 'periodo', return_value=periodo):
+            resposta = self.client.get('/api/senhas/painel/', HTTP_IF_NONE_MATCH=resposta['ETag'])
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json()['estatisticas']['aguardando_guiche'], 0)
+
+
+class GetCondicionalTests(TestCase):
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.na_fila = Senha.objects.create(numero='NC001', tipo='N', especialidade=self.cardiologia)
+            self.em_triagem = Senha.objects.create(
+                numero='NC002', tipo='N', especialidade=self.cardiologia, status='em_triagem'
+            )
+
+    def test_fila_sem_mudancas_responde_304_sem_consultas(self):
+        etag = self.client.get('/api/senhas/aguardando_guiche/')['ETag']
+        with self.assertNumQueries(0):
+            resposta = self.client.get('/api/senhas/aguardando_guiche/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 304)
+
+    def test_versao_muda_so_com_eventos_da_fila(self):
+        etag_guiche = self.client.get('/api/senhas/aguardando_guiche/')['ETag']
+        etag_medico = self.client.get('/api/senhas/aguardando_medico/')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/senhas/{self.em_triagem.id}/finalizar_triagem/')
+
+        self.assertEqual(
+            self.client.get('/api/senhas/aguardando_guiche/', HTTP_IF_NONE_MATCH=etag_guiche).status_code, 304
+        )
+        resposta = self.client.get('/api/senhas/aguardando_medico/', HTTP_IF_NONE_MATCH=etag_medico)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual([s['numero'] for s in resposta.json()['results']], ['NC002'])
+
+
+class EstatisticasTests(TestCase):
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        self.pediatria = Especialidade.objects.create(nome='Pediatria', sigla='P')
+        agora = timezone.now()
+        for numero, tipo, especialidade, status in [
+            ('NC001', 'N', self.cardiologia, 'aguardando_guiche'),
+            ('PC001', 'P', self.cardiologia, 'em_triagem'),
+            ('NP001', 'N', self.pediatria, 'aguardando_medico'),
+            ('NP002', 'N', self.pediatria, 'concluido'),
+            ('UP001', 'U', self.pediatria, 'cancelado'),
+        ]:
+            Senha.objects.create(
+                numero=numero, tipo=tipo, especialidade=especialidade, status=status,
+                concluido_em=agora if status in ('concluido', 'cancelado') else None
+            )
+
+    def test_contadores_em_uma_consulta(self):
+        with self.assertNumQueries(1):
+            dados = calcular_estatisticas()
+        self.assertEqual(dados['total_hoje'], 5)
+        self.assertEqual(dados['aguardando_guiche'], 1)
+        self.assertEqual(dados['etapa_guiche'], 1)
+        self.assertEqual(dados['aguardando_medico'], 1)
+        self.assertEqual(dados['finalizadas_hoje'], 1)
+        self.assertEqual(dados['canceladas_hoje'], 1)
+
+    def test_agrupamento_por_especialidade_e_tipo(self):
+        with self.assertNumQueries(1):
+            dados = calcular_estatisticas(agrupar_por=['especialidade', 'tipo'])
+        self.assertEqual(dados['total_hoje'], 5)
+        pediatria_normal = next(
+            g for g in dados['grupos'] if g['especialidade_nome'] == 'Pediatria' and g['tipo'] == 'N'
+        )
+        self.assertEqual(pediatria_normal['total_hoje'], 2)
+        self.assertEqual(pediatria_normal['aguardando_medico'], 1)
+
+    def test_endpoint_estatisticas(self):
+        resposta = self.client.get('/api/senhas/estatisticas/?agrupar_por=tipo').json()
+        self.assertEqual(resposta['em_triagem'], 1)
+        self.assertEqual(len(resposta['grupos']), 3)
+
+
+class SenhaSerializerRapidoTests(TestCase):
+    def setUp(self):
+        cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        guiche = Guiche.objects.create(numero='01', nome='Triagem 1')
+        medico = Profissional.objects.create(nome='Dr. João', crm='12345', especialidade=cardiologia, sala='101')
+        agora = timezone.now()
+        Senha.objects.create(numero='NC001', tipo='N', especialidade=cardiologia)
+        Senha.objects.create(
+            numero='PC001', tipo='P', especialidade=cardiologia, status='em_triagem',
+            guiche=guiche, chamado_guiche_em=agora, triagem_iniciada_em=agora
+        )
+        Senha.objects.create(
+            numero='UC001', tipo='U', especialidade=cardiologia, status='concluido',
+            guiche=guiche, profissional=medico, nome_paciente='Maria José',
+            observacoes_triagem='Pressão "alta"\nretorno', chamado_guiche_em=agora,
+            chamado_medico_em=agora.replace(microsecond=0), concluido_em=agora
+        )
+        Senha.objects.create(numero='NC002', tipo='N', especialidade=cardiologia, status='desistencia')
+
+    def test_json_identico_ao_serializer_padrao(self):
+        senhas = Senha.objects.select_related('especialidade', 'guiche', 'profissional')
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(SenhaSerializerRapido(senhas).data),
+            renderer.render(SenhaSerializer(senhas, many=True).data)
+        )
+
+    def test_json_identico_em_utc(self):
+        senhas = Senha.objects.select_related('especialidade', 'guiche', 'profissional')
+        with timezone.override('UTC'):
+            self.assertEqual(
+                JSONRenderer().render(SenhaSerializerRapido(senhas).data),
+                JSONRenderer().render(SenhaSerializer(senhas, many=True).data)
+            )
+
+    def test_listas_da_api_usam_uma_consulta(self):
+        with self.assertNumQueries(1):
+            resposta = self.client.get('/api/senhas/hoje/')
+        self.assertEqual(len(resposta.json()['results']), 4)
+
+
+class PaginacaoKeysetTests(TestCase):
+    def setUp(self):
+        self.especialidade = Especialidade.objects.create(nome='Clínica', sigla='CLI')
+        inicio = timezone.now() - timedelta(hours=1)
+        # Timestamps repetidos para exercitar o desempate por id
+        self.senhas = [
+            Senha.objects.create(
+                numero=f'NCLI{i:03d}', tipo='N', especialidade=self.especialidade, status='concluido',
+                concluido_em=inicio + timedelta(minutes=i // 3) if i < 10 else None,
+            )
+            for i in range(12)
+        ]
+
+    def _percorrer(self, url):
+        numeros, paginas = [], 0
+        while url:
+            with self.assertNumQueries(1 if paginas < 3 else 2):
+                dados = self.client.get(url).json()
+            self.assertNotIn('count', dados)
+            numeros += [s['numero'] for s in dados['results']]
+            url, paginas = dados['next'], paginas + 1
+        return numeros, paginas
+
+    def test_percorre_todas_as_senhas_sem_repetir(self):
+        numeros, paginas = self._percorrer('/api/senhas/finalizadas/?limite=3')
+        esperado = sorted(self.senhas[:10], key=lambda s: (s.concluido_em, s.id), reverse=True)
+        # Senhas sem concluido_em vêm ao final, por id
+        esperado += sorted(self.senhas[10:], key=lambda s: s.id, reverse=True)
+        self.assertEqual(numeros, [s.numero for s in esperado])
+        self.assertEqual(paginas, 4)
+
+    def test_lista_padrao_usa_criado_em(self):
+        vistos, url = [], '/api/senhas/?limite=5'
+        while url:
+            dados = self.client.get(url).json()
+            vistos += [s['id'] for s in dados['results']]
+            url = dados['next']
+        self.assertEqual(vistos, [s.id for s in reversed(self.senhas)])
+
+    def test_em_atendimento_pela_ultima_chamada(self):
+        agora = timezone.now()
+        for numero, status, guiche, medico in [
+            ('NC901', 'em_triagem', 10, None), ('NC902', 'em_consulta', 60, 5), ('NC903', 'chamando_medico', 50, 20),
+        ]:
+            Senha.objects.create(
+                numero=numero, tipo='N', especialidade=self.especialidade, status=status,
+                chamado_guiche_em=agora - timedelta(minutes=guiche),
+                chamado_medico_em=medico and agora - timedelta(minutes=medico),
+            )
+        numeros, url = [], '/api/senhas/em_atendimento/?limite=2'
+        while url:
+            dados = self.client.get(url).json()
+            numeros += [s['numero'] for s in dados['results']]
+            url = dados['next']
+        self.assertEqual(numeros, ['NC902', 'NC901', 'NC903'])
+
+    def test_cursor_invalido(self):
+        self.assertEqual(self.client.get('/api/senhas/hoje/?cursor=lixo').status_code, 404)
+
+
+class ExportacaoTests(TestCase):
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        self.pediatria = Especialidade.objects.create(nome='Pediatria', sigla='P')
+        for i in range(5):
+            Senha.objects.create(numero=f'NC{i:03d}', tipo='N', especialidade=self.cardiologia, nome_paciente=f'Paciente, {i}')
+        Senha.objects.create(numero='NP001', tipo='N', especialidade=self.pediatria)
+        antiga = Senha.objects.create(numero='NC900', tipo='N', especialidade=self.cardiologia)
+        Senha.objects.filter(pk=antiga.pk).update(criado_em=timezone.now() - timedelta(days=40))
+
+    def _conteudo(self, resposta):
+        return b''.join(resposta.streaming_content).decode()
+
+    def test_ndjson_em_fluxo_com_filtros(self):
+        hoje = timezone.localdate().isoformat()
+        resposta = self.client.get(
+            f'/api/senhas/exportar/?inicio={hoje}&fim={hoje}&especialidade_id={self.cardiologia.id}'
+        )
+        self.assertTrue(resposta.streaming)
+        self.assertEqual(resposta['Content-Type'], 'application/x-ndjson')
+        registros = [json.loads(linha) for linha in self._conteudo(resposta).splitlines()]
+        self.assertEqual([r['numero'] for r in registros], [f'NC{i:03d}' for i in range(5)])
+        esperado = SenhaSerializer(Senha.objects.get(numero='NC000')).data
+        self.assertEqual(registros[0], json.loads(JSONRenderer().render(esperado)))
+
+    def test_csv_em_lotes(self):
+        linhas = list(csv.DictReader(io.StringIO(
+            ''.join(exportar('csv', senhas_para_exportar(), tamanho_lote=2))
+        )))
+        self.assertEqual(len(linhas), 7)
+        self.assertEqual(linhas[1]['nome_paciente'], 'Paciente, 0')
+        self.assertEqual(linhas[0]['numero'], 'NC900')
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.client.get('/api/senhas/exportar/?formato=xml').status_code, 400)
+        self.assertEqual(self.client.get('/api/senhas/exportar/?inicio=2024-02-30').status_code, 400)
+
+    def test_comando(self):
+        saida = io.StringIO()
+        call_command('exportar_senhas', '--especialidade', str(self.pediatria.id), stdout=saida)
+        self.assertEqual([json.loads(l)['numero'] for l in saida.getvalue().splitlines()], ['NP001'])
+
+
+class FilaSenhasTests(TestCase):
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        self.pediatria = Especialidade.objects.create(nome='Pediatria', sigla='P')
+
+    def _senha(self, numero, tipo, minutos_atras, especialidade=None, status='aguardando_guiche'):
+        entrada = timezone.now() - timedelta(minutes=minutos_atras)
+        senha = Senha.objects.create(
+            numero=numero, tipo=tipo, especialidade=especialidade or self.cardiologia, status=status,
+            triagem_finalizada_em=entrada if status == 'aguardando_medico' else None,
+        )
+        Senha.objects.filter(pk=senha.pk).update(
+            criado_em=entrada, prioridade=Senha.calcular_prioridade(tipo, entrada)
+        )
+        return senha
+
+    def test_urgencia_e_preferencial_na_frente_com_envelhecimento(self):
+        self._senha('NC001', 'N', 10)
+        self._senha('PC001', 'P', 5)
+        self._senha('UC001', 'U', 1)
+        # Normal esperando mais que o bônus da Preferencial
+        self._senha('NC000', 'N', 45)
+        ordem = list(FilaSenhas('guiche').senhas().values_list('numero', flat=True))
+        self.assertEqual(ordem, ['UC001', 'NC000', 'PC001', 'NC001'])
+
+    def test_fila_do_medico_por_especialidade(self):
+        self._senha('NC001', 'N', 10, status='aguardando_medico')
+        self._senha('NP001', 'N', 20, especialidade=self.pediatria, status='aguardando_medico')
+        self.assertEqual(FilaSenhas('medico', self.cardiologia.id).espiar().numero, 'NC001')
+        self.assertEqual(FilaSenhas('medico').espiar().numero, 'NP001')
+
+    def test_prioridade_recalculada_ao_entrar_na_fila_do_medico(self):
+        senha = Senha.objects.create(numero='PC001', tipo='P', especialidade=self.cardiologia)
+        self.assertIsNotNone(senha.prioridade)
+        senha.status = 'aguardando_medico'
+        senha.triagem_finalizada_em = timezone.now() + timedelta(minutes=5)
+        senha.save(update_fields=['status', 'triagem_finalizada_em'])
+        senha.refresh_from_db()
+        self.assertEqual(senha.prioridade, Senha.calcular_prioridade('P', senha.triagem_finalizada_em))
+
+    def test_retirar_leva_a_proxima_e_publica_evento(self):
+        self._senha('NC001', 'N', 10)
+        self._senha('UC001', 'U', 1)
+        guiche = Guiche.objects.create(numero='01', nome='Triagem 1')
+        barramento = obter_barramento()
+        versao = barramento.versao()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            senha = FilaSenhas('guiche').retirar('chamar_guiche', guiche=guiche)
+        self.assertEqual((senha.numero, senha.status, senha.guiche_id), ('UC001', 'chamando_guiche', guiche.id))
+        evento = barramento.desde(versao)[-1][1]
+        self.assertEqual((evento['status_anterior'], evento['status']), ('aguardando_guiche', 'chamando_guiche'))
+
+        self.assertEqual(FilaSenhas('guiche').retirar('chamar_guiche').numero, 'NC001')
+        self.assertIsNone(FilaSenhas('guiche').retirar('chamar_guiche'))
+
+    def test_api_proxima(self):
+        self.assertEqual(self.client.get('/api/senhas/proxima/').status_code, 204)
+        self._senha('PC001', 'P', 1)
+        resposta = self.client.get('/api/senhas/proxima/?etapa=guiche')
+        self.assertEqual(resposta.json()['numero'], 'PC001')
+        self.assertEqual(self.client.get('/api/senhas/proxima/?etapa=outra').status_code, 400)
+        self.assertEqual(self.client.get('/api/senhas/proxima/?etapa=medico&especialidade_id=abc').status_code, 400)
+        self.assertEqual(self.client.get('/api/senhas/aguardando_medico/?especialidade_id=abc').status_code, 400)
+
+
+class ChamarProximaTests(TestCase):
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        self.guiche1 = Guiche.objects.create(numero='01', nome='Triagem 1')
+        self.guiche2 = Guiche.objects.create(numero='02', nome='Triagem 2')
+        self.medico = Profissional.objects.create(
+            nome='Dr. Teste', crm='12345', uf_crm='MT', especialidade=self.cardiologia
+        )
+        self.normal = Senha.objects.create(numero='NC001', tipo='N', especialidade=self.cardiologia)
+        self.urgente = Senha.objects.create(numero='UC001', tipo='U', especialidade=self.cardiologia)
+
+    def test_guiches_nunca_levam_a_mesma_senha(self):
+        r1 = self.client.post('/guiche/chamar-proxima/', {'guiche_id': self.guiche1.id}).json()
+        r2 = self.client.post('/guiche/chamar-proxima/', {'guiche_id': self.guiche2.id}).json()
+        self.assertEqual((r1['numero'], r2['numero']), ('UC001', 'NC001'))
+        self.urgente.refresh_from_db()
+        self.assertEqual((self.urgente.status, self.urgente.guiche_id), ('chamando_guiche', self.guiche1.id))
+
+        # Guichê ocupado e fila vazia
+        self.assertEqual(self.client.post('/guiche/chamar-proxima/', {'guiche_id': self.guiche1.id}).status_code, 400)
+        livre = Guiche.objects.create(numero='03', nome='Triagem 3')
+        self.assertEqual(self.client.post('/guiche/chamar-proxima/', {'guiche_id': livre.id}).status_code, 404)
+
+    def test_senha_levada_por_outra_mesa_passa_para_a_seguinte(self):
+        # Simula a corrida: a cabeça lida já foi chamada por outro guichê
+        Senha.objects.filter(pk=self.urgente.pk).update(status='chamando_guiche', guiche=self.guiche2)
+        with mock.patch.object(FilaSenhas, '_proxima_id', side_effect=[self.urgente.id, self.normal.id]):
+            senha = FilaSenhas('guiche').retirar('chamar_guiche', guiche=self.guiche1)
+        self.assertEqual(senha.id, self.normal.id)
+        self.urgente.refresh_from_db()
+        self.assertEqual(self.urgente.guiche_id, self.guiche2.id)
+
+    def test_medico_chama_proximo_da_especialidade(self):
+        Senha.objects.filter(pk=self.normal.pk).update(status='aguardando_medico')
+        resposta = self.client.post('/medico/chamar-proxima/', {'medico_id': self.medico.id}).json()
+        self.assertEqual(resposta['numero'], 'NC001')
+        self.normal.refresh_from_db()
+        self.assertEqual((self.normal.status, self.normal.profissional_id), ('chamando_medico', self.medico.id))
+
+    def test_api(self):
+        resposta = self.client.post(
+            '/api/senhas/chamar_proxima_guiche/', {'guiche_id': self.guiche1.id}, content_type='application/json'
+        )
+        self.assertEqual(resposta.json()['numero'], 'UC001')
+        resposta = self.client.post(
+            '/api/senhas/chamar_proxima_medico/', {'profissional_id': self.medico.id}, content_type='application/json'
+        )
+        self.assertEqual(resposta.status_code, 204)
+        self.assertEqual(self.client.post('/api/senhas/chamar_proxima_guiche/', {}).status_code, 400)
+        # Guichê ocupado também na API
+        resposta = self.client.post(
+            '/api/senhas/chamar_proxima_guiche/', {'guiche_id': self.guiche1.id}, content_type='application/json'
+        )
+        self.assertEqual(resposta.status_code, 400)
+
+    def test_ids_nao_numericos(self):
+        self.assertEqual(self.client.post('/guiche/chamar-proxima/', {'guiche_id': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.post('/medico/chamar-proxima/', {'medico_id': '1x'}).status_code, 400)
+        for url, campo in [('/api/senhas/chamar_proxima_guiche/', 'guiche_id'),
+                           ('/api/senhas/chamar_proxima_medico/', 'profissional_id')]:
+            resposta = self.client.post(url, {campo: 'abc'}, content_type='application/json')
+            self.assertEqual(resposta.status_code, 400)
+
+    def test_mesa_ocupada_verificada_na_transacao_da_retirada(self):
+        chamar_proxima_guiche(self.guiche1)
+        with self.assertRaises(MesaOcupada):
+            chamar_proxima_guiche(self.guiche1)
+        self.normal.refresh_from_db()
+        self.assertEqual(self.normal.status, 'aguardando_guiche')
+
+
+class TransicoesTests(TestCase):
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        self.guiche = Guiche.objects.create(numero='01', nome='Triagem 1')
+        self.senha = Senha.objects.create(numero='PC001', tipo='P', especialidade=self.cardiologia)
+
+    def test_fluxo_completo_com_update_condicional(self):
+        barramento = obter_barramento()
+        versao = barramento.versao()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(2):
+                senha = transicionar(self.senha.id, 'chamar_guiche', guiche=self.guiche)
+            for nome in ('iniciar_triagem', 'finalizar_triagem', 'chamar_medico', 'iniciar_consulta'):
+                with self.assertNumQueries(1):
+                    senha = transicionar(senha, nome)
+            # A finalização também atualiza o resumo diário, na mesma transação
+            senha = transicionar(senha, 'finalizar_consulta')
+
+        self.senha.refresh_from_db()
+        self.assertEqual((self.senha.status, self.senha.guiche_id), ('concluido', self.guiche.id))
+        self.assertIsNotNone(self.senha.concluido_em)
+        self.assertEqual(
+            self.senha.prioridade, Senha.calcular_prioridade('P', self.senha.triagem_finalizada_em)
+        )
+        eventos = [(e['status_anterior'], e['status']) for _, e in barramento.desde(versao)]
+        self.assertEqual(eventos, [
+            ('aguardando_guiche', 'chamando_guiche'), ('chamando_guiche', 'em_triagem'),
+            ('em_triagem', 'aguardando_medico'), ('aguardando_medico', 'chamando_medico'),
+            ('chamando_medico', 'em_consulta'), ('em_consulta', 'concluido'),
+        ])
+
+    def test_instancia_desatualizada_nao_sobrescreve(self):
+        desatualizada = Senha.objects.get(id=self.senha.id)
+        transicionar(self.senha.id, 'cancelar')
+        # O UPDATE condicional falha, a senha é relida e a transição reavaliada
+        with self.assertRaises(TransicaoInvalida):
+            transicionar(desatualizada, 'chamar_guiche', guiche=self.guiche)
+        self.senha.refresh_from_db()
+        self.assertEqual((self.senha.status, self.senha.guiche_id), ('cancelado', None))
+
+    def test_senha_finalizada_nao_e_cancelada_de_novo(self):
+        transicionar(self.senha.id, 'cancelar')
+        for nome in ('cancelar', 'desistencia'):
+            with self.assertRaises(TransicaoInvalida):
+                transicionar(self.senha.id, nome)
+        self.assertEqual(self.client.post(f'/api/senhas/{self.senha.id}/cancelar/').status_code, 400)
+
+        resumo = ResumoDiario.objects.get()
+        self.assertEqual((resumo.canceladas, resumo.desistencias), (1, 0))
+        self.senha.refresh_from_db()
+        self.assertEqual(self.senha.status, 'cancelado')
+
+    def test_views_respondem_com_erro_de_transicao(self):
+        resposta = self.client.post(f'/guiche/iniciar-triagem/{self.senha.id}/')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(resposta.json()['error'], 'Esta senha não está sendo chamada.')
+
+        resposta = self.client.post(f'/api/senhas/{self.senha.id}/finalizar_consulta/')
+        self.assertEqual(resposta.json(), {'error': 'Paciente não está em consulta'})
+
+        resposta = self.client.post(f'/api/senhas/{self.senha.id}/chamar_guiche/', {'guiche_id': self.guiche.id})
+        self.assertEqual((resposta.json()['status'], resposta.json()['guiche']), ('chamando_guiche', self.guiche.id))
+
+
+class OperacoesEmLoteTests(TestCase):
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        self.pediatria = Especialidade.objects.create(nome='Pediatria', sigla='P')
+        self.guiche = Guiche.objects.create(numero='01', nome='Triagem 1')
+        self.medico = Profissional.objects.create(
+            nome='Dr. Teste', crm='12345', uf_crm='MT', especialidade=self.cardiologia
+        )
+
+    def _senha(self, numero, especialidade=None, **campos):
+        return Senha.objects.create(numero=numero, tipo='N', especialidade=especialidade or self.cardiologia, **campos)
+
+    def test_cancelar_fila_da_especialidade_com_um_evento(self):
+        for i in range(3):
+            self._senha(f'NC00{i}')
+        self._senha('NC010', status='aguardando_medico')
+        self._senha('NC020', status='em_consulta')
+        self._senha('NP001', especialidade=self.pediatria)
+        barramento = obter_barramento()
+        versao = barramento.versao()
+        etag = self.client.get(f'/api/senhas/aguardando_medico/?especialidade_id={self.cardiologia.id}')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(
+                '/api/senhas/lote_cancelar_aguardando/',
+                {'especialidade_id': self.cardiologia.id, 'motivo': 'desistencia'}, content_type='application/json'
+            )
+        self.assertEqual(resposta.json(), {'alteradas': 4})
+        self.assertEqual(
+            dict(Senha.objects.values_list('numero', 'status').filter(numero__in=['NC000', 'NC020', 'NP001'])),
+            {'NC000': 'desistencia', 'NC020': 'em_consulta', 'NP001': 'aguardando_guiche'}
+        )
+        eventos = barramento.desde(versao)
+        self.assertEqual(len(eventos), 1)
+        self.assertEqual(eventos[0][1]['status_anteriores'], ['aguardando_guiche', 'aguardando_medico'])
+        resposta = self.client.get(
+            f'/api/senhas/aguardando_medico/?especialidade_id={self.cardiologia.id}', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_lotes_validam_os_parametros(self):
+        self._senha('NC001')
+        for dados in [{'especialidade_id': 'abc'}, {'especialidade_id': self.cardiologia.id, 'motivo': 'xyz'}]:
+            resposta = self.client.post('/api/senhas/lote_cancelar_aguardando/', dados, content_type='application/json')
+            self.assertEqual(resposta.status_code, 400)
+        for dados in [{'guiche_id': 'abc'}, {'profissional_id': 'abc'}]:
+            resposta = self.client.post('/api/senhas/lote_redistribuir/', dados, content_type='application/json')
+            self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(Senha.objects.get(numero='NC001').status, 'aguardando_guiche')
+
+    def test_encerrar_chamadas_antigas(self):
+        antiga = timezone.now() - timedelta(minutes=30)
+        self._senha('NC001', status='chamando_guiche', chamado_guiche_em=antiga)
+        self._senha('NC002', status='chamando_medico', chamado_medico_em=antiga)
+        self._senha('NC003', status='chamando_guiche', chamado_guiche_em=timezone.now())
+        self._senha('NC004', status='em_triagem', chamado_guiche_em=antiga)
+        # SELECT das afetadas e um UPDATE (mais SAVEPOINT/RELEASE da transação),
+        # releitura das finalizadas e atualização de uma linha do resumo diário
+        with self.assertNumQueries(10):
+            self.assertEqual(transicoes.encerrar_chamadas_antigas(15), 2)
+        self.assertEqual(
+            list(Senha.objects.filter(status='desistencia').order_by('numero').values_list('numero', flat=True)),
+            ['NC001', 'NC002']
+        )
+
+    def test_redistribuir_mantem_a_prioridade(self):
+        senha = self._senha('NC001')
+        prioridade = senha.prioridade
+        transicionar(senha, 'chamar_guiche', guiche=self.guiche)
+        transicionar(senha, 'iniciar_triagem')
+        self.guiche.ativo = False
+        self.guiche.save()
+
+        resposta = self.client.post('/api/senhas/lote_redistribuir/', {'guiche_id': self.guiche.id})
+        self.assertEqual(resposta.json(), {'alteradas': 1})
+        senha.refresh_from_db()
+        self.assertEqual((senha.status, senha.guiche_id, senha.prioridade), ('aguardando_guiche', None, prioridade))
+        self.assertEqual(FilaSenhas('guiche').espiar().id, senha.id)
+
+        paciente = self._senha('NC002', status='em_consulta', profissional=self.medico)
+        self.assertEqual(transicoes.redistribuir_medico(self.medico), 1)
+        paciente.refresh_from_db()
+        self.assertEqual((paciente.status, paciente.profissional_id), ('aguardando_medico', None))
+
+
+class ArquivamentoTests(TestCase):
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        ontem = timezone.now() - timedelta(days=1)
+        for i, status in enumerate(['concluido', 'cancelado', 'desistencia', 'em_consulta']):
+            senha = Senha.objects.create(numero=f'NC{i:03d}', tipo='N', especialidade=self.cardiologia)
+            Senha.objects.filter(pk=senha.pk).update(
+                status=status, criado_em=ontem,
+                concluido_em=None if status == 'em_consulta' else ontem,
+            )
+        Senha.objects.create(numero='NC100', tipo='N', especialidade=self.cardiologia, status='concluido',
+                             concluido_em=timezone.now())
+
+    def test_move_finalizadas_de_dias_anteriores_em_lotes(self):
+        barramento = obter_barramento()
+        versao = barramento.versao()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(arquivamento.arquivar(tamanho_lote=2), 3)
+
+        self.assertEqual(sorted(Senha.objects.values_list('numero', flat=True)), ['NC003', 'NC100'])
+        arquivada = SenhaHistorico.objects.get(numero='NC000')
+        self.assertEqual(arquivada.mes, arquivamento.mes_de(arquivada.criado_em))
+        self.assertEqual(arquivada.mes.day, 1)
+        # Um único evento, sem um 'removida' por senha
+        eventos = [evento for _, evento in barramento.desde(versao)]
+        self.assertEqual(eventos, [{'evento': 'arquivamento', 'quantidade': 3}])
+        self.assertEqual(arquivamento.arquivar(), 0)
+
+    def test_exportacao_le_a_uniao(self):
+        arquivamento.arquivar()
+        numeros = [linha['numero'] for linha in senhas_para_exportar()]
+        self.assertEqual(sorted(numeros), ['NC000', 'NC001', 'NC002', 'NC003', 'NC100'])
+        ontem = timezone.localdate() - timedelta(days=1)
+        numeros = [linha['numero'] for linha in senhas_para_exportar(ontem, ontem)]
+        self.assertEqual(sorted(numeros), ['NC000', 'NC001', 'NC002', 'NC003'])
+
+    def test_id_ja_arquivado_fica_em_senha(self):
+        senha = Senha.objects.get(numero='NC000')
+        SenhaHistorico.objects.create(
+            id=senha.id, mes=arquivamento.mes_de(senha.criado_em), numero='OUTRA', tipo='N',
+            especialidade=self.cardiologia, status='concluido', criado_em=senha.criado_em,
+        )
+        with self.assertLogs('app_medpass.arquivamento', 'WARNING'):
+            self.assertEqual(arquivamento.arquivar(tamanho_lote=2), 2)
+        self.assertTrue(Senha.objects.filter(pk=senha.pk).exists())
+        self.assertEqual(SenhaHistorico.objects.get(pk=senha.pk).numero, 'OUTRA')
+
+    def test_api_obtem_senha_arquivada(self):
+        senha = Senha.objects.get(numero='NC000')
+        arquivamento.arquivar()
+        resposta = self.client.get(f'/api/senhas/{senha.id}/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual((resposta.json()['numero'], resposta.json()['status']), ('NC000', 'concluido'))
+        self.assertEqual(self.client.get('/api/senhas/999999/').status_code, 404)
+
+    def test_comando(self):
+        saida = io.StringIO()
+        call_command('arquivar_senhas', '--lote', '1', stdout=saida)
+        self.assertIn('3 senha(s) arquivada(s)', saida.getvalue())
+        self.assertEqual(SenhaHistorico.objects.count(), 3)
+
+    @override_settings(MEDPASS_ARQUIVAMENTO={'AO_VIRAR_O_DIA': True, 'LOTE': 10})
+    def test_virada_do_dia_agenda_uma_vez(self):
+        arquivamento._ultimo_dia = None
+        with mock.patch.object(arquivamento.threading, 'Thread') as thread:
+            with self.captureOnCommitCallbacks(execute=True):
+                SequenciaSenha.proximo(timezone.localdate(), 'N', 'X')
+                SequenciaSenha.proximo(timezone.localdate(), 'P', 'X')
+        thread.assert_called_once_with(
+            target=arquivamento._arquivar_em_segundo_plano,
+            args=(timezone.localdate(), 10), daemon=True,
+        )
+
+
+class DDSketchTests(TestCase):
+    def test_quantis_com_erro_relativo_limitado(self):
+        valores = [float(i) for i in range(1, 10001)]
+        sketch = DDSketch()
+        for valor in valores:
+            sketch.adicionar(valor)
+        for q in (0.5, 0.9, 0.99):
+            exato = valores[int(q * (len(valores) - 1))]
+            self.assertLessEqual(abs(sketch.quantil(q) - exato) / exato, 0.01)
+        self.assertLess(len(sketch.baldes), 500)
+        self.assertEqual(sketch.media, sum(valores) / len(valores))
+
+    def test_mesclar_e_serializar(self):
+        a, b = DDSketch(), DDSketch()
+        for i in range(100):
+            a.adicionar(i)
+            b.adicionar(i + 100)
+        mesclado = DDSketch.de_dict(json.loads(json.dumps(a.para_dict()))).mesclar(b)
+        self.assertEqual((mesclado.contagem, mesclado.minimo, mesclado.maximo), (200, 0, 199))
+        self.assertAlmostEqual(mesclado.quantil(0.5), 99.5, delta=1.5)
+        self.assertIsNone(DDSketch().quantil(0.5))
+
+
+class ResumoDiarioTests(TestCase):
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        self.guiche = Guiche.objects.create(numero='01', nome='Triagem 1')
+
+    def _atender(self, numero, espera_minutos):
+        senha = Senha.objects.create(numero=numero, tipo='N', especialidade=self.cardiologia)
+        Senha.objects.filter(pk=senha.pk).update(criado_em=timezone.now() - timedelta(minutes=espera_minutos))
+        senha.refresh_from_db()
+        for nome in ('iniciar_triagem', 'finalizar_triagem', 'chamar_medico', 'iniciar_consulta', 'finalizar_consulta'):
+            if nome == 'iniciar_triagem':
+                senha = transicionar(senha, 'chamar_guiche', guiche=self.guiche)
+            senha = transicionar(senha, nome)
+        return senha
+
+    def test_incremental_igual_ao_recalculo(self):
+        for i, minutos in enumerate([10, 20, 30]):
+            self._atender(f'NC00{i}', minutos)
+        transicionar(Senha.objects.create(numero='NC010', tipo='N', especialidade=self.cardiologia), 'cancelar')
+        Senha.objects.create(numero='NC011', tipo='N', especialidade=self.cardiologia)
+        transicoes.cancelar_aguardando(self.cardiologia.id, 'desistencia')
+
+        resumo = ResumoDiario.objects.get()
+        self.assertEqual(
+            (resumo.emitidas, resumo.concluidas, resumo.canceladas, resumo.desistencias), (5, 3, 1, 1)
+        )
+        incremental = resumos.consultar()
+        resumos.recalcular()
+        self.assertEqual(resumos.consultar(), incremental)
+
+        espera = incremental[0]['tempos']['espera_guiche']
+        self.assertEqual(espera['quantidade'], 3)
+        self.assertAlmostEqual(espera['p50'], 20 * 60, delta=20 * 60 * 0.01)
+        self.assertEqual(incremental[0]['tempos']['consulta']['quantidade'], 3)
+
+    def test_api_combina_os_dias(self):
+        self._atender('NC001', 10)
+        ontem = timezone.localdate() - timedelta(days=1)
+        ResumoDiario.objects.create(
+            data=ontem, especialidade=self.cardiologia, tipo='N', emitidas=4, concluidas=4,
+        )
+        resposta = self.client.get(f'/api/senhas/resumos/?inicio={ontem}&agrupar_por=especialidade')
+        self.assertEqual(resposta.status_code, 200)
+        [grupo] = resposta.json()
+        self.assertEqual((grupo['especialidade_nome'], grupo['emitidas'], grupo['concluidas']), ('Cardiologia', 5, 5))
+        self.assertEqual(len(self.client.get('/api/senhas/resumos/').json()), 2)
+        self.assertEqual(self.client.get('/api/senhas/resumos/?tipo=X').status_code, 400)
+
+    def test_comando_recalcula_a_partir_do_historico(self):
+        self._atender('NC001', 10)
+        Senha.objects.filter(numero='NC001').update(criado_em=timezone.now() - timedelta(days=2))
+        ResumoDiario.objects.all().delete()
+        arquivamento.arquivar()
+        call_command('recalcular_resumos', stdout=io.StringIO())
+        resumo = ResumoDiario.objects.get()
+        self.assertEqual((resumo.data, resumo.concluidas), (timezone.localdate() - timedelta(days=2), 1))
+
+
+class EstimativasEsperaTests(TestCase):
+    def setUp(self):
+        self.barramento = BarramentoLocal()
+        self.estimativas = estimativas.EstimativasEspera(self.barramento, janela=600, fatias=2)
+
+    def _chamada(self, espera, especialidade_id=1, etapa='guiche'):
+        self.barramento.publicar({
+            'evento': 'status', 'status_anterior': f'aguardando_{etapa}', 'status': f'chamando_{etapa}',
+            'especialidade_id': especialidade_id, 'espera': espera,
+        })
+
+    def test_evento_da_chamada_leva_a_espera(self):
+        cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        guiche = Guiche.objects.create(numero='01', nome='Triagem 1')
+        senha = Senha.objects.create(numero='NC001', tipo='N', especialidade=cardiologia)
+        Senha.objects.filter(pk=senha.pk).update(criado_em=timezone.now() - timedelta(minutes=12))
+        barramento = obter_barramento()
+        versao = barramento.versao()
+        with self.captureOnCommitCallbacks(execute=True):
+            transicionar(senha.id, 'chamar_guiche', guiche=guiche)
+            transicionar(senha.id, 'iniciar_triagem')
+        eventos = [evento for _, evento in barramento.desde(versao)]
+        self.assertAlmostEqual(eventos[0]['espera'], 12 * 60, delta=5)
+        self.assertNotIn('espera', eventos[1])
+
+    def test_quantis_por_especialidade_com_reserva_da_etapa(self):
+        for segundos in range(60, 660, 60):
+            self._chamada(segundos)
+        estimativa = self.estimativas.estimativa('guiche', 1)
+        self.assertEqual((estimativa['especialidade_id'], estimativa['amostras']), (1, 10))
+        self.assertAlmostEqual(estimativa['p50'], 300, delta=300 * 0.02)
+        self.assertAlmostEqual(estimativa['p90'], 540, delta=540 * 0.02)
+        # Especialidade sem chamadas: usa a etapa inteira
+        self.assertEqual(self.estimativas.estimativa('guiche', 2)['especialidade_id'], None)
+        self.assertIsNone(self.estimativas.estimativa('medico')['p50'])
+
+    def test_janela_descarta_chamadas_antigas(self):
+        with mock.patch.object(estimativas.time, 'time', return_value=1_000_000):
+            self._chamada(600)
+        with mock.patch.object(estimativas.time, 'time', return_value=1_000_400):
+            self._chamada(60)
+            self.assertEqual(self.estimativas.estimativa('guiche')['amostras'], 2)
+        with mock.patch.object(estimativas.time, 'time', return_value=1_000_700):
+            estimativa = self.estimativas.estimativa('guiche')
+        self.assertEqual(estimativa['amostras'], 1)
+        self.assertAlmostEqual(estimativa['p50'], 60, delta=1)
+
+    def test_copia_no_banco_restaura_apos_reiniciar(self):
+        self._chamada(120)
+        self.estimativas.salvar()
+        self.assertEqual(EstimativaEspera.objects.count(), 2)
+        reiniciado = estimativas.EstimativasEspera(BarramentoLocal(), janela=600, fatias=2)
+        self.assertEqual(reiniciado.estimativa('guiche', 1)['amostras'], 1)
+
+    def test_api(self):
+        Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        estimativa = estimativas.EstimativasEspera(obter_barramento())
+        self.addCleanup(estimativa.encerrar)
+        with mock.patch.object(estimativas, '_estimativas', estimativa):
+            obter_barramento().publicar({
+                'evento': 'status', 'status_anterior': 'aguardando_guiche', 'status': 'chamando_guiche',
+                'especialidade_id': 1, 'espera': 240.0,
+            })
+            resposta = self.client.get('/api/senhas/estimativa_espera/?etapa=guiche')
+            self.assertEqual(resposta.status_code, 200)
+            self.assertEqual(resposta.json()['amostras'], 1)
+            self.assertEqual(resposta.json()['na_fila'], 0)
+            self.assertEqual(self.client.get('/api/senhas/estimativa_espera/?etapa=x').status_code, 400)
+
+
+class ViewsAssincronasTests(TestCase):
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        self.guiche = Guiche.objects.create(numero='01', nome='Triagem 1')
+        with self.captureOnCommitCallbacks(execute=True):
+            Senha.objects.create(numero='NC001', tipo='N', especialidade=self.cardiologia)
+            senha = Senha.objects.create(numero='NC002', tipo='N', especialidade=self.cardiologia)
+            transicionar(senha, 'chamar_guiche', guiche=self.guiche)
+
+    def test_mesmo_json_das_acoes_do_viewset(self):
+        self.assertEqual(self.client.get('/api/painel/').json(), self.client.get('/api/senhas/painel/').json())
+        for parametros in ('', '?agrupar_por=especialidade,tipo'):
+            self.assertEqual(
+                self.client.get(f'/api/estatisticas/{parametros}').json(),
+                self.client.get(f'/api/senhas/estatisticas/{parametros}').json(),
+            )
+
+    async def test_orm_assincrono_e_304(self):
+        cliente = AsyncClient()
+        resposta = await cliente.get('/api/senha-chamando/')
+        self.assertEqual(resposta.json()['guiche']['numero'], 'NC002')
+        self.assertEqual(
+            (await cliente.get('/api/senha-chamando/', headers={'If-None-Match': resposta['ETag']})).status_code, 304
+        )
+
+        resposta = await cliente.get('/api/senhas-aguardando/')
+        self.assertEqual([s['numero'] for s in resposta.json()['senhas']], ['NC001'])
+        resposta = await cliente.get('/api/senhas-aguardando/', {'tipo': 'medico', 'especialidade': 'abc'})
+        self.assertEqual(resposta.status_code, 400)
+
+        resposta = await cliente.get('/api/estatisticas/')
+        self.assertEqual(resposta.json()['total_hoje'], 2)
+        self.assertEqual(
+            (await cliente.get('/api/estatisticas/', headers={'If-None-Match': resposta['ETag']})).status_code, 304
+        )
+
+        resposta = await cliente.get('/painel/')
+        self.assertContains(resposta, 'NC002')
+
+
+class LongPollTests(TestCase):
+    url = '/api/senha-chamando/aguardar/'
+
+    def setUp(self):
+        self.cardiologia = Especialidade.objects.create(nome='Cardiologia', sigla='C')
+        self.barramento = obter_barramento()
+
+    def _evento(self, status, status_anterior):
+        return {'evento': 'status', 'id': 1, 'numero': 'NC001', 'tipo': 'N', 'especialidade_id': self.cardiologia.id,
+                'status': status, 'status_anterior': status_anterior, 'guiche_id': None, 'profissional_id': None}
+
+    async def test_primeira_requisicao_traz_o_estado_completo(self):
+        dados = (await AsyncClient().get(self.url)).json()
+        self.assertTrue(dados['completo'])
+        self.assertEqual(dados['chamando'], {'guiche': None, 'medico': None})
+        self.assertEqual(dados['versao'], f'{self.barramento.origem}-{self.barramento.versao()}')
+
+    async def test_timeout_sem_mudancas(self):
+        versao = f'{self.barramento.origem}-{self.barramento.versao()}'
+        dados = (await AsyncClient().get(self.url, {'versao': versao, 'timeout': '0.05'})).json()
+        self.assertEqual(dados, {'versao': versao, 'completo': False, 'eventos': []})
+
+    async def test_responde_assim_que_algo_muda(self):
+        versao = f'{self.barramento.origem}-{self.barramento.versao()}'
+        pedido = asyncio.ensure_future(AsyncClient().get(self.url, {'versao': versao, 'timeout': '5'}))
+        await asyncio.sleep(0.05)
+        self.assertFalse(pedido.done())
+        evento_id = self.barramento.publicar(self._evento('aguardando_guiche', None))
+        dados = (await asyncio.wait_for(pedido, 1)).json()
+        self.assertEqual(dados['versao'], f'{self.barramento.origem}-{evento_id}')
+        self.assertEqual([e['status'] for e in dados['eventos']], ['aguardando_guiche'])
+        # A senha em chamada não mudou
+        self.assertNotIn('chamando', dados)
+
+    async def test_filtro_por_fila(self):
+        versao = f'{self.barramento.origem}-{self.barramento.versao()}'
+        pedido = asyncio.ensure_future(AsyncClient().get(
+            self.url, {'versao': versao, 'timeout': '5', 'fila': 'em_atendimento'}
+        ))
+        await asyncio.sleep(0.05)
+        self.barramento.publicar(self._evento('aguardando_guiche', None))
+        await asyncio.sleep(0.05)
+        self.assertFalse(pedido.done())
+        self.barramento.publicar(self._evento('chamando_guiche', 'aguardando_guiche'))
+        dados = (await asyncio.wait_for(pedido, 1)).json()
+        self.assertEqual([e['status'] for e in dados['eventos']], ['chamando_guiche'])
+        self.assertIn('chamando', dados)
+
+    def test_wsgi_responde_na_hora(self):
+        versao = f'{self.barramento.origem}-{self.barramento.versao()}'
+        dados = self.client.get(self.url, {'versao': versao}).json()
+        self.assertEqual((dados['eventos'], dados['intervalo']), ([], 5000))
+        self.assertTrue(self.client.get(self.url, {'versao': 'outro-1'}).json()['completo'])
+        self.assertEqual(self.client.get(self.url, {'timeout': 'x'}).status_code, 400)
+        for valor in ('nan', 'inf', '-inf'):
+            self.assertEqual(self.client.get(self.url, {'timeout': valor}).status_code, 400)
+
+
+class EventosTempoRealTests(TestCase):
+    def setUp(self):
+        self.barramento = BarramentoLocal(capacidade=3)
+        patcher = mock.patch.object(views, 'obter_barramento', return_value=self.barramento)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def _quadros(self, ultimo_id, quantidade):
+        stream = views._stream_eventos(ultimo_id)
+        try:
+            return [await asyncio.wait_for(anext(stream), 1) for _ in range(quantidade)]
+        finally:
+            await stream.aclose()
+
+    def test_wsgi_responde_503(self):
+        resposta = self.client.get('/api/eventos/')
+        self.assertEqual(resposta.status_code, 503)
+        self.assertIn('ASGI', resposta.json()['error'])
+
+    async def test_entrega_eventos_apos_o_ultimo_id(self):
+        self.barramento.publicar({'numero': 'NC001'})
+        self.barramento.publicar({'numero': 'NC002'})
+        retry, quadro = await self._quadros(1, 2)
+        self.assertEqual(retry, 'retry: 3000\n\n')
+        self.assertEqual(quadro, 'id: 2\nevent: senha\ndata: {"numero": "NC002"}\n\n')
+
+    async def test_resync_quando_o_id_saiu_do_buffer(self):
+        for n in range(5):
+            self.barramento.publicar({'n': n})
+        # Eventos 2 e 3 já foram descartados (capacidade 3)
+        _, quadro = await self._quadros(1, 2)
+        self.assertEqual(quadro, 'id: 5\nevent: resync\ndata: {}\n\n')
+
+    async def test_keepalive_sem_eventos(self):
+        with mock.patch.object(views, 'INTERVALO_KEEPALIVE', 0.01):
+            _, quadro = await self._quadros(self.barramento.versao(), 2)
+        self.assertEqual(quadro, ': keepalive\n\n')
+
+
+class SimulacaoCargaTests(TestCase):
+    class ClienteFalso:
+        """Responde como as rotas reais, sem banco, e guarda as chamadas"""
+        chamadas = []
+
+        def requisitar(self, metodo, caminho, dados=None, cabecalhos=None):
+            self.chamadas.append((metodo, caminho.split('?')[0], cabecalhos))
+            if 'chamar-proxima' in caminho:
+                return 200, {}, json.dumps({'id': 7}).encode(), None
+            if caminho == '/gerar-senha/':
+                return 302, {}, b'', None
+            if cabecalhos and cabecalhos.get('If-None-Match') == '"v1"':
+                return 304, {}, b'', None
+            return 200, {'ETag': '"v1"'}, b'{}', None
+
+        def encerrar(self):
+            pass
+
+    def test_percentis_e_consultas(self):
+        medicoes = carga.Medicoes()
+        for ms in range(1, 101):
+            medicoes.registrar('rota/', ms / 1000, 200 if ms < 100 else 500, consultas=ms % 3)
+        [rota] = medicoes.relatorio(duracao=2)
+        self.assertEqual((rota['p50_ms'], rota['p99_ms']), (50.0, 99.0))
+        self.assertEqual((rota['requisicoes'], rota['por_segundo'], rota['erros']), (100, 50.0, 1))
+        self.assertEqual((rota['consultas_media'], rota['consultas_max']), (1.0, 2))
+
+    def test_cliente_local_conta_consultas(self):
+        Senha.objects.create(numero='NC001', tipo='N', especialidade=Especialidade.objects.create(nome='Clínica', sigla='C'))
+        status, _, _, consultas = carga.ClienteLocal().requisitar('post', '/gerar-senha/', {
+            'especialidade': Especialidade.objects.get().id, 'tipo': 'N',
+        })
+        self.assertEqual(status, 302)
+        self.assertGreater(consultas, 0)
+        self.assertEqual(Senha.objects.count(), 2)
+
+    def test_atores_percorrem_o_fluxo(self):
+        especialidades, guiches, medicos = carga.preparar_cadastros(2, 1, 1)
+        self.assertEqual((len(especialidades), len(guiches), len(medicos)), (1, 1, 1))
+        self.ClienteFalso.chamadas = []
+        simulacao = carga.Simulacao(
+            especialidades, guiches, medicos, fabrica_cliente=self.ClienteFalso,
+            totens=1, paineis=1, chegadas_por_hora=3600, triagem_minutos=1,
+            consulta_minutos=1, horas=1, acelerar=3600 / 0.3,
+        )
+        relatorio = simulacao.executar()
+
+        caminhos = {caminho for _, caminho, _ in self.ClienteFalso.chamadas}
+        self.assertTrue({
+            '/gerar-senha/', '/guiche/chamar-proxima/', '/guiche/iniciar-triagem/7/',
+            '/guiche/finalizar-triagem/7/', '/medico/chamar-proxima/', '/medico/iniciar-consulta/7/',
+            '/medico/finalizar-consulta/7/', '/api/senhas/painel/', '/api/senha-chamando/',
+        } <= caminhos)
+        # O painel repete o ETag recebido
+        self.assertIn({'If-None-Match': '"v1"'}, [c for _, caminho, c in self.ClienteFalso.chamadas
+                                                 if caminho == '/api/senhas/painel/'])
+        self.assertGreater(relatorio['senhas_emitidas'], 0)
+        self.assertGreater(relatorio['consultas_concluidas'], 0)
+        self.assertIn('medico/finalizar-consulta/<id>/', {r['rota'] for r in relatorio['rotas']})
+        self.assertIsNone(relatorio['rotas'][0]['consultas_media'])
+
+
+class TransacaoDeEscritaTests(TransactionTestCase):
+    @skipUnless(connection.vendor == 'sqlite', 'BEGIN IMMEDIATE é do SQLite')
+    def test_begin_immediate_so_no_bloco_externo(self):
+        modo = connection.transaction_mode
+        with CaptureQueriesContext(connection) as consultas:
+            with transacao_de_escrita():
+                self.assertEqual(connection.transaction_mode, modo)
+                with transacao_de_escrita():
+                    Especialidade.objects.create(nome='Clínica', sigla='C')
+        sql = [consulta['sql'] for consulta in consultas]
+        self.assertEqual(sql[0], 'BEGIN IMMEDIATE')
+        self.assertTrue(sql[1].startswith('SAVEPOINT'))
+        self.assertEqual(connection.transaction_mode, modo)
+        self.assertEqual(Especialidade.objects.count(), 1)
+
+    def test_rollback_em_erro(self):
+        with self.assertRaises(ValueError):
+            with transacao_de_escrita():
+                Especialidade.objects.create(nome='Clínica', sigla='C')
+                raise ValueError
+        self.assertFalse(Especialidade.objects.exists())
+
+
+class BancoOcupadoTests(TestCase):
+    def setUp(self):
+        self.guiche = Guiche.objects.create(numero='G01', nome='Guichê 1')
+        self.senha = Senha.objects.create(
+            numero='NC001', tipo='N', especialidade=Especialidade.objects.create(nome='Clínica', sigla='C'),
+        )
+
+    def test_identifica_erros_de_lock(self):
+        self.assertTrue(banco_ocupado(OperationalError('database is locked')))
+        self.assertTrue(banco_ocupado(OperationalError('deadlock detected')))
+        self.assertFalse(banco_ocupado(OperationalError('no such table: x')))
+        self.assertFalse(banco_ocupado(ValueError('locked')))
+
+    def test_lock_vira_503(self):
+        erro = OperationalError('database is locked')
+        with mock.patch('app_medpass.views.chamar_proxima_guiche', side_effect=erro):
+            resposta = self.client.post(f'/guiche/chamar-proxima/?guiche={self.guiche.id}')
+        self.assertEqual((resposta.status_code, resposta['Retry-After']), (503, '1'))
+        # Também nas views que capturam Exception (antes: 500 com str(e))
+        with mock.patch('app_medpass.views.transicionar', side_effect=erro):
+            resposta = self.client.post(f'/guiche/iniciar-triagem/{self.senha.id}/')
+        self.assertEqual(resposta.status_code, 503)
+        self.assertNotIn('locked', resposta.json()['error'])
+
+    def test_outros_erros_continuam_500(self):
+        with mock.patch('app_medpass.views.transicionar', side_effect=OperationalError('disk I/O error')):
+            resposta = self.client.post(f'/guiche/iniciar-triagem/{self.senha.id}/')
+        self.assertEqual((resposta.status_code, resposta.json()['error']), (500, 'disk I/O error'))
+
+
+@mock.patch.object(roteamento, 'alias_replica', return_value='replica')
+class RoteadorReplicaTests(TestCase):
+    def setUp(self):
+        self.roteador = roteamento.RoteadorReplica()
+        self.fabrica = RequestFactory()
+
+    def _leitura(self):
+        return self.roteador.db_for_read(Senha)
+
+    def test_so_trechos_somente_leitura_vao_a_replica(self, _):
+        self.assertIsNone(self._leitura())
+        with roteamento.requisicao(), roteamento.leitura():
+            self.assertEqual(self._leitura(), 'replica')
+            # Depois de escrever, a requisição lê do principal
+            self.assertIsNone(self.roteador.db_for_write(Senha))
+            self.assertIsNone(self._leitura())
+        with roteamento.requisicao(fixado=True), roteamento.leitura():
+            self.assertIsNone(self._leitura())
+        self.assertFalse(self.roteador.allow_migrate('replica', 'app_medpass'))
+        self.assertIsNone(self.roteador.allow_migrate('default', 'app_medpass'))
+
+    def test_leitura_versionada_espera_o_atraso_maximo(self, _):
+        with roteamento.requisicao(), roteamento.leitura(roteamento.VERSIONADA):
+            roteamento.registrar_escrita()
+            self.assertIsNone(self._leitura())
+            with mock.patch.object(roteamento, '_ultima_escrita', time.monotonic() - 6):
+                self.assertEqual(self._leitura(), 'replica')
+
+    def test_decorator_em_view_assincrona(self, _):
+        @roteamento.somente_leitura
+        async def view(request):
+            return self._leitura()
+
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+        with roteamento.requisicao():
+            self.assertEqual(asyncio.run(view(None)), 'replica')
+        self.assertIsNone(self._leitura())
+
+    def test_cliente_que_escreveu_fica_no_principal(self, _):
+        middleware = ReplicaMiddleware(
+            roteamento.somente_leitura(lambda request: HttpResponse(self._leitura() or 'default'))
+        )
+        resposta = middleware(self.fabrica.post('/guiche/chamar-proxima/'))
+        self.assertEqual(resposta.cookies[roteamento.COOKIE]['max-age'], 5)
+        self.assertEqual(middleware(self.fabrica.get('/api/senhas/')).content, b'replica')
+
+        pedido = self.fabrica.get('/api/senhas/')
+        pedido.COOKIES[roteamento.COOKIE] = '1'
+        resposta = middleware(pedido)
+        self.assertEqual(resposta.content, b'default')
+        # Ler não renova o cookie
+        self.assertNotIn(roteamento.COOKIE, resposta.cookies)
+
+
+class MedicaoConsultasTests(TestCase):
+    def setUp(self):
+        self.especialidade = Especialidade.objects.create(nome='Clínica', sigla='C')
+        self.guiche = Guiche.objects.create(numero='G01', nome='Guichê 1')
+        for i in range(3):
+            Senha.objects.create(numero=f'NC{i:03d}', tipo='N', especialidade=self.especialidade)
+
+    def test_forma_ignora_valores(self):
+        self.assertEqual(
+            consultas.forma("SELECT * FROM t WHERE id IN (%s, %s, %s) AND nome = 'x' LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND nome = ? LIMIT ?',
+        )
+
+    def test_detecta_n_mais_1(self):
+        with consultas.medir_consultas() as registro:
+            [str(senha) for senha in Senha.objects.all()]
+        self.assertEqual(registro.quantidade, 4)
+        [(sql, vezes)] = registro.repetidas()
+        self.assertEqual(vezes, 3)
+        self.assertIn('app_medpass_especialidade', sql)
+
+        with self.assertRaisesMessage(AssertionError, '3x'):
+            with consultas.orcamento_consultas(10):
+                [str(senha) for senha in Senha.objects.all()]
+        with consultas.orcamento_consultas(1):
+            [str(senha) for senha in Senha.objects.select_related('especialidade')]
+
+    def test_painel_do_guiche_le_a_fila_uma_vez(self):
+        with consultas.orcamento_consultas(3):
+            resposta = self.client.get(f'/guiche/?guiche={self.guiche.id}')
+        self.assertEqual(resposta.context['total_aguardando'], 3)
+        self.assertEqual(consultas.orcamento_da_view(resposta.wsgi_request), 4)
+
+    @override_settings(MEDPASS_CONSULTAS={'SERVER_TIMING': True, 'ORCAMENTO_PADRAO': 0})
+    def test_middleware_server_timing_e_log(self):
+        with self.assertLogs('app_medpass.middleware', 'WARNING') as logs:
+            resposta = self.client.get('/api/senhas/')
+        self.assertRegex(resposta['Server-Timing'], r'^db;dur=[\d.]+;desc="1 consultas", total;dur=[\d.]+$')
+        self.assertIn('GET /api/senhas/: 1 consultas (orçamento 0)', logs.output[0])
+
+    @override_settings(MEDPASS_CONSULTAS={'SERVER_TIMING': True})
+    async def test_conta_consultas_das_views_assincronas(self):
+        resposta = await AsyncClient().get('/api/estatisticas/')
+        self.assertRegex(resposta['Server-Timing'], r'desc="[1-9]\d* consultas"')
+
+
+class MetricasTests(TestCase):
+    def setUp(self):
+        self.especialidade = Especialidade.objects.create(nome='Clínica', sigla='C')
+        self.barramento = BarramentoLocal()
+        self.metricas = metricas.MetricasSenhas(self.barramento, recontagem=0)
+        for i in range(2):
+            Senha.objects.create(numero=f'NC{i:03d}', tipo='N', especialidade=self.especialidade)
+
+    def _fila(self, fila):
+        return metricas.TAMANHO_FILA.valor(fila=fila, especialidade_id=self.especialidade.id)
+
+    def _evento(self, evento, status, status_anterior=None):
+        self.barramento.publicar({
+            'evento': evento, 'id': 1, 'tipo': 'P', 'especialidade_id': self.especialidade.id,
+            'status': status, 'status_anterior': status_anterior,
+        })
+
+    def test_filas_mantidas_pelos_eventos_sem_contar_a_tabela(self):
+        with self.assertNumQueries(1):
+            self.metricas.atualizar()
+        self.assertEqual(self._fila('aguardando_guiche'), 2)
+
+        emitidas = metricas.EMITIDAS.valor(tipo='P', especialidade_id=self.especialidade.id)
+        chamadas = metricas.TRANSICOES.valor(de='aguardando_guiche', para='chamando_guiche')
+        self._evento('criada', 'aguardando_guiche')
+        self._evento('status', 'chamando_guiche', 'aguardando_guiche')
+        self._evento('status', 'aguardando_medico', 'em_triagem')
+        self._evento('rechamada', 'chamando_guiche', 'chamando_guiche')
+        with self.assertNumQueries(0):
+            self.metricas.atualizar()
+        self.assertEqual((self._fila('aguardando_guiche'), self._fila('aguardando_medico')), (2, 1))
+        self.assertEqual(metricas.EMITIDAS.valor(tipo='P', especialidade_id=self.especialidade.id), emitidas + 1)
+        self.assertEqual(
+            metricas.TRANSICOES.valor(de='aguardando_guiche', para='chamando_guiche'), chamadas + 1
+        )
+
+        # Sem o status anterior não se sabe que fila mudou: conta de novo na próxima coleta
+        self._evento('status', 'cancelado')
+        with self.assertNumQueries(1):
+            self.metricas.atualizar()
+        self.assertEqual((self._fila('aguardando_guiche'), self._fila('aguardando_medico')), (2, 0))
+
+    def test_lote_informa_a_contagem_por_status_anterior(self):
+        Senha.objects.create(numero='NC010', tipo='N', especialidade=self.especialidade, status='aguardando_medico')
+        # O assinante do processo (apps.ready), que recebe os eventos das transições
+        metricas.obter_metricas_senhas().atualizar(forcar=True)
+        canceladas = metricas.TRANSICOES.valor(de='aguardando_guiche', para='cancelado')
+        with self.captureOnCommitCallbacks(execute=True):
+            transicoes.cancelar_aguardando(self.especialidade.id)
+        self.assertEqual((self._fila('aguardando_guiche'), self._fila('aguardando_medico')), (0, 0))
+        self.assertEqual(metricas.TRANSICOES.valor(de='aguardando_guiche', para='cancelado'), canceladas + 2)
+
+    def test_formato_de_exposicao(self):
+        histograma = metricas.Histograma('teste_segundos', 'Teste', ('view',), buckets=(0.1, 1))
+        for valor in (0.05, 0.1, 0.5, 3):
+            histograma.observar(valor, view='a"b')
+        self.assertEqual(histograma.exposicao().splitlines(), [
+            '# HELP teste_segundos Teste',
+            '# TYPE teste_segundos histogram',
+            'teste_segundos_bucket{view="a\\"b",le="0.1"} 2',
+            'teste_segundos_bucket{view="a\\"b",le="1"} 3',
+            'teste_segundos_bucket{view="a\\"b",le="+Inf"} 4',
+            'teste_segundos_sum{view="a\\"b"} 3.65',
+            'teste_segundos_count{view="a\\"b"} 4',
+        ])
+
+    def test_endpoint(self):
+        self.client.get('/api/senhas/')
+        with mock.patch.object(metricas, '_metricas_senhas', self.metricas):
+            resposta = self.client.get('/metricas/')
+        self.assertEqual(resposta['Content-Type'], metricas.CONTENT_TYPE)
+        texto = resposta.content.decode()
+        self.assertIn('medpass_requisicao_segundos_bucket{view="senha-list",metodo="GET",le="+Inf"}', texto)
+        self.assertRegex(texto, r'medpass_requisicoes_total\{view="senha-list",metodo="GET",status="200"\} \d+')
+        self.assertIn(f'medpass_fila_senhas{{fila="aguardando_guiche",especialidade_id="{self.especialidade.id}"}} 2', texto)
+
+
+class FragmentosPaineisTests(TestCase):
+    def setUp(self):
+        self.especialidade = Especialidade.objects.create(nome='Clínica', sigla='C')
+        self.guiche = Guiche.objects.create(numero='G01', nome='Guichê 1')
+        self.medico = Profissional.objects.create(
+            nome='Dr. Teste', crm='12345', uf_crm='MT', especialidade=self.especialidade
+        )
+        for i in range(2):
+            Senha.objects.create(numero=f'NC{i:03d}', tipo='N', especialidade=self.especialidade)
+
+    def test_acoes_do_guiche_devolvem_os_trechos(self):
+        dados = {'guiche_id': self.guiche.id, 'fragmentos': '1'}
+        with consultas.orcamento_consultas(8):
+            resposta = self.client.post('/guiche/chamar-proxima/', dados).json()
+        self.assertEqual(set(resposta['fragmentos']), {'atendimento', 'fila'})
+        self.assertEqual(resposta['contadores'], {'total_aguardando': 1})
+        self.assertIn('NC000', resposta['fragmentos']['atendimento'])
+        # Com uma senha em atendimento a fila não oferece "Chamar"
+        self.assertNotIn('chamarSenha(', resposta['fragmentos']['fila'])
+
+        senha_id = resposta['id']
+        resposta = self.client.post(f'/guiche/iniciar-triagem/{senha_id}/', {'fragmentos': '1'}).json()
+        self.assertEqual(set(resposta['fragmentos']), {'atendimento'})
+        self.assertIn('id="nome_paciente"', resposta['fragmentos']['atendimento'])
+
+        resposta = self.client.post(f'/guiche/finalizar-triagem/{senha_id}/', {'fragmentos': '1'}).json()
+        self.assertIn('Nenhuma senha em atendimento', resposta['fragmentos']['atendimento'])
+        self.assertIn('chamarSenha(', resposta['fragmentos']['fila'])
+
+        # Sem o pedido do painel a resposta continua só o JSON da ação
+        resposta = self.client.post('/guiche/chamar-proxima/', {'guiche_id': self.guiche.id}).json()
+        self.assertNotIn('fragmentos', resposta)
+
+    def test_fragmentos_do_guiche_custam_menos_que_a_pagina(self):
+        with consultas.orcamento_consultas(2):
+            resposta = self.client.get(f'/guiche/fragmentos/?guiche={self.guiche.id}')
+        self.assertEqual(resposta.json()['contadores'], {'total_aguardando': 2})
+        self.assertIn('chamarProxima()', resposta.json()['fragmentos']['atendimento'])
+        self.assertEqual(self.client.get('/guiche/fragmentos/').status_code, 400)
+
+    def test_painel_do_medico(self):
+        senha = Senha.objects.get(numero='NC000')
+        Senha.objects.filter(pk=senha.pk).update(status='aguardando_medico')
+        dados = {'medico_id': self.medico.id, 'fragmentos': '1'}
+        self.assertEqual(self.client.post('/medico/chamar-proxima/', dados).json()['contadores'], {'total_aguardando': 0})
+        self.client.post(f'/medico/iniciar-consulta/{senha.id}/')
+        resposta = self.client.post(f'/medico/finalizar-consulta/{senha.id}/', {'fragmentos': '1'}).json()
+        self.assertEqual(resposta['contadores'], {'total_aguardando': 0, 'atendidas_hoje': 1})
+        self.assertIn('Nenhum paciente em atendimento', resposta['fragmentos']['atendimento'])
+
+        with consultas.orcamento_consultas(4):
+            resposta = self.client.get(f'/medico/fragmentos/?medico={self.medico.id}')
+        self.assertEqual(resposta.json()['contadores'], {'total_aguardando': 0, 'atendidas_hoje': 1})
+        self.assertEqual(self.client.get('/medico/fragmentos/?medico=999').status_code, 404)
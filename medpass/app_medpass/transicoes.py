@@ -0,0 +1,218 @@
+"""
+Tabela de transições de status das senhas.
+
+Cada transição (chamar, iniciar triagem, finalizar consulta, cancelar...) é
+gravada por um UPDATE condicional que escreve só o status, o horário da etapa
+e os campos informados:
+
+    UPDATE senha SET status = ?, <horário> = ? WHERE id = ? AND status = <lido>
+
+A senha continua sendo lida antes (a resposta, o evento e o status anterior
+precisam dela), então as idas ao banco são as mesmas do get + save(): o ganho
+é a escrita menor e a ausência de sobrescrita, não uma consulta a menos.
+
+Se outra mesa mudou a senha nesse meio tempo, o UPDATE não encontra a linha e
+a transição é reavaliada com o status novo, em vez de sobrescrevê-lo (não há
+"lost update" como no get + save() de todas as colunas). Como update() não
+dispara post_save, o evento do barramento é publicado aqui, e as transições
+para um status final atualizam o resumo diário (resumos.py) na mesma transação
+(aberta com o lock de escrita no SQLite, ver banco.py).
+
+As operações em lote (fim do dia, incidentes) usam a mesma tabela com um único
+UPDATE para o conjunto de senhas e publicam um só evento agregado ('lote'),
+com a contagem das senhas por status anterior e especialidade (métricas).
+"""
+from collections import Counter
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .banco import transacao_de_escrita
+from .eventos import evento_da_senha, publicar_apos_commit
+from .models import Senha
+from .resumos import CAMPOS as CAMPOS_RESUMO, STATUS_FINAIS, registrar_finalizacao
+
+ETAPA_GUICHE = ('aguardando_guiche', 'chamando_guiche', 'em_triagem')
+EM_ATENDIMENTO_GUICHE = ('chamando_guiche', 'em_triagem')
+EM_ATENDIMENTO_MEDICO = ('chamando_medico', 'em_consulta')
+NAO_FINALIZADOS = tuple(status for status, _ in Senha.STATUS_CHOICES if status not in STATUS_FINAIS)
+
+
+class Transicao:
+    """Status de origem aceitos, status de destino e horário gravado (se houver)"""
+
+    def __init__(self, origens, destino, campo_data=None, evento='status'):
+        self.origens = origens
+        self.destino = destino
+        self.campo_data = campo_data
+        self.evento = evento
+
+    def valores(self, tipo, campos, agora):
+        """Colunas gravadas pelo UPDATE (inclui a prioridade ao entrar numa fila)"""
+        valores = {'status': self.destino}
+        if self.campo_data:
+            valores[self.campo_data] = agora
+        valores.update(campos)
+        entrada = Senha.ENTRADA_NA_FILA.get(self.destino)
+        if entrada in valores:
+            valores['prioridade'] = Senha.calcular_prioridade(tipo, valores[entrada])
+        return valores
+
+
+# Fluxo da docstring de Senha: guichê (1-4), médico (5-7) e encerramentos
+TRANSICOES = {
+    'chamar_guiche': Transicao(('aguardando_guiche',), 'chamando_guiche', 'chamado_guiche_em'),
+    'rechamar_guiche': Transicao(('chamando_guiche',), 'chamando_guiche', 'chamado_guiche_em', 'rechamada'),
+    'iniciar_triagem': Transicao(('chamando_guiche',), 'em_triagem', 'triagem_iniciada_em'),
+    'finalizar_triagem': Transicao(('em_triagem',), 'aguardando_medico', 'triagem_finalizada_em'),
+    'chamar_medico': Transicao(('aguardando_medico',), 'chamando_medico', 'chamado_medico_em'),
+    'rechamar_medico': Transicao(('chamando_medico',), 'chamando_medico', 'chamado_medico_em', 'rechamada'),
+    'iniciar_consulta': Transicao(('chamando_medico',), 'em_consulta', 'consulta_iniciada_em'),
+    'finalizar_consulta': Transicao(('em_consulta',), 'concluido', 'concluido_em'),
+    'cancelar_guiche': Transicao(ETAPA_GUICHE, 'cancelado', 'concluido_em'),
+    'desistencia_guiche': Transicao(ETAPA_GUICHE, 'desistencia', 'concluido_em'),
+    'desistencia_medico': Transicao(EM_ATENDIMENTO_MEDICO, 'desistencia', 'concluido_em'),
+    'cancelar': Transicao(NAO_FINALIZADOS, 'cancelado', 'concluido_em'),
+    'desistencia': Transicao(NAO_FINALIZADOS, 'desistencia', 'concluido_em'),
+    # Operações em lote
+    'encerrar_chamada': Transicao(('chamando_guiche', 'chamando_medico'), 'desistencia', 'concluido_em'),
+    # Volta à fila mantendo a prioridade original (o horário de entrada não muda)
+    'devolver_guiche': Transicao(EM_ATENDIMENTO_GUICHE, 'aguardando_guiche'),
+    'devolver_medico': Transicao(EM_ATENDIMENTO_MEDICO, 'aguardando_medico'),
+}
+
+
+class TransicaoInvalida(Exception):
+    """A senha não está em nenhum dos status de origem da transição"""
+
+    def __init__(self, nome, senha):
+        self.nome = nome
+        self.senha = senha
+        super().__init__(f'Transição {nome} inválida para a senha {senha.numero} ({senha.status})')
+
+
+def transicionar(senha, nome, **campos):
+    """
+    Aplica a transição `nome` à senha (instância ou id) e retorna a instância
+    atualizada. `campos` são gravados no mesmo UPDATE (ex.: guiche=...). Com
+    um id, a senha é carregada antes (SELECT + UPDATE); com a instância já
+    carregada pelo chamador, só o UPDATE.
+
+    Levanta TransicaoInvalida se o status atual não permite a transição e
+    Senha.DoesNotExist se a senha não existe.
+    """
+    transicao = TRANSICOES[nome]
+    if not isinstance(senha, Senha):
+        senha = _carregar(senha)
+
+    finaliza = transicao.destino in STATUS_FINAIS
+    while True:
+        if senha.status not in transicao.origens:
+            raise TransicaoInvalida(nome, senha)
+        valores = transicao.valores(senha.tipo, campos, timezone.now())
+        # Só a finalização grava mais de uma tabela (o resumo diário)
+        with transacao_de_escrita() if finaliza else nullcontext():
+            if Senha.objects.filter(id=senha.id, status=senha.status).update(**valores):
+                status_anterior = senha.status
+                for campo, valor in valores.items():
+                    setattr(senha, campo, valor)
+                # Mesma regra do post_save (signals.py): a senha conta uma vez só
+                if finaliza and status_anterior not in STATUS_FINAIS:
+                    registrar_finalizacao([senha])
+                break
+        # Outra requisição mudou a senha; reavalia com o estado atual
+        senha = _carregar(senha.id)
+
+    senha._estado_carregado = senha.estado_rastreado()
+    publicar_apos_commit(evento_da_senha(senha, status_anterior, transicao.evento))
+    return senha
+
+
+def _carregar(senha_id):
+    return Senha.objects.select_related('especialidade', 'guiche', 'profissional').get(id=senha_id)
+
+
+def transicionar_em_lote(senhas, nome, **campos):
+    """
+    Aplica a transição `nome` a todas as `senhas` (queryset) que estiverem num
+    status de origem, com um único UPDATE numa transação, e publica um evento
+    'lote' com as senhas afetadas. Retorna quantas senhas mudaram.
+    """
+    transicao = TRANSICOES[nome]
+    senhas = senhas.filter(status__in=transicao.origens).order_by()
+
+    with transacao_de_escrita():
+        afetadas = senhas.values_list('id', 'status', 'especialidade_id')
+        if connection.features.has_select_for_update:
+            afetadas = afetadas.select_for_update()
+        afetadas = list(afetadas)
+        if not afetadas:
+            return 0
+
+        ids = [id for id, _, _ in afetadas]
+        total = Senha.objects.filter(id__in=ids, status__in=transicao.origens).update(
+            **transicao.valores(None, campos, timezone.now())
+        )
+        if transicao.destino in STATUS_FINAIS:
+            registrar_finalizacao(
+                Senha.objects.filter(id__in=ids, status=transicao.destino).order_by().values(*CAMPOS_RESUMO)
+            )
+        publicar_apos_commit({
+            'evento': 'lote',
+            'transicao': nome,
+            'ids': ids,
+            'status': transicao.destino,
+            'status_anteriores': sorted({status for _, status, _ in afetadas}),
+            'especialidades': sorted({especialidade for _, _, especialidade in afetadas}),
+            'contagem': [
+                [status, especialidade, n]
+                for (status, especialidade), n in Counter((s, e) for _, s, e in afetadas).items()
+            ],
+        })
+    return total
+
+
+# Operações em lote
+
+# Motivo de cancelar_aguardando -> transição aplicada
+MOTIVOS_CANCELAMENTO = {
+    'cancelado': 'cancelar',
+    'desistencia': 'desistencia',
+}
+
+
+def cancelar_aguardando(especialidade_id, motivo='cancelado'):
+    """Cancela (ou marca desistência de) todas as senhas em espera da especialidade"""
+    if motivo not in MOTIVOS_CANCELAMENTO:
+        raise ValueError(f'Motivo desconhecido: {motivo}')
+    senhas = Senha.objects.filter(especialidade_id=especialidade_id, status__in=list(Senha.ENTRADA_NA_FILA))
+    return transicionar_em_lote(senhas, MOTIVOS_CANCELAMENTO[motivo])
+
+
+def encerrar_chamadas_antigas(minutos):
+    """Marca como desistência as senhas chamadas há mais de `minutos` sem comparecer"""
+    limite = timezone.now() - timedelta(minutes=minutos)
+    senhas = Senha.objects.filter(
+        Q(status='chamando_guiche', chamado_guiche_em__lt=limite)
+        | Q(status='chamando_medico', chamado_medico_em__lt=limite)
+    )
+    return transicionar_em_lote(senhas, 'encerrar_chamada')
+
+
+def redistribuir_guiche(guiche):
+    """Devolve à fila as senhas em atendimento no guichê, para outros guichês chamarem"""
+    return transicionar_em_lote(
+        Senha.objects.filter(guiche=guiche), 'devolver_guiche',
+        guiche=None, chamado_guiche_em=None, triagem_iniciada_em=None,
+    )
+
+
+def redistribuir_medico(profissional):
+    """Devolve à fila da especialidade os pacientes em atendimento com o médico"""
+    return transicionar_em_lote(
+        Senha.objects.filter(profissional=profissional), 'devolver_medico',
+        profissional=None, chamado_medico_em=None, consulta_iniciada_em=None,
+    )
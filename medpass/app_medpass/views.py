@@ -1,9 +1,43 @@
+import asyncio
+import json
+import math
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse
-from django.utils import timezone
-from django.db import models
-from .models import Especialidade, Profissional, Senha, Guiche
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from .banco import banco_ocupado
+from .consultas import orcamento
+from .condicional import TODAS, aetag_fila, filas_afetadas
+from .estatisticas import acalcular_estatisticas, agrupamentos_do_parametro, dados_da_api
+from .estimativas import aminutos_de_espera, minutos_de_espera
+from .eventos import obter_barramento
+from .filas import FilaSenhas, MesaOcupada, chamar_proxima_guiche, chamar_proxima_medico
+from .metricas import CONTENT_TYPE as CONTENT_TYPE_METRICAS, exposicao
+from .transicoes import TransicaoInvalida, transicionar
+from .roteamento import somente_leitura
+from .painel import adados_painel, aobter_quadro, obter_quadro
+from .models import Especialidade, Profissional, Senha, Guiche, filtro_do_dia
+
+
+def _erro_interno(erro):
+    """500 com a mensagem do erro; lock no banco sobe para o BancoOcupadoMiddleware (503)"""
+    if banco_ocupado(erro):
+        raise erro
+    return JsonResponse({'error': str(erro)}, status=500)
+
+
+def _resposta_da_acao(request, dados, fragmentos):
+    """
+    JSON da ação; se o painel pediu (fragmentos=1), leva também os trechos
+    redesenhados, montados por `fragmentos()`, em vez de o painel recarregar.
+    """
+    if request.POST.get('fragmentos') == '1':
+        dados.update(fragmentos())
+    return JsonResponse(dados)
 
 
 # ============================================
@@ -15,75 +49,62 @@ def home(request):
     return render(request, 'home/home.html')
 
 
-def painel_senhas(request):
-    """Painel público de visualização de senhas"""
-    hoje = timezone.now().date()
-    
-    # Senha atualmente sendo chamada
-    senha_chamando_guiche = Senha.objects.filter(
-        status='chamando_guiche'
-    ).select_related('especialidade', 'guiche').order_by('-chamado_guiche_em').first()
-    
-    senha_chamando_medico = Senha.objects.filter(
-        status='chamando_medico'
-    ).select_related('especialidade', 'profissional').order_by('-chamado_medico_em').first()
-    
-    # Últimas 10 senhas chamadas (guichê ou médico)
-    ultimas_chamadas = Senha.objects.filter(
-        status__in=['chamando_guiche', 'chamando_medico', 'em_triagem', 'em_consulta', 'concluido']
-    ).select_related('especialidade', 'guiche', 'profissional').order_by(
-        '-chamado_guiche_em', '-chamado_medico_em', '-concluido_em'
-    )[:10]
-    
-    # Senhas aguardando
-    senhas_aguardando_guiche = Senha.objects.filter(
-        status='aguardando_guiche'
-    ).select_related('especialidade').order_by('criado_em')[:10]
-    
-    senhas_aguardando_medico = Senha.objects.filter(
-        status='aguardando_medico'
-    ).select_related('especialidade').order_by('triagem_finalizada_em')[:10]
-    
-    # Estatísticas
-    total_hoje = Senha.objects.filter(criado_em__date=hoje).count()
-    total_atendidas = Senha.objects.filter(criado_em__date=hoje, status='concluido').count()
-    total_aguardando_guiche = Senha.objects.filter(status='aguardando_guiche').count()
-    total_aguardando_medico = Senha.objects.filter(status='aguardando_medico').count()
+@somente_leitura(versionada=True)
+async def painel_senhas(request):
+    """Painel público de visualização de senhas (servido pelo quadro pré-calculado)"""
+    async def montar(quadro):
+        contadores = await quadro.acontadores()
+        context = {
+            # Senhas atualmente sendo chamadas
+            'senha_chamando_guiche': await quadro.achamada_guiche(),
+            'senha_chamando_medico': await quadro.achamada_medico(),
+            # Últimas 10 senhas chamadas (guichê ou médico)
+            'ultimas_chamadas': await quadro.aultimas_chamadas(
+                ['chamando_guiche', 'chamando_medico', 'em_triagem', 'em_consulta', 'concluido'], 10
+            ),
+            # Senhas aguardando
+            'senhas_aguardando_guiche': (await quadro.aaguardando_guiche())[:10],
+            'senhas_aguardando_medico': (await quadro.aaguardando_medico())[:10],
+            # Estatísticas
+            'total_hoje': contadores['total_hoje'],
+            'total_atendidas': contadores['atendidas_emitidas_hoje'],
+            'total_aguardando_guiche': contadores['aguardando_guiche'],
+            'total_aguardando_medico': contadores['aguardando_medico'],
+            # Espera recente (p50, em minutos), calculada em memória
+            'espera_guiche': await aminutos_de_espera('guiche'),
+            'espera_medico': await aminutos_de_espera('medico'),
+            # Ponto de partida do long-poll (api_senha_chamando_aguardar)
+            'versao_eventos': f'{quadro.origem}-{quadro.versao}',
+        }
+        # Tudo já carregado (select_related): a renderização não consulta o banco
+        return render(request, 'painel_senhas/painel_senhas.html', context)
     
-    context = {
-        'senha_chamando_guiche': senha_chamando_guiche,
-        'senha_chamando_medico': senha_chamando_medico,
-        'ultimas_chamadas': ultimas_chamadas,
-        'senhas_aguardando_guiche': senhas_aguardando_guiche,
-        'senhas_aguardando_medico': senhas_aguardando_medico,
-        'total_hoje': total_hoje,
-        'total_atendidas': total_atendidas,
-        'total_aguardando_guiche': total_aguardando_guiche,
-        'total_aguardando_medico': total_aguardando_medico,
-    }
-    return render(request, 'painel_senhas/painel_senhas.html', context)
+    return await _responder_pelo_quadro(request, montar)
 
 
 # ============================================
 # CENTRAL DE SENHAS (Recepção)
 # ============================================
 
+@orcamento(4)
 def central_senhas(request):
     """View para exibir a central de senhas (recepção)"""
     especialidades = Especialidade.objects.filter(ativa=True).order_by('nome')
     
-    hoje = timezone.now().date()
-    senhas_hoje = Senha.objects.filter(criado_em__date=hoje).select_related('especialidade').order_by('-criado_em')[:20]
+    senhas_hoje = Senha.objects.filter(filtro_do_dia('criado_em')).select_related('especialidade').order_by('-criado_em')[:20]
+    
+    contadores = obter_quadro().contadores()
     
     context = {
         'especialidades': especialidades,
         'senhas_hoje': senhas_hoje,
-        'total_aguardando_guiche': Senha.objects.filter(status='aguardando_guiche').count(),
-        'total_aguardando_medico': Senha.objects.filter(status='aguardando_medico').count(),
+        'total_aguardando_guiche': contadores['aguardando_guiche'],
+        'total_aguardando_medico': contadores['aguardando_medico'],
     }
     return render(request, 'central_senhas/central_senhas.html', context)
 
 
+@orcamento(14)
 def gerar_senha(request):
     """View para gerar uma nova senha"""
     if request.method == 'POST':
@@ -108,13 +129,20 @@ def gerar_senha(request):
                 status='aguardando_guiche'
             )
             
-            messages.success(request, f'Senha {numero} gerada com sucesso!')
+            mensagem = f'Senha {numero} gerada com sucesso!'
+            espera = minutos_de_espera('guiche')
+            if espera is not None:
+                mensagem += f' Espera estimada: cerca de {espera} min.'
+            messages.success(request, mensagem)
             return redirect('central_senhas')
             
         except Especialidade.DoesNotExist:
             messages.error(request, 'Especialidade não encontrada.')
         except Exception as e:
-            messages.error(request, f'Erro ao gerar senha: {str(e)}')
+            if banco_ocupado(e):
+                messages.error(request, 'Sistema ocupado no momento. Tente novamente.')
+            else:
+                messages.error(request, f'Erro ao gerar senha: {str(e)}')
     
     return redirect('central_senhas')
 
@@ -135,6 +163,7 @@ def selecionar_medico(request):
     return render(request, 'medico/selecionar_medico.html', {'medicos': medicos})
 
 
+@orcamento(4)
 def painel_guiche(request):
     """Painel do guichê"""
     guiche_id = request.GET.get('guiche')
@@ -150,34 +179,57 @@ def painel_guiche(request):
     # Lista de guichês disponíveis
     guiches = Guiche.objects.filter(ativo=True).order_by('numero')
     
-    # Senhas aguardando (priorizando urgência e preferencial)
-    senhas_aguardando = Senha.objects.filter(
-        status='aguardando_guiche'
-    ).select_related('especialidade').order_by(
-        models.Case(
-            models.When(tipo='U', then=0),
-            models.When(tipo='P', then=1),
-            models.When(tipo='N', then=2),
-        ),
-        'criado_em'
-    )
+    # Senhas aguardando (priorizando urgência e preferencial, ver filas.py).
+    # Lidas uma vez: o template e o total usam a mesma lista
+    senhas_aguardando = list(FilaSenhas('guiche').senhas().select_related('especialidade'))
     
     # Senha que este guichê está atendendo
-    senha_atual = Senha.objects.filter(
-        guiche=guiche,
-        status__in=['chamando_guiche', 'em_triagem']
-    ).select_related('especialidade').first()
+    senha_atual = _senha_atual_guiche(guiche.id)
     
     context = {
         'guiche': guiche,
         'guiches': guiches,
         'senhas_aguardando': senhas_aguardando,
         'senha_atual': senha_atual,
-        'total_aguardando': senhas_aguardando.count(),
+        'total_aguardando': len(senhas_aguardando),
     }
     return render(request, 'guiche/painel_guiche.html', context)
 
 
+def _senha_atual_guiche(guiche_id):
+    return Senha.objects.filter(
+        guiche_id=guiche_id,
+        status__in=['chamando_guiche', 'em_triagem']
+    ).select_related('especialidade').first()
+
+
+def _fragmentos_guiche(request, senha_atual, fila=True):
+    """
+    Trechos do painel do guichê ([data-fragmento] do template): o atendimento
+    atual e, com `fila`, a fila de espera e o total. Sem senha em atendimento a
+    fila sempre vai junto, pois o botão "Chamar Próxima" depende dela.
+    """
+    contexto = {'senha_atual': senha_atual}
+    dados = {'fragmentos': {}, 'contadores': {}}
+    if fila or senha_atual is None:
+        senhas_aguardando = list(FilaSenhas('guiche').senhas().select_related('especialidade'))
+        contexto['senhas_aguardando'] = senhas_aguardando
+        dados['fragmentos']['fila'] = render_to_string('guiche/_fila.html', contexto, request)
+        dados['contadores']['total_aguardando'] = len(senhas_aguardando)
+    dados['fragmentos']['atendimento'] = render_to_string('guiche/_atendimento.html', contexto, request)
+    return dados
+
+
+@somente_leitura(versionada=True)
+@orcamento(2)
+def guiche_fragmentos(request):
+    """Atendimento e fila do painel do guichê, para atualizar sem recarregar a página"""
+    guiche_id = request.GET.get('guiche', '')
+    if not guiche_id.isdigit():
+        return JsonResponse({'error': 'Guichê não informado'}, status=400)
+    return JsonResponse(_fragmentos_guiche(request, _senha_atual_guiche(guiche_id)))
+
+
 def guiche_chamar_senha(request, senha_id):
     """Guichê chama uma senha"""
     guiche_id = request.POST.get('guiche_id') or request.GET.get('guiche')
@@ -199,37 +251,55 @@ def guiche_chamar_senha(request, senha_id):
         return JsonResponse({'error': 'Você já está atendendo uma senha.'}, status=400)
     
     try:
-        senha = get_object_or_404(Senha, id=senha_id)
-        
-        if senha.status != 'aguardando_guiche':
-            return JsonResponse({'error': 'Esta senha não está disponível.'}, status=400)
+        senha = get_object_or_404(Senha.objects.select_related('especialidade'), id=senha_id)
+        senha = transicionar(senha, 'chamar_guiche', guiche=guiche)
         
-        senha.status = 'chamando_guiche'
-        senha.guiche = guiche
-        senha.chamado_guiche_em = timezone.now()
-        senha.save()
-        
-        return JsonResponse({
+        return _resposta_da_acao(request, {
             'success': True, 
             'numero': senha.numero,
             'message': f'Senha {senha.numero} chamada!'
-        })
+        }, lambda: _fragmentos_guiche(request, senha))
         
+    except TransicaoInvalida:
+        return JsonResponse({'error': 'Esta senha não está disponível.'}, status=400)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        return _erro_interno(e)
+
+
+@orcamento(8)
+def guiche_chamar_proxima(request):
+    """Guichê chama a próxima senha da fila (reserva atômica, sem colisão entre guichês)"""
+    guiche_id = request.POST.get('guiche_id') or request.GET.get('guiche')
+    
+    if not guiche_id:
+        return JsonResponse({'error': 'Guichê não informado'}, status=400)
+    if not guiche_id.isdigit():
+        return JsonResponse({'error': 'Guichê inválido'}, status=400)
+    
+    guiche = Guiche.objects.filter(id=guiche_id).first()
+    if not guiche:
+        return JsonResponse({'error': 'Guichê não encontrado'}, status=404)
+    
+    try:
+        senha = chamar_proxima_guiche(guiche)
+    except MesaOcupada:
+        return JsonResponse({'error': 'Você já está atendendo uma senha.'}, status=400)
+    if senha is None:
+        return JsonResponse({'error': 'Nenhuma senha aguardando.'}, status=404)
+    
+    return _resposta_da_acao(request, {
+        'success': True,
+        'id': senha.id,
+        'numero': senha.numero,
+        'message': f'Senha {senha.numero} chamada!'
+    }, lambda: _fragmentos_guiche(request, senha))
 
 
 def guiche_rechamar_senha(request, senha_id):
     """Guichê rechama uma senha (atualiza o timestamp para o painel público falar novamente)"""
     try:
-        senha = get_object_or_404(Senha, id=senha_id)
-        
-        if senha.status != 'chamando_guiche':
-            return JsonResponse({'error': 'Esta senha não está sendo chamada.'}, status=400)
-        
         # Atualiza o timestamp para o painel público detectar como nova chamada
-        senha.chamado_guiche_em = timezone.now()
-        senha.save()
+        senha = transicionar(get_object_or_404(Senha, id=senha_id), 'rechamar_guiche')
         
         return JsonResponse({
             'success': True, 
@@ -237,79 +307,70 @@ def guiche_rechamar_senha(request, senha_id):
             'message': f'Senha {senha.numero} rechamada!'
         })
         
+    except TransicaoInvalida:
+        return JsonResponse({'error': 'Esta senha não está sendo chamada.'}, status=400)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        return _erro_interno(e)
 
 
 def guiche_iniciar_triagem(request, senha_id):
     """Guichê inicia a triagem"""
-    guiche_id = request.POST.get('guiche_id') or request.GET.get('guiche')
-    guiche = Guiche.objects.filter(id=guiche_id).first()
-    
     try:
-        senha = get_object_or_404(Senha, id=senha_id)
+        senha = get_object_or_404(Senha.objects.select_related('especialidade'), id=senha_id)
+        senha = transicionar(senha, 'iniciar_triagem')
         
-        if senha.status != 'chamando_guiche':
-            return JsonResponse({'error': 'Esta senha não está sendo chamada.'}, status=400)
-        
-        senha.status = 'em_triagem'
-        senha.triagem_iniciada_em = timezone.now()
-        senha.save()
-        
-        return JsonResponse({'success': True, 'message': 'Triagem iniciada!'})
+        # A fila não muda: a senha continua com este guichê
+        return _resposta_da_acao(request, {'success': True, 'message': 'Triagem iniciada!'},
+                                 lambda: _fragmentos_guiche(request, senha, fila=False))
         
+    except TransicaoInvalida:
+        return JsonResponse({'error': 'Esta senha não está sendo chamada.'}, status=400)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        return _erro_interno(e)
 
 
 def guiche_finalizar_triagem(request, senha_id):
     """Guichê finaliza a triagem"""
     try:
-        senha = get_object_or_404(Senha, id=senha_id)
-        
-        if senha.status != 'em_triagem':
-            return JsonResponse({'error': 'Esta senha não está em triagem.'}, status=400)
-        
+        dados = {}
         if request.method == 'POST':
-            senha.nome_paciente = request.POST.get('nome_paciente', '')
-            senha.observacoes_triagem = request.POST.get('observacoes', '')
+            dados['nome_paciente'] = request.POST.get('nome_paciente', '')
+            dados['observacoes_triagem'] = request.POST.get('observacoes', '')
         
-        senha.status = 'aguardando_medico'
-        senha.triagem_finalizada_em = timezone.now()
-        senha.save()
+        transicionar(get_object_or_404(Senha, id=senha_id), 'finalizar_triagem', **dados)
         
-        return JsonResponse({
+        return _resposta_da_acao(request, {
             'success': True,
             'message': 'Triagem concluída! Paciente aguardando médico.'
-        })
+        }, lambda: _fragmentos_guiche(request, None))
         
+    except TransicaoInvalida:
+        return JsonResponse({'error': 'Esta senha não está em triagem.'}, status=400)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        return _erro_interno(e)
 
 
 def guiche_cancelar_senha(request, senha_id):
     """Guichê cancela uma senha"""
     try:
-        senha = get_object_or_404(Senha, id=senha_id)
-        
-        if senha.status not in ['aguardando_guiche', 'chamando_guiche', 'em_triagem']:
-            return JsonResponse({'error': 'Esta senha não pode ser cancelada.'}, status=400)
-        
         motivo = request.POST.get('motivo', 'desistencia')
-        senha.status = 'desistencia' if motivo == 'desistencia' else 'cancelado'
-        senha.concluido_em = timezone.now()
-        senha.save()
+        transicao = 'desistencia_guiche' if motivo == 'desistencia' else 'cancelar_guiche'
+        transicionar(get_object_or_404(Senha, id=senha_id), transicao)
         
-        return JsonResponse({'success': True, 'message': 'Senha cancelada.'})
+        return _resposta_da_acao(request, {'success': True, 'message': 'Senha cancelada.'},
+                                 lambda: _fragmentos_guiche(request, None))
         
+    except TransicaoInvalida:
+        return JsonResponse({'error': 'Esta senha não pode ser cancelada.'}, status=400)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        return _erro_interno(e)
 
 
 # ============================================
 # PAINEL DO MÉDICO
 # ============================================
 
+@orcamento(6)
 def painel_medico(request):
     """Painel do médico"""
     medico_id = request.GET.get('medico')
@@ -326,43 +387,76 @@ def painel_medico(request):
     medicos = Profissional.objects.filter(ativo=True).select_related('especialidade').order_by('nome')
     
     # Senhas aguardando médico da especialidade do médico
-    senhas_aguardando = Senha.objects.filter(
-        status='aguardando_medico',
-        especialidade=medico.especialidade
-    ).select_related('especialidade', 'guiche').order_by(
-        models.Case(
-            models.When(tipo='U', then=0),
-            models.When(tipo='P', then=1),
-            models.When(tipo='N', then=2),
-        ),
-        'triagem_finalizada_em'
-    )
+    senhas_aguardando = list(FilaSenhas('medico', medico.especialidade_id).senhas().select_related(
+        'especialidade', 'guiche'
+    ))
     
     # Senha que este médico está atendendo
-    senha_atual = Senha.objects.filter(
-        profissional=medico,
-        status__in=['chamando_medico', 'em_consulta']
-    ).select_related('especialidade', 'guiche').first()
+    senha_atual = _senha_atual_medico(medico.id)
     
     # Estatísticas
-    hoje = timezone.now().date()
-    atendidas_hoje = Senha.objects.filter(
-        profissional=medico,
-        status='concluido',
-        concluido_em__date=hoje
-    ).count()
+    atendidas_hoje = _atendidas_hoje(medico.id)
     
     context = {
         'medico': medico,
         'medicos': medicos,
         'senhas_aguardando': senhas_aguardando,
         'senha_atual': senha_atual,
-        'total_aguardando': senhas_aguardando.count(),
+        'total_aguardando': len(senhas_aguardando),
         'atendidas_hoje': atendidas_hoje,
     }
     return render(request, 'medico/painel_medico.html', context)
 
 
+def _senha_atual_medico(medico_id):
+    return Senha.objects.filter(
+        profissional_id=medico_id,
+        status__in=['chamando_medico', 'em_consulta']
+    ).select_related('especialidade', 'guiche').first()
+
+
+def _atendidas_hoje(medico_id):
+    return Senha.objects.filter(
+        filtro_do_dia('concluido_em'),
+        profissional_id=medico_id,
+        status='concluido'
+    ).count()
+
+
+def _fragmentos_medico(request, especialidade_id, senha_atual, fila=True, medico_id=None):
+    """
+    Trechos do painel do médico: o atendimento atual, a fila da especialidade
+    e o total (com `fila`, ou sem senha em atendimento, como no guichê) e, com
+    `medico_id`, o contador de atendidos hoje.
+    """
+    contexto = {'senha_atual': senha_atual}
+    dados = {'fragmentos': {}, 'contadores': {}}
+    if fila or senha_atual is None:
+        senhas_aguardando = list(FilaSenhas('medico', especialidade_id).senhas())
+        contexto['senhas_aguardando'] = senhas_aguardando
+        dados['fragmentos']['fila'] = render_to_string('medico/_fila.html', contexto, request)
+        dados['contadores']['total_aguardando'] = len(senhas_aguardando)
+    dados['fragmentos']['atendimento'] = render_to_string('medico/_atendimento.html', contexto, request)
+    if medico_id:
+        dados['contadores']['atendidas_hoje'] = _atendidas_hoje(medico_id)
+    return dados
+
+
+@somente_leitura(versionada=True)
+@orcamento(4)
+def medico_fragmentos(request):
+    """Atendimento, fila e contadores do painel do médico, para atualizar sem recarregar a página"""
+    medico_id = request.GET.get('medico', '')
+    if not medico_id.isdigit():
+        return JsonResponse({'error': 'Médico não informado'}, status=400)
+    medico = Profissional.objects.filter(id=medico_id, ativo=True).first()
+    if not medico:
+        return JsonResponse({'error': 'Médico não encontrado'}, status=404)
+    return JsonResponse(_fragmentos_medico(
+        request, medico.especialidade_id, _senha_atual_medico(medico.id), medico_id=medico.id
+    ))
+
+
 def medico_chamar_senha(request, senha_id):
     """Médico chama uma senha"""
     medico_id = request.POST.get('medico_id') or request.GET.get('medico')
@@ -389,71 +483,87 @@ def medico_chamar_senha(request, senha_id):
         if senha.status != 'aguardando_medico':
             return JsonResponse({'error': 'Este paciente não está disponível.'}, status=400)
         
-        if senha.especialidade != medico.especialidade:
+        if senha.especialidade_id != medico.especialidade_id:
             return JsonResponse({'error': 'Este paciente não é da sua especialidade.'}, status=400)
         
-        senha.status = 'chamando_medico'
-        senha.profissional = medico
-        senha.chamado_medico_em = timezone.now()
-        senha.save()
+        senha = transicionar(senha, 'chamar_medico', profissional=medico)
         
-        return JsonResponse({
+        return _resposta_da_acao(request, {
             'success': True, 
             'numero': senha.numero,
             'paciente': senha.nome_paciente or 'Não informado',
             'message': f'Paciente {senha.numero} chamado!'
-        })
+        }, lambda: _fragmentos_medico(request, senha.especialidade_id, senha))
         
+    except TransicaoInvalida:
+        return JsonResponse({'error': 'Este paciente não está disponível.'}, status=400)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        return _erro_interno(e)
+
+
+@orcamento(8)
+def medico_chamar_proxima(request):
+    """Médico chama o próximo paciente da fila (reserva atômica, sem colisão entre médicos)"""
+    medico_id = request.POST.get('medico_id') or request.GET.get('medico')
+    
+    if not medico_id:
+        return JsonResponse({'error': 'Médico não informado'}, status=400)
+    if not medico_id.isdigit():
+        return JsonResponse({'error': 'Médico inválido'}, status=400)
+    
+    medico = Profissional.objects.filter(id=medico_id).first()
+    if not medico:
+        return JsonResponse({'error': 'Médico não encontrado'}, status=404)
+    
+    try:
+        senha = chamar_proxima_medico(medico)
+    except MesaOcupada:
+        return JsonResponse({'error': 'Você já está atendendo um paciente.'}, status=400)
+    if senha is None:
+        return JsonResponse({'error': 'Nenhum paciente aguardando.'}, status=404)
+    
+    return _resposta_da_acao(request, {
+        'success': True,
+        'id': senha.id,
+        'numero': senha.numero,
+        'paciente': senha.nome_paciente or 'Não informado',
+        'message': f'Paciente {senha.numero} chamado!'
+    }, lambda: _fragmentos_medico(request, senha.especialidade_id, senha))
 
 
 def medico_iniciar_consulta(request, senha_id):
     """Médico inicia a consulta"""
     try:
-        senha = get_object_or_404(Senha, id=senha_id)
-        
-        if senha.status != 'chamando_medico':
-            return JsonResponse({'error': 'Este paciente não está sendo chamado.'}, status=400)
+        senha = transicionar(get_object_or_404(Senha, id=senha_id), 'iniciar_consulta')
         
-        senha.status = 'em_consulta'
-        senha.consulta_iniciada_em = timezone.now()
-        senha.save()
-        
-        return JsonResponse({'success': True, 'message': 'Consulta iniciada!'})
+        return _resposta_da_acao(request, {'success': True, 'message': 'Consulta iniciada!'},
+                                 lambda: _fragmentos_medico(request, senha.especialidade_id, senha, fila=False))
         
+    except TransicaoInvalida:
+        return JsonResponse({'error': 'Este paciente não está sendo chamado.'}, status=400)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        return _erro_interno(e)
 
 
 def medico_finalizar_consulta(request, senha_id):
     """Médico finaliza a consulta"""
     try:
-        senha = get_object_or_404(Senha, id=senha_id)
-        
-        if senha.status != 'em_consulta':
-            return JsonResponse({'error': 'Este paciente não está em consulta.'}, status=400)
+        senha = transicionar(get_object_or_404(Senha, id=senha_id), 'finalizar_consulta')
         
-        senha.status = 'concluido'
-        senha.concluido_em = timezone.now()
-        senha.save()
-        
-        return JsonResponse({'success': True, 'message': 'Consulta finalizada!'})
+        return _resposta_da_acao(request, {'success': True, 'message': 'Consulta finalizada!'}, lambda: _fragmentos_medico(
+            request, senha.especialidade_id, None, medico_id=senha.profissional_id
+        ))
         
+    except TransicaoInvalida:
+        return JsonResponse({'error': 'Este paciente não está em consulta.'}, status=400)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        return _erro_interno(e)
 
 
 def medico_rechamar_senha(request, senha_id):
     """Médico rechama o paciente"""
     try:
-        senha = get_object_or_404(Senha, id=senha_id)
-        
-        if senha.status != 'chamando_medico':
-            return JsonResponse({'error': 'Só é possível rechamar senhas sendo chamadas.'}, status=400)
-        
-        senha.chamado_medico_em = timezone.now()
-        senha.save()
+        senha = transicionar(get_object_or_404(Senha, id=senha_id), 'rechamar_medico')
         
         return JsonResponse({
             'success': True, 
@@ -461,26 +571,24 @@ def medico_rechamar_senha(request, senha_id):
             'message': f'Paciente {senha.numero} rechamado!'
         })
         
+    except TransicaoInvalida:
+        return JsonResponse({'error': 'Só é possível rechamar senhas sendo chamadas.'}, status=400)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        return _erro_interno(e)
 
 
 def medico_desistencia_senha(request, senha_id):
     """Médico marca desistência"""
     try:
-        senha = get_object_or_404(Senha, id=senha_id)
-        
-        if senha.status not in ['chamando_medico', 'em_consulta']:
-            return JsonResponse({'error': 'Esta senha não pode ser marcada como desistência.'}, status=400)
+        senha = transicionar(get_object_or_404(Senha, id=senha_id), 'desistencia_medico')
         
-        senha.status = 'desistencia'
-        senha.concluido_em = timezone.now()
-        senha.save()
-        
-        return JsonResponse({'success': True, 'message': 'Paciente marcado como desistência.'})
+        return _resposta_da_acao(request, {'success': True, 'message': 'Paciente marcado como desistência.'},
+                                 lambda: _fragmentos_medico(request, senha.especialidade_id, None))
         
+    except TransicaoInvalida:
+        return JsonResponse({'error': 'Esta senha não pode ser marcada como desistência.'}, status=400)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        return _erro_interno(e)
 
 
 # ============================================
@@ -617,42 +725,53 @@ def deletar_guiche(request, id):
 # APIs
 # ============================================
 
-def api_senhas_aguardando(request):
+async def _responder_pelo_quadro(request, montar):
+    """
+    Equivalente assíncrono de @condition(etag_func=etag_quadro): se o cliente
+    já tem a versão atual do quadro, responde 304 sem sair do event loop;
+    senão monta a resposta com `montar(quadro)` (corrotina) e a marca com o ETag.
+    """
+    quadro = await aobter_quadro()
+    response = get_conditional_response(request, etag=quadro.etag)
+    if response is None:
+        response = await montar(quadro)
+        response.headers['ETag'] = quadro.etag
+    return response
+
+
+@somente_leitura(versionada=True)
+async def api_senhas_aguardando(request):
     """API para obter senhas aguardando"""
-    tipo = request.GET.get('tipo', 'guiche')
-    especialidade_id = request.GET.get('especialidade')
-    
-    if tipo == 'guiche':
-        senhas = Senha.objects.filter(status='aguardando_guiche')
-    else:
-        senhas = Senha.objects.filter(status='aguardando_medico')
-        if especialidade_id:
-            senhas = senhas.filter(especialidade_id=especialidade_id)
-    
-    senhas = senhas.select_related('especialidade').order_by('criado_em')[:20]
-    
-    data = [{
-        'id': s.id,
-        'numero': s.numero,
-        'tipo': s.get_tipo_display(),
-        'especialidade': s.especialidade.nome,
-        'criado_em': s.criado_em.strftime('%H:%M'),
-        'nome_paciente': s.nome_paciente or '',
-    } for s in senhas]
+    # A chave da seção do quadro sai destes valores: nada do cliente vai sem validar
+    tipo = 'guiche' if request.GET.get('tipo', 'guiche') == 'guiche' else 'medico'
+    especialidade_id = request.GET.get('especialidade') or None
+    if especialidade_id is not None and not especialidade_id.isdigit():
+        return JsonResponse({'error': 'Especialidade inválida'}, status=400)
+    especialidade_id = int(especialidade_id) if tipo == 'medico' and especialidade_id else None
+    
+    async def montar(quadro):
+        if tipo == 'guiche':
+            senhas = await quadro.aaguardando_guiche()
+        else:
+            senhas = await quadro.aaguardando_medico(especialidade_id, ordem='criado_em')
+        
+        def calcular():
+            return [{
+                'id': s.id,
+                'numero': s.numero,
+                'tipo': s.get_tipo_display(),
+                'especialidade': s.especialidade.nome,
+                'criado_em': s.criado_em.strftime('%H:%M'),
+                'nome_paciente': s.nome_paciente or '',
+            } for s in senhas]
+        
+        data = quadro.secao(('api_senhas_aguardando', tipo, especialidade_id), calcular)
+        return JsonResponse({'senhas': data})
     
-    return JsonResponse({'senhas': data})
+    return await _responder_pelo_quadro(request, montar)
 
 
-def api_senha_chamando(request):
-    """API para obter a senha sendo chamada"""
-    senha_guiche = Senha.objects.filter(
-        status='chamando_guiche'
-    ).select_related('guiche').order_by('-chamado_guiche_em').first()
-    
-    senha_medico = Senha.objects.filter(
-        status='chamando_medico'
-    ).select_related('profissional').order_by('-chamado_medico_em').first()
-    
+def _dados_senha_chamando(senha_guiche, senha_medico):
     data = {'guiche': None, 'medico': None}
     
     if senha_guiche:
@@ -669,5 +788,194 @@ def api_senha_chamando(request):
             'medico': senha_medico.profissional.nome if senha_medico.profissional else '',
             'chamado_em': senha_medico.chamado_medico_em.strftime('%H:%M:%S') if senha_medico.chamado_medico_em else ''
         }
+    return data
+
+
+async def _senha_chamando(quadro):
+    senha_guiche = await quadro.achamada_guiche()
+    senha_medico = await quadro.achamada_medico()
+    return quadro.secao('api_senha_chamando', lambda: _dados_senha_chamando(senha_guiche, senha_medico))
+
+
+@somente_leitura(versionada=True)
+async def api_senha_chamando(request):
+    """API para obter a senha sendo chamada"""
+    async def montar(quadro):
+        return JsonResponse(await _senha_chamando(quadro))
+    
+    return await _responder_pelo_quadro(request, montar)
+
+
+@somente_leitura(versionada=True)
+async def api_painel(request):
+    """Versão assíncrona de GET /api/senhas/painel/ (mesmo JSON)"""
+    async def montar(quadro):
+        return JsonResponse(await adados_painel(quadro))
     
-    return JsonResponse(data)
+    return await _responder_pelo_quadro(request, montar)
+
+
+@somente_leitura(versionada=True)
+async def api_estatisticas(request):
+    """Versão assíncrona de GET /api/senhas/estatisticas/ (mesmo JSON, ETag da fila 'hoje')"""
+    etag = await aetag_fila('hoje')
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        agrupar_por = agrupamentos_do_parametro(request.GET.get('agrupar_por'))
+        response = JsonResponse(dados_da_api(await acalcular_estatisticas(agrupar_por=agrupar_por)))
+        response.headers['ETag'] = etag
+    return response
+
+
+# ============================================
+# TEMPO REAL
+# ============================================
+
+# Intervalo (s) entre comentários de keepalive quando não há eventos
+INTERVALO_KEEPALIVE = 15
+
+# Tempo máximo (s) que o long-poll segura a requisição (abaixo do timeout dos proxies)
+TIMEOUT_LONG_POLL = 25
+
+# Sem ASGI o long-poll responde na hora; o cliente repete após este intervalo (ms)
+INTERVALO_POLLING_WSGI = 5000
+
+# Status que mudam a senha em chamada (resposta de api_senha_chamando)
+STATUS_CHAMANDO = ('chamando_guiche', 'chamando_medico')
+
+
+def _muda_chamada(evento):
+    if evento.get('evento') == 'lote':
+        status = [evento.get('status'), *evento.get('status_anteriores', [])]
+    else:
+        status = [evento.get('status'), evento.get('status_anterior')]
+    return evento.get('evento') == 'cadastro' or any(s in STATUS_CHAMANDO for s in status)
+
+
+@somente_leitura(versionada=True)
+async def api_senha_chamando_aguardar(request):
+    """
+    Long-poll para painéis sem SSE: espera até a próxima mudança das senhas.
+
+    O cliente envia a última `versao` recebida; a resposta sai assim que houver
+    eventos novos (opcionalmente só os que afetam a `fila` informada, ver
+    condicional.filas_afetadas) ou após `timeout` segundos (máx. 25), com:
+
+    - versao: a enviar na próxima requisição;
+    - eventos: os diffs desde a versão do cliente (vazio no timeout);
+    - chamando: os dados de api_senha_chamando, só se a chamada mudou;
+    - completo: true quando não dá para saber o que mudou (primeira requisição,
+      outro processo/reinício ou buffer esgotado) e o cliente deve recarregar.
+
+    Sem ASGI a resposta é imediata e inclui `intervalo` (ms) para a próxima.
+    """
+    barramento = obter_barramento()
+    fila = request.GET.get('fila')
+    try:
+        timeout = float(request.GET.get('timeout', TIMEOUT_LONG_POLL))
+    except ValueError:
+        timeout = math.nan
+    # nan passaria por min/max sem ser limitado
+    if not math.isfinite(timeout):
+        return JsonResponse({'error': 'timeout deve ser um número de segundos'}, status=400)
+    timeout = min(max(timeout, 0), TIMEOUT_LONG_POLL)
+    asgi = isinstance(request, ASGIRequest)
+    if not asgi:
+        timeout = 0
+    
+    # A versão é "<origem>-<id do evento>": ids de outro processo não valem aqui
+    origem, _, ultimo_id = request.GET.get('versao', '').rpartition('-')
+    eventos = None
+    if origem == barramento.origem and ultimo_id.isdigit():
+        ultimo_id = int(ultimo_id)
+        eventos = await _aguardar_eventos(barramento, ultimo_id, timeout, fila)
+    
+    if eventos is None:
+        quadro = await aobter_quadro()
+        dados = {
+            'versao': f'{barramento.origem}-{quadro.versao}',
+            'completo': True,
+            'eventos': [],
+            'chamando': await _senha_chamando(quadro),
+        }
+    else:
+        ultimo_id, eventos = eventos
+        dados = {'versao': f'{barramento.origem}-{ultimo_id}', 'completo': False, 'eventos': eventos}
+        if any(_muda_chamada(evento) for evento in eventos):
+            dados['chamando'] = await _senha_chamando(await aobter_quadro())
+    if not asgi:
+        dados['intervalo'] = INTERVALO_POLLING_WSGI
+    
+    response = JsonResponse(dados)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+async def _aguardar_eventos(barramento, ultimo_id, timeout, fila=None):
+    """
+    (último id, eventos) após `ultimo_id` que afetam a `fila` (todas, se None),
+    esperando até `timeout` segundos; None se o intervalo não está mais no buffer.
+    """
+    loop = asyncio.get_running_loop()
+    limite = loop.time() + timeout
+    while True:
+        eventos = await barramento.aguardar(ultimo_id, max(limite - loop.time(), 0))
+        if eventos is None:
+            return None
+        if eventos:
+            ultimo_id = eventos[-1][0]
+        relevantes = [
+            evento for _, evento in eventos
+            if fila is None or {fila, TODAS} & set(filas_afetadas(evento))
+        ]
+        if relevantes or loop.time() >= limite:
+            return ultimo_id, relevantes
+
+
+async def eventos_senhas(request):
+    """
+    Stream de mudanças das senhas (Server-Sent Events) para os painéis.
+
+    Exige servidor ASGI (uvicorn/daphne com medpass.asgi). No WSGI uma conexão
+    aberta prenderia um worker inteiro, então a resposta é 503 e os painéis
+    voltam ao recarregamento periódico.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Eventos em tempo real exigem servidor ASGI.'}, status=503)
+    
+    # Reconexões do EventSource retomam do último id recebido
+    ultimo_id = request.headers.get('Last-Event-ID')
+    if ultimo_id and ultimo_id.isdigit():
+        ultimo_id = int(ultimo_id)
+    else:
+        ultimo_id = await sync_to_async(obter_barramento().versao)()
+    
+    response = StreamingHttpResponse(_stream_eventos(ultimo_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def _stream_eventos(ultimo_id):
+    barramento = obter_barramento()
+    yield 'retry: 3000\n\n'
+    while True:
+        eventos = await barramento.aguardar(ultimo_id, timeout=INTERVALO_KEEPALIVE)
+        if eventos is None:
+            # Eventos perdidos (buffer esgotado ou servidor reiniciado): o painel recarrega
+            ultimo_id = await sync_to_async(barramento.versao)()
+            yield f'id: {ultimo_id}\nevent: resync\ndata: {{}}\n\n'
+        elif not eventos:
+            yield ': keepalive\n\n'
+        for evento_id, evento in eventos or []:
+            ultimo_id = evento_id
+            yield f'id: {evento_id}\nevent: senha\ndata: {json.dumps(evento)}\n\n'
+
+
+# ============================================
+# MÉTRICAS
+# ============================================
+
+def metricas(request):
+    """Métricas do processo no formato texto do Prometheus (ver metricas.py)"""
+    return HttpResponse(exposicao(), content_type=CONTENT_TYPE_METRICAS)
@@ -3,6 +3,11 @@ ASGI config for medpass project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The live panel stream (``/api/eventos/``, Server-Sent Events) only works when
+the project is served through this module, e.g.::
+
+    uvicorn medpass.asgi:application
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
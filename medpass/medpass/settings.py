@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -60,6 +61,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app_medpass.middleware.MedicaoConsultasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,6 +69,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'app_medpass.middleware.BancoOcupadoMiddleware',
+    'app_medpass.middleware.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'medpass.urls'
@@ -99,6 +103,66 @@ DATABASES = {
     }
 }
 
+# Perfis do banco, escolhidos pela variável de ambiente MEDPASS_PERFIL_BANCO.
+# 'producao' é para o SQLite com vários workers (gunicorn): em cada conexão nova
+# liga o WAL (leitores não bloqueiam o escritor), synchronous=NORMAL (seguro com
+# WAL) e um cache maior; espera até 20 s por um lock em vez de falhar; e mantém
+# as conexões abertas entre requisições. As transições abrem a transação já com
+# o lock de escrita (app_medpass/banco.py). Compare com `benchmark_concorrencia`.
+# Também troca o barramento de eventos para o 'banco' (ver MEDPASS_BARRAMENTO).
+MEDPASS_PERFIS_BANCO = {
+    'desenvolvimento': {},
+    'producao': {
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA cache_size=-20000;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA mmap_size=134217728'
+            ),
+        },
+    },
+}
+MEDPASS_PERFIL_BANCO = os.environ.get('MEDPASS_PERFIL_BANCO', 'desenvolvimento')
+DATABASES['default'].update(MEDPASS_PERFIS_BANCO[MEDPASS_PERFIL_BANCO])
+
+# Réplica de leitura para painéis e relatórios (app_medpass/roteamento.py).
+# MEDPASS_BANCO_REPLICA aponta o arquivo SQLite da réplica (mantido pelo comando
+# `atualizar_replica`); para uma réplica PostgreSQL, defina DATABASES['replica'].
+# ATRASO_MAXIMO: quantos segundos a réplica pode estar atrás do principal.
+if os.environ.get('MEDPASS_BANCO_REPLICA'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ['MEDPASS_BANCO_REPLICA'],
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['app_medpass.roteamento.RoteadorReplica']
+MEDPASS_REPLICA = {
+    'ALIAS': 'replica',
+    'ATRASO_MAXIMO': 5,
+}
+
+# Medição das consultas de cada requisição (app_medpass/consultas.py): orçamento
+# das views sem @orcamento próprio, repetições da mesma consulta que contam como
+# suspeita de N+1 (ambos só geram log) e o cabeçalho Server-Timing.
+MEDPASS_CONSULTAS = {
+    'ORCAMENTO_PADRAO': 20,
+    'REPETICOES_SUSPEITAS': 3,
+    'SERVER_TIMING': DEBUG,
+}
+
+# Métricas no formato do Prometheus em /metricas/ (app_medpass/metricas.py):
+# limites (s) dos histogramas de latência e de SQL, e a cada quantos segundos o
+# tamanho das filas, mantido pelos eventos, é recontado no banco.
+MEDPASS_METRICAS = {
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'RECONTAGEM': 5 * 60,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -155,6 +219,44 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# Barramento de eventos das senhas (app_medpass/eventos.py)
+# 'local': memória do processo (um worker); 'banco': tabela compartilhada entre workers
+MEDPASS_BARRAMENTO = {
+    'BACKEND': 'local',
+    'CAPACIDADE': 1000,
+    'INTERVALO_POLLING': 0.5,
+    'VALIDADE': 5,
+    'ESPERA_LACUNA': 2.0,
+}
+# Com vários workers o 'local' deixaria cada um só com os próprios eventos
+# (eventos.obter_barramento recusa essa combinação)
+if MEDPASS_PERFIL_BANCO == 'producao':
+    MEDPASS_BARRAMENTO['BACKEND'] = 'banco'
+
+# Bônus de cada tipo de senha na fila, em segundos (app_medpass/filas.py).
+# Uma senha Normal que espera mais que o bônus passa à frente de uma recém-chegada.
+MEDPASS_PRIORIDADE = {
+    'U': 4 * 60 * 60,
+    'P': 30 * 60,
+    'N': 0,
+}
+
+# Arquivamento das senhas finalizadas de dias anteriores (app_medpass/arquivamento.py).
+# AO_VIRAR_O_DIA: arquiva em segundo plano quando a primeira senha do dia é emitida;
+# desligado, use o comando `arquivar_senhas` (ex.: cron de madrugada).
+MEDPASS_ARQUIVAMENTO = {
+    'AO_VIRAR_O_DIA': False,
+    'LOTE': 1000,
+}
+
+# Estimativas de espera ao vivo (app_medpass/estimativas.py), em segundos:
+# janela considerada, número de fatias da janela e intervalo entre cópias no banco.
+MEDPASS_ESTIMATIVAS = {
+    'JANELA': 60 * 60,
+    'FATIAS': 6,
+    'INTERVALO_SNAPSHOT': 60,
+}
+
 # URL de Login
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'
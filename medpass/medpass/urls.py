@@ -24,19 +24,23 @@ urlpatterns = [
     path('guiche/', views.painel_guiche, name='painel_guiche'),
     path('selecionar-guiche/', views.selecionar_guiche, name='selecionar_guiche'),
     path('guiche/chamar/<int:senha_id>/', views.guiche_chamar_senha, name='guiche_chamar_senha'),
+    path('guiche/chamar-proxima/', views.guiche_chamar_proxima, name='guiche_chamar_proxima'),
     path('guiche/rechamar/<int:senha_id>/', views.guiche_rechamar_senha, name='guiche_rechamar_senha'),
     path('guiche/iniciar-triagem/<int:senha_id>/', views.guiche_iniciar_triagem, name='guiche_iniciar_triagem'),
     path('guiche/finalizar-triagem/<int:senha_id>/', views.guiche_finalizar_triagem, name='guiche_finalizar_triagem'),
     path('guiche/cancelar/<int:senha_id>/', views.guiche_cancelar_senha, name='guiche_cancelar_senha'),
+    path('guiche/fragmentos/', views.guiche_fragmentos, name='guiche_fragmentos'),
     
     # Médico
     path('medico/', views.painel_medico, name='painel_medico'),
     path('selecionar-medico/', views.selecionar_medico, name='selecionar_medico'),
     path('medico/chamar/<int:senha_id>/', views.medico_chamar_senha, name='medico_chamar_senha'),
+    path('medico/chamar-proxima/', views.medico_chamar_proxima, name='medico_chamar_proxima'),
     path('medico/iniciar-consulta/<int:senha_id>/', views.medico_iniciar_consulta, name='medico_iniciar_consulta'),
     path('medico/finalizar-consulta/<int:senha_id>/', views.medico_finalizar_consulta, name='medico_finalizar_consulta'),
     path('medico/rechamar/<int:senha_id>/', views.medico_rechamar_senha, name='medico_rechamar_senha'),
     path('medico/desistencia/<int:senha_id>/', views.medico_desistencia_senha, name='medico_desistencia_senha'),
+    path('medico/fragmentos/', views.medico_fragmentos, name='medico_fragmentos'),
     
     # Cadastros
     path('cadastrar-medicos/', views.cadastrar_medicos, name='cadastrar_medicos'),
@@ -51,4 +55,13 @@ urlpatterns = [
     # APIs internas
     path('api/senhas-aguardando/', views.api_senhas_aguardando, name='api_senhas_aguardando'),
     path('api/senha-chamando/', views.api_senha_chamando, name='api_senha_chamando'),
+    path('api/senha-chamando/aguardar/', views.api_senha_chamando_aguardar, name='api_senha_chamando_aguardar'),
+    path('api/painel/', views.api_painel, name='api_painel'),
+    path('api/estatisticas/', views.api_estatisticas, name='api_estatisticas'),
+    
+    # Tempo real (ASGI)
+    path('api/eventos/', views.eventos_senhas, name='eventos_senhas'),
+    
+    # Métricas (Prometheus: metrics_path: /metricas/)
+    path('metricas/', views.metricas, name='metricas'),
 ]